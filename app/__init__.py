@@ -16,6 +16,22 @@ from app.database import db
 from config import ProductionConfiguration
 from flask_migrate import Migrate
 from app.mail import mail
+from app.mail_queue import mail_queue
+from app.counters import download_counter
+from app.trending import trending
+from app.recommendations import recommendations
+from app.cache import response_cache
+from app.categories import category_registry
+from app.storage import pdf_store
+from app.thumbnails import thumbnails
+from app.instrumentation import request_stats
+from app.metrics import metrics
+from app.sessions import server_sessions
+from app.current_user import current_users
+from app.passwords import passwords
+from app.ratelimit import rate_limiter
+from app.search import search_index
+from app.related import related_worksheets
 ALLOWED_EXTENSIONS = set(['pdf'])
 
 migrate = Migrate()
@@ -27,7 +43,23 @@ def create_app(config_class=ProductionConfiguration):
 
     db.init_app(app)
     migrate.init_app(app, db)
+    server_sessions.init_app(app)
+    current_users.init_app(app)
+    passwords.init_app(app)
+    request_stats.init_app(app)
+    metrics.init_app(app)
     mail.init_app(app)
+    mail_queue.init_app(app)
+    download_counter.init_app(app)
+    trending.init_app(app)
+    recommendations.init_app(app)
+    response_cache.init_app(app)
+    category_registry.init_app(app)
+    pdf_store.init_app(app)
+    thumbnails.init_app(app)
+    rate_limiter.init_app(app)
+    search_index.init_app(app)
+    related_worksheets.init_app(app)
 
     from app import models
 
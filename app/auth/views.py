@@ -1,7 +1,8 @@
-from werkzeug.security import generate_password_hash, check_password_hash
 from flask import flash, redirect, render_template, url_for, request, session
 from . import auth
 from .forms import LoginForm
+from ..passwords import passwords
+from ..sessions import regenerate_session
 
 # The simple login logout solution was found at the following link:
 # https://pythonspot.com/login-authentication-with-flask/
@@ -37,11 +38,16 @@ def login():
     form = LoginForm()
     if form.validate_on_submit():
 
-        if check_password_hash(passwrd, form.password.data) and form.username.data == 'LLLRocks':
+        # checked once, a wrong password is reported before a wrong username
+        correct = passwords.check(passwrd, form.password.data)
+
+        if correct and form.username.data == 'LLLRocks':
+            # a new session id for the admin (see app/sessions.py)
+            regenerate_session()
             session['logged_in'] = True
 
             return redirect(url_for('other.home'))
-        elif not check_password_hash(passwrd, form.password.data) :
+        elif not correct :
             flash("password was incorrect")
             return redirect(request.url)
         elif not form.username.data == 'LLLRocks':
@@ -67,6 +73,7 @@ def login():
 @auth.route('/logout')
 def logout():
     if session.get('logged_in'):
+        regenerate_session()
         session['logged_in'] = False
 
     # redirect to the login page
@@ -3,7 +3,14 @@ from flask import render_template, session, redirect, url_for, request, current_
 from ..models import Author, Worksheet
 from .forms import AuthorForm, AuthorLoginForm
 from .. import db
-from werkzeug.security import check_password_hash, generate_password_hash
+from ..current_user import current_users, log_in, log_out
+from ..queries import worksheets_query, favourite_counts, author_stats
+from ..pagination import paginate
+from ..cache import response_cache
+from ..passwords import passwords
+
+# number of worksheets on each page of the author dashboard
+DASHBOARD_WORKSHEETS_PER_PAGE = 20
 
 #
 # AddAuthor
@@ -21,9 +28,10 @@ def add_author():
 
     if form.validate_on_submit():
         try:
-            new_author = Author(name=form.name.data, email=form.email.data, password=generate_password_hash(form.password.data))
+            new_author = Author(name=form.name.data, email=form.email.data, password=passwords.hash(form.password.data))
             db.session.add(new_author)
             db.session.commit()
+            response_cache.clear()
             return redirect(url_for('other.home'))
 
         except:
@@ -50,6 +58,7 @@ def delete_author(id):
         author = Author.query.get(id)
         db.session.delete(author)
         db.session.commit()
+        response_cache.clear()
 
         # redirect to the home page
         return redirect(url_for('other.home'))
@@ -82,9 +91,10 @@ def edit_author(id) :
         try :
             author.name = form.name.data
             author.email = form.email.data
-            author.password = generate_password_hash(form.password.data)
+            author.password = passwords.hash(form.password.data)
 
             db.session.commit()
+            response_cache.clear()
 
             # redirect to the home page
             return redirect(url_for('other.home'))
@@ -114,12 +124,14 @@ def author_login():
                 flash("Email does not exist")
 
                 return redirect(request.url)
-            elif check_password_hash(author.password, form.password.data):
-                session['author_logged_in'] = True
-                session['author_name'] = author.name
+            elif passwords.verify(author, form.password.data):
+                log_in('author', author)
+
+                # saves the password if it was hashed again
+                db.session.commit()
 
                 return redirect(url_for('author.author_dashboard', id=author.id))
-            elif not check_password_hash(author.password, form.password.data) :
+            else :
                 flash("password was incorrect")
                 return redirect(request.url)
         except :
@@ -138,8 +150,7 @@ def author_login():
 @author.route('/author_logout')
 def author_logout():
     if session.get('author_logged_in'):
-        session['author_logged_in'] = False
-        session['author_name'] = None
+        log_out('author')
 
     # redirect to the login page
     return redirect(url_for('other.home'))
@@ -155,12 +166,12 @@ def author_change_screenname(id):
         return redirect(url_for('other.home'))
 
     try :
-        author = Author.query.get(id)
+        author = current_users.author()
     except :
         db.session.rollback()
         raise
 
-    if not author.name == session.get('author_name') :
+    if author == None or not author.id == id :
         return redirect(url_for('other.home'))
 
     form = AuthorForm(obj=author)
@@ -170,6 +181,7 @@ def author_change_screenname(id):
             author.screenname = form.screenname.data
 
             db.session.commit()
+            response_cache.clear()
 
             # redirect to the home page
             return redirect(url_for('author.author_dashboard', id=author.id))
@@ -192,12 +204,12 @@ def author_change_email(id):
         return redirect(url_for('other.home'))
 
     try :
-        author = Author.query.get(id)
+        author = current_users.author()
     except :
         db.session.rollback()
         raise
 
-    if not author.name == session.get('author_name') :
+    if author == None or not author.id == id :
         return redirect(url_for('other.home'))
 
     form = AuthorForm(obj=author)
@@ -207,6 +219,7 @@ def author_change_email(id):
             author.email = form.email.data
 
             db.session.commit()
+            response_cache.clear()
 
             # redirect to the author dashboard
             return redirect(url_for('author.author_dashboard', id=author.id))
@@ -229,12 +242,12 @@ def author_change_about(id):
         return redirect(url_for('other.home'))
 
     try :
-        author = Author.query.get(id)
+        author = current_users.author()
     except :
         db.session.rollback()
         raise
 
-    if not author.name == session.get('author_name') :
+    if author == None or not author.id == id :
         return redirect(url_for('other.home'))
 
     form = AuthorForm(obj=author)
@@ -244,6 +257,7 @@ def author_change_about(id):
             author.about = form.about.data
 
             db.session.commit()
+            response_cache.clear()
 
             # redirect to the author dashboard
             return redirect(url_for('author.author_dashboard', id=author.id))
@@ -267,19 +281,19 @@ def author_change_password(id):
         return redirect(url_for('other.home'))
 
     try :
-        author = Author.query.get(id)
+        author = current_users.author()
     except :
         db.session.rollback()
         raise
 
-    if not author.name == session.get('author_name') :
+    if author == None or not author.id == id :
         return redirect(url_for('other.home'))
 
     form = AuthorForm(obj=author)
 
     if form.validate_on_submit():
         try :
-            author.password = generate_password_hash(form.password.data)
+            author.password = passwords.hash(form.password.data)
 
             db.session.commit()
 
@@ -296,24 +310,33 @@ def author_change_password(id):
 # Author Dashboard
 # Purpose: A place for an author to see all the different options with their account
 #
+# Method:
+#     the worksheets are paged like the worksheets page (see app/pagination.py)
+#     with how many learners like each one. The totals panel is added up by the
+#     database (see queries.author_stats).
+#
 @author.route('/author_dashboard/<int:id>', methods=['GET', 'POST'])
 @author.route('/author_dashboard', defaults={'id': 0}, methods=['GET', 'POST'])
 def author_dashboard(id):
     try :
         if not session.get('author_logged_in') :
             return redirect(url_for('other.home'))
-        if not id == 0:
-            author = Author.query.get(id)
-        else :
-            author = Author.query.filter_by(name=session.get('author_name')).first()
+        author = current_users.author()
 
-        if not author.name == session.get('author_name'):
+        # authors can only see their own dashboard
+        if author == None or not id in (0, author.id) :
             return redirect(url_for('other.home'))
 
-        worksheets = Worksheet.query.filter_by(author_id=author.id).order_by(Worksheet.id.desc()).all()
+        worksheets = paginate(worksheets_query().filter_by(author_id=author.id), Worksheet.id, DASHBOARD_WORKSHEETS_PER_PAGE,
+            after=request.args.get('after', type=int), before=request.args.get('before', type=int))
+        favourites = favourite_counts(worksheets.items)
+        stats = author_stats(author.id)
     except :
         db.session.rollback()
         raise
 
+    prev_url = worksheets.prev_url('author.author_dashboard', id=author.id)
+    next_url = worksheets.next_url('author.author_dashboard', id=author.id)
 
-    return render_template('author_templates/author_dashboard.html.j2', id=author.id, worksheets=worksheets)
+    return render_template('author_templates/author_dashboard.html.j2', id=author.id, worksheets=worksheets.items,
+        favourites=favourites, stats=stats, next_url=next_url, prev_url=prev_url)
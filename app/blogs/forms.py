@@ -2,13 +2,15 @@ from flask_wtf import FlaskForm
 from wtforms import StringField, SubmitField, TextAreaField
 from wtforms.validators import DataRequired
 from wtforms.ext.sqlalchemy.fields import QuerySelectField
-from ..models import PostCategory
+from ..categories import category_registry
 
 #
 # This function is designed to obtain choices for the categories in the PostForm.
+#   The categories come from the category registry so the table is not read
+#   every time a form is shown or checked.
 #
 def category_choices() :
-    return PostCategory.query
+    return category_registry.post_categories()
 
 
 
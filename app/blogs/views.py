@@ -3,6 +3,12 @@ from flask import render_template, session, redirect, url_for, current_app, requ
 from ..models import Post, PostCategory
 from .forms import PostForm, PostCategoryForm
 from .. import db
+from ..pagination import paginate
+from ..cache import response_cache
+from ..categories import category_registry
+
+# number of posts shown on each page of the blog
+POSTS_PER_PAGE = 5
 
 #
 # Blog
@@ -21,15 +27,21 @@ from .. import db
 #
 #       page: the page number that is being requested. First page is 'page=0' and
 #           the second page is 'page=1'. Each page will show 5 blog posts and the posts
-#           will be in descending order (first posted to last posted)
+#           will be in descending order (first posted to last posted). Only kept so
+#           old links keep working, it is mapped onto a cursor.
+#
+#       after/before: the cursors used for pagination (see app/pagination.py)
 #
 @blogs.route('/blog/<int:page>', methods=['GET', 'POST'])
 @blogs.route('/blog', defaults={'page' : 0}, methods=['GET', 'POST'])
+@response_cache.cached
 def blog(page) :
     try :
-        categories = PostCategory.query.all()
+        categories = category_registry.post_categories()
         post = request.args.get('post')
         category = request.args.get('category')
+        after = request.args.get('after', type=int)
+        before = request.args.get('before', type=int)
     except:
         db.session.rollback()
         return redirect(url_for('other.home'))
@@ -49,43 +61,30 @@ def blog(page) :
     elif not category == None :
         try :
             # if a specific category has been selected this if statement will be ran
-            posts = Post.query.filter_by(category_id=category).order_by(Post.id.desc()).offset(page * 5).limit(5).all()
-
-            more = Post.query.filter_by(category_id=category).offset((page + 1) * 5).first()
+            posts = paginate(Post.query.filter_by(category_id=category), Post.id, POSTS_PER_PAGE,
+                after=after, before=before, page=page)
         except:
             db.session.rollback()
             return redirect(url_for('other.home'))
 
-        prev_url = None
-        next_url = None
-        if not page == 0 :
-            prev_url = url_for('blogs.blog', category=category, page=page - 1, post=None)
-
-        if not more == None :
-            next_url = url_for('blogs.blog', post=None, category=category, page=page + 1)
+        prev_url = posts.prev_url('blogs.blog', category=category, post=None)
+        next_url = posts.next_url('blogs.blog', post=None, category=category)
 
-
-        return render_template('blog_templates/blog.html.j2', posts=posts, categories=categories, next_url=next_url, prev_url=prev_url)
+        return render_template('blog_templates/blog.html.j2', posts=posts.items, categories=categories, next_url=next_url, prev_url=prev_url)
 
     else :
         try :
             # if a no specific post or category has been selected this if statement will be ran
-            posts = Post.query.order_by(Post.id.desc()).offset(page * 5).limit(5).all()
-
-            more = Post.query.offset((page + 1) * 5).first()
+            posts = paginate(Post.query, Post.id, POSTS_PER_PAGE,
+                after=after, before=before, page=page)
         except:
             db.session.rollback()
             return redirect(url_for('other.home'))
 
-        prev_url = None
-        next_url = None
-        if not page == 0 :
-            prev_url = url_for('blogs.blog', category=category, page=page - 1, post=None)
-
-        if not more == None :
-            next_url = url_for('blogs.blog', post=None, category=category, page=page + 1)
+        prev_url = posts.prev_url('blogs.blog', category=category, post=None)
+        next_url = posts.next_url('blogs.blog', post=None, category=category)
 
-        return render_template('blog_templates/blog.html.j2', posts=posts, categories=categories, next_url=next_url, prev_url=prev_url)
+        return render_template('blog_templates/blog.html.j2', posts=posts.items, categories=categories, next_url=next_url, prev_url=prev_url)
 
 
 
@@ -113,6 +112,7 @@ def add_post():
             new_post = Post(name=form.title.data, content=form.content.data, category_id=form.category.data.id, category=form.category.data)
             db.session.add(new_post)
             db.session.commit()
+            response_cache.clear()
             return redirect(url_for('other.home'))
         except:
             db.session.rollback()
@@ -148,6 +148,7 @@ def edit_post(id):
             post.category = form.category.data
 
             db.session.commit()
+            response_cache.clear()
 
             # redirect to the home page
             return redirect(url_for('other.home'))
@@ -179,6 +180,7 @@ def delete_post(id):
         post = Post.query.get(id)
         db.session.delete(post)
         db.session.commit()
+        response_cache.clear()
 
         # redirect to the home page
         return redirect(url_for('other.home'))
@@ -207,6 +209,7 @@ def add_blog_category():
             new_category = PostCategory(name=form.name.data)
             db.session.add(new_category)
             db.session.commit()
+            response_cache.clear()
 
             return redirect(url_for('other.home'))
         except:
@@ -238,6 +241,7 @@ def edit_blog_category(id) :
             category.name = form.name.data
 
             db.session.commit()
+            response_cache.clear()
 
             # redirect to the home page
             return redirect(url_for('other.home'))
@@ -266,6 +270,7 @@ def delete_blog_category(id):
         category = PostCategory.query.get(id)
         db.session.delete(category)
         db.session.commit()
+        response_cache.clear()
 
         # redirect to the home page
         return redirect(url_for('other.home'))
@@ -0,0 +1,243 @@
+#
+# Response Cache
+#   Anonymous visitors to the listing pages all get the same html, so instead of
+#   querying the database and rendering the templates every time the finished
+#   response is kept and handed out again until it expires or something the page
+#   shows is changed.
+#
+#   Responses are keyed on the path and query string. Anyone logged in (admin,
+#   author or learner) skips the cache because their pages are different.
+#
+#   Backends (RESPONSE_CACHE_TYPE):
+#       'simple': an LRU dictionary in each worker (the default). Clearing it only
+#           clears the worker that made the change so the others can be stale
+#           for up to RESPONSE_CACHE_TTL seconds.
+#       'filesystem': pickled files in RESPONSE_CACHE_DIR, shared by every worker
+#           on the machine
+#       'redis': any Redis compatible client. RESPONSE_CACHE_REDIS_CLIENT can be
+#           set to a client object (or a stand in with get, setex, delete and
+#           scan_iter), otherwise one is made from RESPONSE_CACHE_REDIS_URL with
+#           the redis package
+#       'null': nothing is cached (used by the tests)
+#
+#   Works like the other extensions (see app/mail.py):
+#       response_cache = ResponseCache()
+#       response_cache.init_app(app)
+#
+#   Views are cached with @response_cache.cached and the views that change what
+#   they show call response_cache.clear()
+#
+import hashlib
+import os
+import pickle
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+
+from flask import current_app, request, session, make_response
+
+# session values that mean the visitor is logged in
+LOGGED_IN_KEYS = ('logged_in', 'author_logged_in', 'learner_logged_in')
+
+# headers that are not kept with a response, the length is worked out again and
+# a cookie is never handed to another visitor
+UNCACHED_HEADERS = ('content-length', 'set-cookie', 'x-cache')
+
+
+class NullCache(object) :
+    """
+    A cache that never keeps anything
+    """
+
+    def get(self, key):
+        return None
+
+    def set(self, key, value, ttl):
+        pass
+
+    def clear(self):
+        pass
+
+
+class LRUCache(object) :
+    """
+    Keeps the most recently used entries of one worker in memory
+    """
+
+    def __init__(self, size=500):
+        self.size = size
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock :
+            entry = self.entries.get(key)
+            if entry == None :
+                return None
+
+            expires, value = entry
+            if expires < time.time() :
+                del self.entries[key]
+                return None
+
+            self.entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl):
+        with self.lock :
+            self.entries[key] = (time.time() + ttl, value)
+            self.entries.move_to_end(key)
+
+            while len(self.entries) > self.size :
+                self.entries.popitem(last=False)
+
+    def clear(self):
+        with self.lock :
+            self.entries.clear()
+
+
+class FileSystemCache(object) :
+    """
+    Keeps entries as files so every worker on the machine shares them
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def path(self, key):
+        return os.path.join(self.directory, hashlib.sha1(key.encode('utf-8')).hexdigest() + '.cache')
+
+    def get(self, key):
+        try :
+            with open(self.path(key), 'rb') as f :
+                expires, value = pickle.load(f)
+        except (OSError, EOFError, pickle.UnpicklingError) :
+            return None
+
+        if expires < time.time() :
+            return None
+
+        return value
+
+    def set(self, key, value, ttl):
+        # write to a temporary file first so no one reads half an entry
+        path = self.path(key)
+        temp = path + '.' + str(os.getpid()) + '.' + str(threading.get_ident())
+        with open(temp, 'wb') as f :
+            pickle.dump((time.time() + ttl, value), f)
+        os.replace(temp, path)
+
+    def clear(self):
+        for name in os.listdir(self.directory) :
+            if name.endswith('.cache') :
+                try :
+                    os.remove(os.path.join(self.directory, name))
+                except OSError :
+                    pass
+
+
+class RedisCache(object) :
+    """
+    Keeps entries in Redis (or anything that talks like it)
+    """
+
+    def __init__(self, client, prefix='lll-response:'):
+        self.client = client
+        self.prefix = prefix
+
+    def get(self, key):
+        value = self.client.get(self.prefix + key)
+        if value == None :
+            return None
+
+        return pickle.loads(value)
+
+    def set(self, key, value, ttl):
+        self.client.setex(self.prefix + key, int(max(ttl, 1)), pickle.dumps(value))
+
+    def clear(self):
+        for key in self.client.scan_iter(self.prefix + '*') :
+            self.client.delete(key)
+
+
+def make_backend(app):
+    cache_type = app.config['RESPONSE_CACHE_TYPE']
+
+    if cache_type == 'simple' :
+        return LRUCache(app.config['RESPONSE_CACHE_SIZE'])
+    elif cache_type == 'filesystem' :
+        return FileSystemCache(app.config['RESPONSE_CACHE_DIR'])
+    elif cache_type == 'redis' :
+        client = app.config.get('RESPONSE_CACHE_REDIS_CLIENT')
+        if client == None :
+            import redis
+            client = redis.Redis.from_url(app.config['RESPONSE_CACHE_REDIS_URL'])
+        return RedisCache(client)
+    elif cache_type == 'null' :
+        return NullCache()
+
+    raise ValueError('Unknown RESPONSE_CACHE_TYPE %r' % cache_type)
+
+
+class ResponseCache(object) :
+    """
+    Caches whole responses of pages that look the same to every visitor
+    """
+
+    def __init__(self, app=None):
+        if not app == None :
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('RESPONSE_CACHE_TYPE', 'simple')
+        app.config.setdefault('RESPONSE_CACHE_TTL', 60)
+        app.config.setdefault('RESPONSE_CACHE_SIZE', 500)
+        app.config.setdefault('RESPONSE_CACHE_DIR', os.path.join(app.instance_path, 'response_cache'))
+        app.config.setdefault('RESPONSE_CACHE_REDIS_URL', 'redis://localhost:6379/0')
+
+        app.extensions['response_cache'] = make_backend(app)
+
+    @property
+    def backend(self):
+        return current_app.extensions['response_cache']
+
+    def clear(self):
+        self.backend.clear()
+
+    #
+    # cached
+    #   Decorator for views that can be cached. Only GET requests from visitors
+    #   who are not logged in are cached and only successful responses are kept,
+    #   with the headers the view set.
+    #
+    def cached(self, view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            if not request.method == 'GET' or any(session.get(key) for key in LOGGED_IN_KEYS) :
+                return view(*args, **kwargs)
+
+            key = request.full_path
+            entry = self.backend.get(key)
+            # entries kept before the headers were have the mimetype in their
+            # place and are left to expire
+            if not entry == None and isinstance(entry[2], list) :
+                data, status, headers = entry
+                response = current_app.response_class(data, status=status, headers=headers)
+                response.headers['X-Cache'] = 'HIT'
+                return response
+
+            response = make_response(view(*args, **kwargs))
+            if response.status_code == 200 and not response.direct_passthrough :
+                headers = [(name, value) for name, value in response.headers if not name.lower() in UNCACHED_HEADERS]
+                self.backend.set(key, (response.get_data(), response.status_code, headers),
+                    current_app.config['RESPONSE_CACHE_TTL'])
+            response.headers['X-Cache'] = 'MISS'
+
+            return response
+
+        return wrapper
+
+
+response_cache = ResponseCache()
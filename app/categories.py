@@ -0,0 +1,152 @@
+#
+# Category Registry
+#   The worksheet and blog categories are on almost every page and in every
+#   worksheet and post form but they hardly ever change. Each worker keeps both
+#   tables in memory and only reads them again when they change.
+#
+#   Whenever a flush adds, edits or deletes a category the 'categories' row of
+#   the versions table is bumped in the same transaction. The worker that made
+#   the change reloads after the commit and the other workers notice the new
+#   version the next time they check (at most every
+#   CATEGORY_REGISTRY_CHECK_INTERVAL seconds, 0 checks on every use).
+#
+#   The categories handed out are merged into the current session without a
+#   query so they can be used like any other model instance.
+#
+#   Works like the other extensions (see app/mail.py):
+#       category_registry = CategoryRegistry()
+#       category_registry.init_app(app)
+#
+import threading
+import time
+
+from flask import current_app, has_app_context
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from .database import db
+from .models import PostCategory, WorksheetCategory, Version
+
+# name of the row in the versions table
+CATEGORIES = 'categories'
+
+
+#
+# LoadedCategories
+#   The categories one app has in memory and the version they came from
+#
+class LoadedCategories(object) :
+    """
+    The categories a worker has in memory
+    """
+
+    def __init__(self, interval):
+        self.interval = interval
+        self.version = None
+        self.checked = 0
+        self.worksheet_categories = []
+        self.post_categories = []
+        self.lock = threading.Lock()
+
+    def stale(self):
+        self.checked = 0
+        self.version = None
+
+    #
+    # current
+    #   Reads the version (if it is time to check) and reloads the categories if
+    #   it has changed.
+    #
+    def current(self):
+        if self.version == None or time.time() - self.checked >= self.interval :
+            with self.lock :
+                version = db.session.query(Version.version).filter_by(name=CATEGORIES).scalar() or 0
+
+                if not version == self.version :
+                    self.load(version)
+
+                self.checked = time.time()
+
+        return self
+
+    def load(self, version):
+        session = Session(bind=db.engine)
+        try :
+            self.worksheet_categories = session.query(WorksheetCategory).order_by(WorksheetCategory.id).all()
+            self.post_categories = session.query(PostCategory).order_by(PostCategory.id).all()
+            session.expunge_all()
+        finally :
+            session.close()
+
+        self.version = version
+
+
+#
+# bump_version
+#   Runs before every flush. If a category is being added, edited or deleted the
+#   version goes up as part of the same transaction.
+#
+def bump_version(session, flush_context, instances):
+    changed = list(session.new) + list(session.dirty) + list(session.deleted)
+    if not any(isinstance(obj, (WorksheetCategory, PostCategory)) for obj in changed) :
+        return
+
+    updated = session.execute(Version.__table__.update().where(Version.name == CATEGORIES).values(version=Version.version + 1))
+    if updated.rowcount == 0 :
+        session.execute(Version.__table__.insert().values(name=CATEGORIES, version=1))
+
+    session.info['categories_changed'] = True
+
+def reload_after_commit(session):
+    if session.info.pop('categories_changed', False) and has_app_context() :
+        loaded = current_app.extensions.get('category_registry')
+        if not loaded == None :
+            loaded.stale()
+
+def forget_after_rollback(session):
+    session.info.pop('categories_changed', None)
+
+
+class CategoryRegistry(object) :
+    """
+    Keeps the worksheet and post categories in memory
+    """
+
+    def __init__(self, app=None):
+        if not app == None :
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('CATEGORY_REGISTRY_CHECK_INTERVAL', 5)
+        app.extensions['category_registry'] = LoadedCategories(app.config['CATEGORY_REGISTRY_CHECK_INTERVAL'])
+
+        if not event.contains(db.session, 'before_flush', bump_version) :
+            event.listen(db.session, 'before_flush', bump_version)
+            event.listen(db.session, 'after_commit', reload_after_commit)
+            event.listen(db.session, 'after_rollback', forget_after_rollback)
+
+    def loaded(self):
+        return current_app.extensions['category_registry'].current()
+
+    def worksheet_categories(self):
+        return [db.session.merge(category, load=False) for category in self.loaded().worksheet_categories]
+
+    def post_categories(self):
+        return [db.session.merge(category, load=False) for category in self.loaded().post_categories]
+
+    def worksheet_category(self, id):
+        for category in self.loaded().worksheet_categories :
+            if category.id == id :
+                return db.session.merge(category, load=False)
+
+        return None
+
+    def post_category(self, id):
+        for category in self.loaded().post_categories :
+            if category.id == id :
+                return db.session.merge(category, load=False)
+
+        return None
+
+
+category_registry = CategoryRegistry()
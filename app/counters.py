@@ -0,0 +1,151 @@
+#
+# Download Counter
+#   Viewing a worksheet used to load the worksheet, add one to its count and
+#   commit, so every click waited on a write and two workers clicking at the same
+#   time could lose a view. Now each worker keeps the views it has seen in memory
+#   and a background thread writes them every DOWNLOAD_COUNT_FLUSH_INTERVAL
+#   seconds with
+#
+#       UPDATE worksheets SET count = count + :n WHERE id = :id
+#
+#   which the database applies atomically no matter how many workers run it.
+#   A flush interval of 0 writes every view straight away (used by the tests).
+#
+#   The same transaction records the views for the trending scores (see
+#   app/trending.py), which are worked out again after it when it is time.
+#
+#   Works like the other extensions (see app/mail.py):
+#       download_counter = DownloadCounter()
+#       download_counter.init_app(app)
+#
+import atexit
+import logging
+import threading
+import time
+from collections import Counter
+
+from flask import current_app
+from sqlalchemy import bindparam
+
+from .database import db
+from .models import Worksheet
+from .trending import trending
+
+log = logging.getLogger(__name__)
+
+
+#
+# PendingCounts
+#   The views that have not been written yet for one app
+#
+class PendingCounts(object) :
+    """
+    Views of each worksheet waiting to be written to the database
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self.interval = app.config['DOWNLOAD_COUNT_FLUSH_INTERVAL']
+        self.counts = Counter()
+        self.lock = threading.Lock()
+        self.flushing = threading.Lock()
+        self.thread = None
+
+    def add(self, worksheet_id, amount=1):
+        with self.lock :
+            self.counts[worksheet_id] += amount
+
+        if self.interval <= 0 :
+            self.flush()
+        elif self.thread == None :
+            self.start()
+
+    def pending(self, worksheet_id):
+        with self.lock :
+            return self.counts[worksheet_id]
+
+    #
+    # flush
+    #   Writes all of the waiting views in one transaction. If the write fails the
+    #   views are put back so they get written next time instead of being lost.
+    #   Returns the number of views written.
+    #
+    def flush(self):
+        # only one flush at a time so that when flush returns every view added
+        # before it was called is in the database
+        with self.flushing :
+            with self.lock :
+                batch = self.counts
+                self.counts = Counter()
+
+            batch = {worksheet_id : n for worksheet_id, n in batch.items() if n}
+            if not batch :
+                return 0
+
+            statement = Worksheet.__table__.update().where(Worksheet.id == bindparam('worksheet_id')).values(
+                count=Worksheet.count + bindparam('n'))
+
+            try :
+                # the engine is used directly, pushing an app context here would
+                # remove the session of the request that called flush
+                with db.get_engine(self.app).begin() as connection :
+                    connection.execute(statement, [{'worksheet_id' : worksheet_id, 'n' : n} for worksheet_id, n in batch.items()])
+                    trending.state_of(self.app).record(connection, batch, 'view')
+            except :
+                with self.lock :
+                    self.counts.update(batch)
+                raise
+
+            try :
+                trending.state_of(self.app).recompute_if_due()
+            except Exception :
+                # the views are written, the scores can be worked out next time
+                log.exception('Could not recompute the trending scores')
+
+            return sum(batch.values())
+
+    def start(self):
+        with self.lock :
+            if not self.thread == None :
+                return
+
+            self.thread = threading.Thread(target=self.run, name='download-counter', daemon=True)
+            self.thread.start()
+
+        # write what is left when the worker shuts down
+        atexit.register(self.flush)
+
+    def run(self):
+        while True :
+            time.sleep(self.interval)
+
+            try :
+                self.flush()
+            except Exception :
+                log.exception('Could not write worksheet view counts')
+
+
+class DownloadCounter(object) :
+    """
+    Buffers worksheet views and writes them to the database in batches
+    """
+
+    def __init__(self, app=None):
+        if not app == None :
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('DOWNLOAD_COUNT_FLUSH_INTERVAL', 10)
+        app.extensions['download_counter'] = PendingCounts(app)
+
+    def increment(self, worksheet_id, amount=1):
+        current_app.extensions['download_counter'].add(worksheet_id, amount)
+
+    def pending(self, worksheet_id):
+        return current_app.extensions['download_counter'].pending(worksheet_id)
+
+    def flush(self):
+        return current_app.extensions['download_counter'].flush()
+
+
+download_counter = DownloadCounter()
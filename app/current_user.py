@@ -0,0 +1,97 @@
+#
+# Current User
+#   The learner and author who are logged in. Logging in keeps their id in the
+#   session (learner_id / author_id) and the first view or template that asks
+#   for them loads them by primary key, once per request, into g.learner and
+#   g.author:
+#
+#       learner = current_users.learner()
+#       if learner == None :
+#           return redirect(url_for('other.home'))
+#
+#   Views used to find them with filter_by(name=session['learner_name']), name
+#   is not indexed and changes when the admin renames someone. Sessions from
+#   before the ids were kept are looked up by name one last time.
+#
+#   Works like the other extensions (see app/mail.py):
+#       current_users = CurrentUsers()
+#       current_users.init_app(app)
+#
+from flask import g, session
+
+from .models import Learner, Author
+from .sessions import regenerate_session
+
+
+#
+# load_user
+#   kind is 'learner' or 'author', the prefix of the session keys
+#
+def load_user(model, kind):
+    if not session.get(kind + '_logged_in') :
+        return None
+
+    id = session.get(kind + '_id')
+    if id == None :
+        name = session.get(kind + '_name')
+        if name == None :
+            return None
+
+        user = model.query.filter_by(name=name).first()
+        if not user == None :
+            session[kind + '_id'] = user.id
+        return user
+
+    return model.query.get(id)
+
+
+#
+# log_in / log_out
+#   What the login and logout views keep in the session. Both give the session
+#   a new id (see app/sessions.py).
+#
+def log_in(kind, user):
+    regenerate_session()
+    session[kind + '_logged_in'] = True
+    session[kind + '_name'] = user.name
+    session[kind + '_id'] = user.id
+    g.pop(kind, None)
+
+def log_out(kind):
+    regenerate_session()
+    session[kind + '_logged_in'] = False
+    session[kind + '_name'] = None
+    session.pop(kind + '_id', None)
+    g.pop(kind, None)
+
+
+class CurrentUsers(object) :
+    """
+    Loads the logged in learner and author at most once per request
+    """
+
+    def __init__(self, app=None):
+        if not app == None :
+            self.init_app(app)
+
+    def init_app(self, app):
+        # g outlives the request when the app context was pushed by someone else
+        # (the tests do this) so the users are dropped at the end of each request
+        app.teardown_request(self.forget)
+
+    def forget(self, exception=None):
+        g.pop('learner', None)
+        g.pop('author', None)
+
+    def learner(self):
+        if not 'learner' in g :
+            g.learner = load_user(Learner, 'learner')
+        return g.learner
+
+    def author(self):
+        if not 'author' in g :
+            g.author = load_user(Author, 'author')
+        return g.author
+
+
+current_users = CurrentUsers()
@@ -0,0 +1,141 @@
+#
+# PDF Delivery
+#   Sending a large pdf through Flask ties up one of the uWSGI workers for as
+#   long as the download takes. When the site sits behind nginx (or Apache) the
+#   worker can instead answer with a header telling the front end server which
+#   file to send and move on to the next request.
+#
+#   PDF_DELIVERY:
+#       'accel': X-Accel-Redirect for nginx. PDF_ACCEL_PREFIX has to be an
+#           internal location pointing at UPLOAD_FOLDER, for example
+#
+#               location /protected_uploads/ {
+#                   internal;
+#                   alias /path/to/lifeLongLearning/app/static/;
+#               }
+#
+#       'sendfile': X-Sendfile for Apache mod_xsendfile or lighttpd
+#       'flask': Flask streams the file itself and answers Range requests (the
+#           default, used when running without a front end server)
+#
+#   Only pdfs and their thumbnails (see app/thumbnails.py) inside UPLOAD_FOLDER
+#   are ever sent.
+#
+#   Every file gets a strong ETag made from the sha256 of its contents, so PDF
+#   viewers can revalidate with If-None-Match and resume with If-Range. Urls
+#   that carry the hash (?v=<sha256>) never change what they point at and are
+#   cached for a year as immutable. Anything else has to be revalidated.
+#
+import hashlib
+import os
+import threading
+
+from flask import current_app, abort, send_file, safe_join, request
+from werkzeug.exceptions import NotFound, RequestedRangeNotSatisfiable
+
+# the kinds of files that can be sent and their mimetypes
+DELIVERABLE_EXTENSIONS = {
+    'pdf' : 'application/pdf',
+    'png' : 'image/png',
+}
+
+
+#
+# upload_path
+#   The full path of an uploaded file. Aborts with 404 if the name tries to leave
+#   UPLOAD_FOLDER, is not a pdf or thumbnail or does not exist.
+#
+def upload_path(filename):
+    if not filename or not filename.rsplit('.', 1)[-1].lower() in DELIVERABLE_EXTENSIONS :
+        abort(404)
+
+    try :
+        path = safe_join(current_app.config['UPLOAD_FOLDER'], filename)
+    except NotFound :
+        abort(404)
+
+    if not os.path.isfile(path) :
+        abort(404)
+
+    return path
+
+
+# how long a content addressed url can be cached (a year)
+IMMUTABLE_MAX_AGE = 365 * 24 * 60 * 60
+
+# sha256 of each file this worker has sent, keyed on path with the mtime and
+# size it had so a replaced file is hashed again
+_hashes = {}
+_hashes_lock = threading.Lock()
+
+
+#
+# content_hash
+#   The sha256 (hex) of a file. Only read again when the file changes.
+#
+def content_hash(path):
+    stat = os.stat(path)
+    with _hashes_lock :
+        known = _hashes.get(path)
+    if not known == None and known[0] == stat.st_mtime and known[1] == stat.st_size :
+        return known[2]
+
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f :
+        for chunk in iter(lambda: f.read(64 * 1024), b'') :
+            digest.update(chunk)
+
+    with _hashes_lock :
+        _hashes[path] = (stat.st_mtime, stat.st_size, digest.hexdigest())
+
+    return digest.hexdigest()
+
+
+#
+# send_upload
+#   Sends an uploaded file the way PDF_DELIVERY says to. If version is the hash
+#   of the file the response is cached as immutable. Files from the pdf store
+#   (app/storage.py) already know their hash and can pass it as etag.
+#
+def send_upload(filename, version=None, etag=None):
+    path = upload_path(filename)
+    mimetype = DELIVERABLE_EXTENSIONS[filename.rsplit('.', 1)[-1].lower()]
+    if etag == None :
+        etag = content_hash(path)
+    mode = current_app.config['PDF_DELIVERY']
+
+    if mode == 'accel' :
+        response = current_app.response_class(mimetype=mimetype)
+        response.headers['X-Accel-Redirect'] = current_app.config['PDF_ACCEL_PREFIX'].rstrip('/') + '/' + filename
+        response.last_modified = os.path.getmtime(path)
+    elif mode == 'sendfile' :
+        response = current_app.response_class(mimetype=mimetype)
+        response.headers['X-Sendfile'] = path
+        response.last_modified = os.path.getmtime(path)
+    else :
+        response = send_file(path, mimetype=mimetype, add_etags=False, cache_timeout=0)
+
+    response.set_etag(etag)
+    response.cache_control.public = True
+    if not version == None and version == etag :
+        response.cache_control.max_age = IMMUTABLE_MAX_AGE
+        response.cache_control.immutable = True
+        response.expires = None
+    else :
+        response.cache_control.no_cache = True
+        response.cache_control.max_age = None
+        response.expires = None
+
+    if mode == 'accel' or mode == 'sendfile' :
+        # the front end server answers Range requests itself
+        response = response.make_conditional(request)
+        if response.status_code == 304 :
+            response.headers.pop('X-Accel-Redirect', None)
+            response.headers.pop('X-Sendfile', None)
+        return response
+
+    try :
+        return response.make_conditional(request, accept_ranges=True, complete_length=os.path.getsize(path))
+    except RequestedRangeNotSatisfiable :
+        response.close()
+        raise
@@ -0,0 +1,199 @@
+#
+# Request Instrumentation
+#   Counts the SQL statements each request runs and times them, the password
+#   hashing (see app/passwords.py), the template rendering and the whole request.
+#
+#   With SERVER_TIMING on (it follows DEBUG unless set) every response gets a
+#   Server-Timing header that shows up in the browser's developer tools:
+#
+#       Server-Timing: db;dur=3.1;desc="7 queries", render;dur=12.0, total;dur=18.4
+#
+#   Requests that hash a password (the logins) also get hash;dur=...
+#
+#   Requests slower than SLOW_REQUEST_SECONDS or running more than
+#   SLOW_REQUEST_QUERIES statements are logged as warnings.
+#
+#   Totals for each endpoint are kept in memory (see RequestStats.endpoints).
+#
+#   Works like the other extensions (see app/mail.py):
+#       request_stats = RequestStats()
+#       request_stats.init_app(app)
+#
+import logging
+import threading
+import time
+
+from flask import current_app, g, has_request_context, request, before_render_template, template_rendered
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+log = logging.getLogger(__name__)
+
+
+class RequestTimer(object) :
+    """
+    What one request has done so far
+    """
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.queries = 0
+        self.db_time = 0.0
+        self.hash_time = 0.0
+        self.render_time = 0.0
+        self.rendering = []
+
+    def total_time(self):
+        return time.perf_counter() - self.start
+
+
+def current_timer():
+    if not has_request_context() :
+        return None
+
+    return g.get('request_timer')
+
+
+#
+# SQLAlchemy events
+#   Every engine is listened to, statements run outside of a request (background
+#   threads, commands) are not counted.
+#
+def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if not current_timer() == None :
+        conn.info.setdefault('query_start', []).append(time.perf_counter())
+
+def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    timer = current_timer()
+    if not timer == None and conn.info.get('query_start') :
+        timer.queries += 1
+        timer.db_time += time.perf_counter() - conn.info['query_start'].pop()
+
+
+#
+# record_hash
+#   Adds the time taken to hash or check a password to the current request
+#
+def record_hash(seconds):
+    timer = current_timer()
+    if not timer == None :
+        timer.hash_time += seconds
+
+
+#
+# Template signals
+#
+def before_render(sender, template, context, **extra):
+    timer = current_timer()
+    if not timer == None :
+        timer.rendering.append(time.perf_counter())
+
+def after_render(sender, template, context, **extra):
+    timer = current_timer()
+    if not timer == None and timer.rendering :
+        timer.render_time += time.perf_counter() - timer.rendering.pop()
+
+
+class EndpointStats(object) :
+    """
+    Totals for all of the requests to one endpoint
+    """
+
+    def __init__(self):
+        self.requests = 0
+        self.queries = 0
+        self.db_time = 0.0
+        self.hash_time = 0.0
+        self.render_time = 0.0
+        self.total_time = 0.0
+        self.slow = 0
+
+
+class RequestStats(object) :
+    """
+    Times the database and template work of each request
+    """
+
+    def __init__(self, app=None):
+        if not app == None :
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('SERVER_TIMING', None)
+        app.config.setdefault('SLOW_REQUEST_SECONDS', 1.0)
+        app.config.setdefault('SLOW_REQUEST_QUERIES', 30)
+
+        app.extensions['request_stats'] = {
+            'endpoints' : {},
+            'lock' : threading.Lock(),
+        }
+
+        app.before_request(self.start_request)
+        app.after_request(self.finish_request)
+
+        if not event.contains(Engine, 'before_cursor_execute', before_cursor_execute) :
+            event.listen(Engine, 'before_cursor_execute', before_cursor_execute)
+            event.listen(Engine, 'after_cursor_execute', after_cursor_execute)
+
+        before_render_template.connect(before_render, app)
+        template_rendered.connect(after_render, app)
+
+    def start_request(self):
+        g.request_timer = RequestTimer()
+
+    def finish_request(self, response):
+        timer = g.pop('request_timer', None)
+        if timer == None :
+            return response
+
+        total = timer.total_time()
+        config = current_app.config
+
+        server_timing = config['SERVER_TIMING']
+        if server_timing == None :
+            server_timing = current_app.debug
+
+        if server_timing :
+            timing = 'db;dur=%.1f;desc="%d queries", ' % (timer.db_time * 1000, timer.queries)
+            if timer.hash_time :
+                timing += 'hash;dur=%.1f, ' % (timer.hash_time * 1000)
+            timing += 'render;dur=%.1f, total;dur=%.1f' % (timer.render_time * 1000, total * 1000)
+            response.headers.add('Server-Timing', timing)
+
+        slow = total > config['SLOW_REQUEST_SECONDS'] or timer.queries > config['SLOW_REQUEST_QUERIES']
+        if slow :
+            log.warning('Slow request %s %s (%s): %.0fms, %d queries taking %.0fms, %.0fms hashing, %.0fms rendering',
+                request.method, request.full_path, request.endpoint, total * 1000, timer.queries,
+                timer.db_time * 1000, timer.hash_time * 1000, timer.render_time * 1000)
+
+        self.record(request.endpoint or 'none', timer, total, slow)
+
+        return response
+
+    def record(self, endpoint, timer, total, slow):
+        state = current_app.extensions['request_stats']
+        with state['lock'] :
+            stats = state['endpoints'].get(endpoint)
+            if stats == None :
+                stats = state['endpoints'][endpoint] = EndpointStats()
+
+            stats.requests += 1
+            stats.queries += timer.queries
+            stats.db_time += timer.db_time
+            stats.hash_time += timer.hash_time
+            stats.render_time += timer.render_time
+            stats.total_time += total
+            if slow :
+                stats.slow += 1
+
+    #
+    # endpoints
+    #   The totals so far for each endpoint of the current app
+    #
+    def endpoints(self):
+        state = current_app.extensions['request_stats']
+        with state['lock'] :
+            return dict(state['endpoints'])
+
+
+request_stats = RequestStats()
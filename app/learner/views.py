@@ -1,19 +1,42 @@
 from . import learner
-from flask import render_template, session, redirect, url_for, request, current_app, flash
+from flask import render_template, session, redirect, url_for, request, current_app, flash, jsonify, abort
 from ..models import Learner, Worksheet
 from .forms import LearnerForm, LearnerLoginForm
 from .. import db
-from werkzeug.security import check_password_hash, generate_password_hash
+from ..current_user import current_users, log_in, log_out
+from ..passwords import passwords
+from ..trending import trending
+from ..recommendations import recommendations
 from flask_mail import Message
 import random
 import string
-from .. import mail
+from ..mail_queue import mail_queue
+from ..queries import favourites_page, recommended_for_learner, FAVOURITE_SORTS
+
+# number of favourites loaded at once on the learner dashboard
+FAVOURITES_PER_PAGE = 20
 
 def get_random_string(length):
     letters = string.ascii_lowercase
     result_str = ''.join(random.choice(letters) for i in range(length))
     return result_str
 
+#
+# queue_reset_failed
+#   Tells the learner their password was not reset. The reset may have failed
+#   because of the database, so if this fails too it is only logged and the
+#   original error is the one that is raised.
+#
+def queue_reset_failed(email):
+    try :
+        msg = Message("Password Reset Failed", sender = 'kodyrogers21@gmail.com', recipients = [email])
+        msg.body = "Something went wrong on our side and you password was not reset. Please try again or contact admin at kodyroger21@gmail.com."
+        mail_queue.send(msg)
+        db.session.commit()
+    except Exception :
+        db.session.rollback()
+        current_app.logger.exception('Could not queue the password reset failed mail')
+
 #
 # Learner Login
 # Purpose: to allow learner to login with their permissions.
@@ -29,12 +52,14 @@ def learner_login():
                 flash("Email does not exist")
 
                 return redirect(request.url)
-            elif check_password_hash(learner.password, form.password.data):
-                session['learner_logged_in'] = True
-                session['learner_name'] = learner.name
+            elif passwords.verify(learner, form.password.data):
+                log_in('learner', learner)
+
+                # saves the password if it was hashed again
+                db.session.commit()
 
                 return redirect(url_for('learner.learner_dashboard', id=learner.id))
-            elif not check_password_hash(learner.password, form.password.data) :
+            else :
                 flash("password was incorrect")
                 return redirect(request.url)
         except :
@@ -50,8 +75,7 @@ def learner_login():
 @learner.route('/learner_logout')
 def learner_logout():
     if session.get('learner_logged_in'):
-        session['learner_logged_in'] = False
-        session['learner_name'] = None
+        log_out('learner')
 
     # redirect to the login page
     return redirect(url_for('other.home'))
@@ -76,20 +100,20 @@ def learner_password_reset() :
         if not learner == None :
             temp_pass = get_random_string(8)
             try :
-                learner.password = generate_password_hash(temp_pass)
-
-                db.session.commit()
+                learner.password = passwords.hash(temp_pass)
 
+                # queued in the same transaction as the new password and sent
+                # outside of the request (see app/mail_queue.py)
                 msg = Message("Temporary Password", sender = 'kodyrogers21@gmail.com', recipients = [learner.email])
                 msg.body = "Your temporary password is '" + temp_pass + "'. It is highly recommended that you change it right away."
-                mail.send(msg)
+                mail_queue.send(msg)
+
+                db.session.commit()
 
                 return redirect(url_for('learner.learner_login'))
             except :
                 db.session.rollback()
-                msg = Message("Password Reset Failed", sender = 'kodyrogers21@gmail.com', recipients = [learner.email])
-                msg.body = "Something went wrong on our side and you password was not reset. Please try again or contact admin at kodyroger21@gmail.com."
-                mail.send(msg)
+                queue_reset_failed(form.email.data)
 
                 raise
         else :
@@ -119,7 +143,7 @@ def edit_learner(id) :
 
     if form.validate_on_submit():
         try :
-            learner.password = generate_password_hash(form.password.data)
+            learner.password = passwords.hash(form.password.data)
 
             db.session.commit()
 
@@ -166,19 +190,19 @@ def learner_change_password(id):
         return redirect(url_for('other.home'))
 
     try :
-        learner = Learner.query.get(id)
+        learner = current_users.learner()
     except :
         db.session.rollback()
         raise
 
-    if not learner.name == session.get('learner_name') :
+    if learner == None or not learner.id == id :
         return redirect(url_for('other.home'))
 
     form = LearnerForm(obj=learner)
 
     if form.validate_on_submit():
         try :
-            learner.password = generate_password_hash(form.password.data)
+            learner.password = passwords.hash(form.password.data)
 
             db.session.commit()
 
@@ -199,12 +223,12 @@ def learner_change_email(id):
         return redirect(url_for('other.home'))
 
     try :
-        learner = Learner.query.get(id)
+        learner = current_users.learner()
     except :
         db.session.rollback()
         raise
 
-    if not learner.name == session.get('learner_name') :
+    if learner == None or not learner.id == id :
         return redirect(url_for('other.home'))
 
     form = LearnerForm(obj=learner)
@@ -236,12 +260,12 @@ def learner_change_screenname(id):
         return redirect(url_for('other.home'))
 
     try :
-        learner = Learner.query.get(id)
+        learner = current_users.learner()
     except :
         db.session.rollback()
         raise
 
-    if not learner.name == session.get('learner_name') :
+    if learner == None or not learner.id == id :
         return redirect(url_for('other.home'))
 
     form = LearnerForm(obj=learner)
@@ -274,18 +298,21 @@ def add_favourite(learner_id, worksheet_id):
         return redirect(url_for('other.home'))
 
     try :
-        learner = Learner.query.get(learner_id)
+        learner = current_users.learner()
     except :
         db.session.rollback()
         raise
 
-    if not learner.name == session.get('learner_name') :
+    if learner == None or not learner.id == learner_id :
         return redirect(url_for('other.home'))
 
     try :
         worksheet = Worksheet.query.get(worksheet_id)
 
         learner.favourites.append(worksheet)
+        # counted for trending in the same transaction as the favourite
+        trending.record_favourite(worksheet.id)
+        recommendations.added_favourite(learner.id, worksheet.id)
 
         db.session.commit()
     except :
@@ -300,21 +327,88 @@ def add_favourite(learner_id, worksheet_id):
 # Learner Dashboard
 # Purpose: A place for an learner to see all the different options with their account
 #
+# Method:
+#     only the first page of favourites is on the page, the rest are loaded from
+#     learner_favourites as the learner scrolls. 'sort' is 'recent' (newest
+#     favourites first) or 'viewed' (most viewed first). The worksheets liked by
+#     learners with the same favourites are recommended (see
+#     app/recommendations.py).
+#
 @learner.route('/learner_dashboard/<int:id>', methods=['GET', 'POST'])
 @learner.route('/learner_dashboard', defaults={'id': 0}, methods=['GET', 'POST'])
 def learner_dashboard(id):
     if not session.get('learner_logged_in') :
         return redirect(url_for('other.home'))
 
+    sort = favourites_sort()
+
+    try :
+        learner = current_users.learner()
+        if learner == None :
+            return redirect(url_for('other.home'))
+
+        favourites = favourites_page(learner, sort, FAVOURITES_PER_PAGE)
+        recommended = recommended_for_learner(learner, current_app.config['RECOMMENDATIONS_SHOWN'])
+    except :
+        db.session.rollback()
+        raise
+
+    return render_template('learner_templates/learner_dashboard.html.j2', id=learner.id,
+        favourites=[row.Worksheet for row in favourites.items], sort=sort, recommended=recommended,
+        next_url=favourites.next_url('learner.learner_favourites', sort=sort))
+
+
+#
+# Learner Favourites
+# Purpose: The next page of favourites for the dashboard as json
+#
+# Method:
+#     'after' is the cursor from the next_url of the page before. Returns the
+#     favourites and the url of the page after them (null at the end).
+#
+@learner.route('/learner_favourites')
+def learner_favourites():
+    if not session.get('learner_logged_in') :
+        abort(403)
+
+    sort = favourites_sort()
+
     try :
-        learner = Learner.query.filter_by(name=session.get('learner_name')).first()
+        learner = current_users.learner()
+        if learner == None :
+            abort(403)
+
+        try :
+            favourites = favourites_page(learner, sort, FAVOURITES_PER_PAGE, after=request.args.get('after'))
+        except ValueError :
+            abort(400)
     except :
         db.session.rollback()
         raise
 
-    favourites = learner.favourites
+    return jsonify(favourites=[favourite_item(row) for row in favourites.items],
+        next_url=favourites.next_url('learner.learner_favourites', sort=sort))
+
+
+def favourites_sort():
+    sort = request.args.get('sort', 'recent')
+    if not sort in FAVOURITE_SORTS :
+        sort = 'recent'
+    return sort
 
-    return render_template('learner_templates/learner_dashboard.html.j2', id=learner.id, favourites=favourites)
+#
+# favourite_item
+#   What the dashboard needs to show one favourite
+#
+def favourite_item(row):
+    worksheet = row.Worksheet
+    return {
+        'id' : worksheet.id,
+        'name' : worksheet.name,
+        'pdf_url' : url_for('worksheets.worksheet_pdf', id=worksheet.id, v=worksheet.sha256),
+        'count' : worksheet.count,
+        'added_at' : row.created_at,
+    }
 
 
 #
@@ -336,7 +430,7 @@ def learner_signup():
     if form.validate_on_submit():
         try:
             new_learner = Learner(name=form.name.data, email=form.email.data,
-                            screenname=form.screenname.data, password=generate_password_hash(form.password.data))
+                            screenname=form.screenname.data, password=passwords.hash(form.password.data))
             db.session.add(new_learner)
             db.session.commit()
             return redirect(url_for('learner.learner_login'))
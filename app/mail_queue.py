@@ -0,0 +1,342 @@
+#
+# Mail Queue
+#   Sending mail straight from a view holds one of the uWSGI workers for as long
+#   as the SMTP server takes to answer, which can be seconds. Instead messages
+#   are written to the mail_jobs table as part of the view's transaction and
+#   sent afterwards by a background thread (or a separate process), several at a
+#   time over one SMTP connection.
+#
+#   A message that cannot be sent is tried again later, waiting
+#   MAIL_QUEUE_BACKOFF seconds and doubling that after each failure. After
+#   MAIL_QUEUE_MAX_ATTEMPTS it is marked failed and left in the table without
+#   its body, which can hold a temporary password.
+#
+#   A worker takes (locks) a batch of jobs before sending them so several
+#   workers can drain the same table. If a worker dies while sending, its jobs
+#   are taken again once MAIL_QUEUE_LEASE seconds have passed, so a message can
+#   be sent twice but is never lost.
+#
+#   MAIL_QUEUE_WORKER:
+#       'thread': every app checks the queue every MAIL_QUEUE_INTERVAL seconds
+#           in a background thread and straight after a message is queued
+#       'process': nothing is sent by the app, run a worker instead with
+#               FLASK_APP=run.py flask mail-queue work
+#   A MAIL_QUEUE_INTERVAL of 0 sends right after the commit, in the request
+#   (used by the tests).
+#
+#   Only the fields in MESSAGE_FIELDS are kept, attachments are not supported.
+#
+#   Works like the other extensions (see app/mail.py):
+#       mail_queue = MailQueue()
+#       mail_queue.init_app(app)
+#
+#   Views queue a message with mail_queue.send(msg) and then commit.
+#
+import json
+import logging
+import smtplib
+import threading
+import time
+from contextlib import contextmanager
+
+import click
+from flask import current_app, has_app_context
+from flask.cli import AppGroup
+from flask_mail import Message
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from .database import db
+from .mail import mail
+from .models import MailJob
+
+log = logging.getLogger(__name__)
+
+# the parts of a flask_mail.Message that are kept in the queue
+MESSAGE_FIELDS = ('subject', 'sender', 'recipients', 'body', 'html', 'cc', 'bcc', 'reply_to')
+
+
+def dump_message(message):
+    return json.dumps({name : getattr(message, name) for name in MESSAGE_FIELDS})
+
+
+#
+# load_message
+#   Makes the Message again. Json turns ('Name', 'address') pairs into lists so
+#   they are turned back into tuples.
+#
+def load_message(text):
+    fields = json.loads(text)
+
+    for name in ('sender', 'reply_to') :
+        if isinstance(fields[name], list) :
+            fields[name] = tuple(fields[name])
+
+    for name in ('recipients', 'cc', 'bcc') :
+        fields[name] = [tuple(address) if isinstance(address, list) else address for address in fields[name] or []]
+
+    return Message(**fields)
+
+
+#
+# redact_message
+#   The message without its body, kept for a job that failed so who it was for
+#   and why it failed can still be seen
+#
+def redact_message(text):
+    fields = json.loads(text)
+    fields['body'] = None
+    fields['html'] = None
+    return json.dumps(fields)
+
+
+class QueueWorker(object) :
+    """
+    Sends the queued mail of one app
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self.interval = app.config['MAIL_QUEUE_INTERVAL']
+        self.batch = app.config['MAIL_QUEUE_BATCH']
+        self.max_attempts = app.config['MAIL_QUEUE_MAX_ATTEMPTS']
+        self.backoff = app.config['MAIL_QUEUE_BACKOFF']
+        self.lease = app.config['MAIL_QUEUE_LEASE']
+        self.run_thread = app.config['MAIL_QUEUE_WORKER'] == 'thread'
+        self.wakeup = threading.Event()
+        self.lock = threading.Lock()
+        self.thread = None
+
+    def session(self):
+        return Session(bind=db.get_engine(self.app))
+
+    #
+    # claim
+    #   Locks up to a batch of jobs that are due. A job is only taken if no one
+    #   else took it in the meantime. Returns (id, message, attempts) of each.
+    #
+    def claim(self):
+        session = self.session()
+        try :
+            now = time.time()
+            due = session.query(MailJob.id).filter(MailJob.failed == False, MailJob.run_at <= now,
+                MailJob.locked_until <= now).order_by(MailJob.id).limit(self.batch).all()
+
+            claimed = []
+            for (id,) in due :
+                updated = session.execute(MailJob.__table__.update().where(MailJob.id == id)
+                    .where(MailJob.locked_until <= now).values(locked_until=now + self.lease))
+                if updated.rowcount == 1 :
+                    claimed.append(id)
+            session.commit()
+
+            if not claimed :
+                return []
+
+            return session.query(MailJob.id, MailJob.message, MailJob.attempts).filter(MailJob.id.in_(claimed)).order_by(MailJob.id).all()
+        finally :
+            session.close()
+
+    #
+    # deliver
+    #   Sends the jobs over one connection. Returns {id: error or None}. If the
+    #   connection fails every job that was not sent yet gets the error.
+    #
+    def deliver(self, jobs):
+        errors = {}
+        try :
+            with app_context(self.app) :
+                with mail.connect() as connection :
+                    for id, message, attempts in jobs :
+                        try :
+                            connection.send(load_message(message))
+                            errors[id] = None
+                        except (smtplib.SMTPResponseException, smtplib.SMTPRecipientsRefused) as e :
+                            # only this message was refused, the connection is still good
+                            errors[id] = repr(e)
+        except Exception as e :
+            for id, message, attempts in jobs :
+                errors.setdefault(id, repr(e))
+
+        return errors
+
+    #
+    # record
+    #   Removes the jobs that were sent and schedules the others to be tried again
+    #
+    def record(self, jobs, errors):
+        session = self.session()
+        try :
+            now = time.time()
+            for id, message, attempts in jobs :
+                if errors[id] == None :
+                    session.execute(MailJob.__table__.delete().where(MailJob.id == id))
+                    continue
+
+                attempts += 1
+                values = dict(attempts=attempts, last_error=errors[id], locked_until=0,
+                    run_at=now + self.backoff * 2 ** (attempts - 1))
+                if attempts >= self.max_attempts :
+                    values['failed'] = True
+                    values['message'] = redact_message(message)
+                    log.error('Giving up on mail job %d: %s', id, errors[id])
+                else :
+                    log.warning('Could not send mail job %d, trying again later: %s', id, errors[id])
+
+                session.execute(MailJob.__table__.update().where(MailJob.id == id).values(**values))
+            session.commit()
+        finally :
+            session.close()
+
+    #
+    # drain
+    #   Sends everything that is due. Returns the number of messages sent and the
+    #   number that failed.
+    #
+    def drain(self):
+        sent = 0
+        failed = 0
+        while True :
+            jobs = self.claim()
+            if not jobs :
+                break
+
+            errors = self.deliver(jobs)
+            self.record(jobs, errors)
+
+            failures = len([id for id in errors if not errors[id] == None])
+            sent += len(jobs) - failures
+            failed += failures
+
+            # a full batch that went out means there may be more waiting
+            if len(jobs) < self.batch or failures == len(jobs) :
+                break
+
+        return sent, failed
+
+    #
+    # wake
+    #   Called after a commit that queued mail
+    #
+    def wake(self):
+        if self.interval <= 0 :
+            try :
+                self.drain()
+            except Exception :
+                log.exception('Could not send queued mail')
+        elif self.run_thread :
+            self.start()
+            self.wakeup.set()
+
+    def start(self):
+        with self.lock :
+            if not self.thread == None :
+                return
+
+            self.thread = threading.Thread(target=self.run, name='mail-queue', daemon=True)
+            self.thread.start()
+
+    def run(self):
+        while True :
+            self.wakeup.wait(self.interval)
+            self.wakeup.clear()
+
+            try :
+                self.drain()
+            except Exception :
+                log.exception('Could not send queued mail')
+
+
+#
+# app_context
+#   The app context needed by Flask-Mail. A new one is only pushed when needed
+#   since popping it would remove the session of the request that is running.
+#
+@contextmanager
+def app_context(app):
+    if has_app_context() and current_app._get_current_object() is app :
+        yield
+    else :
+        with app.app_context() :
+            yield
+
+
+def wake_after_commit(session):
+    if session.info.pop('mail_queued', False) and has_app_context() :
+        worker = current_app.extensions.get('mail_queue')
+        if not worker == None :
+            worker.wake()
+
+def forget_after_rollback(session):
+    session.info.pop('mail_queued', None)
+
+
+mail_queue_cli = AppGroup('mail-queue', help='Send the mail waiting in the queue.')
+
+@mail_queue_cli.command('drain')
+def drain_command():
+    """
+    Send everything that is due and stop
+    """
+    sent, failed = current_app.extensions['mail_queue'].drain()
+    click.echo('Sent %d messages, %d failed' % (sent, failed))
+
+@mail_queue_cli.command('work')
+def work_command():
+    """
+    Keep sending mail as it is queued
+    """
+    worker = current_app.extensions['mail_queue']
+    while True :
+        try :
+            worker.drain()
+        except Exception :
+            log.exception('Could not send queued mail')
+        time.sleep(max(worker.interval, 1))
+
+
+class MailQueue(object) :
+    """
+    Queues mail in the database to be sent outside of the request
+    """
+
+    def __init__(self, app=None):
+        if not app == None :
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('MAIL_QUEUE_WORKER', 'thread')
+        app.config.setdefault('MAIL_QUEUE_INTERVAL', 5)
+        app.config.setdefault('MAIL_QUEUE_BATCH', 20)
+        app.config.setdefault('MAIL_QUEUE_MAX_ATTEMPTS', 6)
+        app.config.setdefault('MAIL_QUEUE_BACKOFF', 30)
+        app.config.setdefault('MAIL_QUEUE_LEASE', 300)
+
+        worker = QueueWorker(app)
+        app.extensions['mail_queue'] = worker
+
+        # jobs left from before the app started (or retries) are sent as soon as
+        # the app starts serving
+        if worker.run_thread and worker.interval > 0 :
+            app.before_first_request(worker.start)
+
+        app.cli.add_command(mail_queue_cli)
+
+        if not event.contains(db.session, 'after_commit', wake_after_commit) :
+            event.listen(db.session, 'after_commit', wake_after_commit)
+            event.listen(db.session, 'after_rollback', forget_after_rollback)
+
+    #
+    # send
+    #   Queues a flask_mail.Message in the current session. It is sent after the
+    #   session is committed.
+    #
+    def send(self, message):
+        db.session.add(MailJob(message=dump_message(message)))
+        db.session.info['mail_queued'] = True
+
+    def drain(self):
+        return current_app.extensions['mail_queue'].drain()
+
+
+mail_queue = MailQueue()
@@ -0,0 +1,376 @@
+#
+# Metrics
+#   Request latency, status codes, requests in flight and how long requests wait
+#   for a database connection, for every endpoint, in the Prometheus text format
+#   at /metrics (see app/other/views.py).
+#
+#   uWSGI runs several worker processes and a scrape only reaches one of them,
+#   so each process writes what it has counted to its own file in METRICS_DIR
+#   and /metrics adds up the files of every process. The file is written when a
+#   request starts (the workers handle one request at a time, so otherwise it
+#   would never show one in flight) and at most every METRICS_WRITE_INTERVAL
+#   seconds after one ends. A thread writes whatever is left over when the worker
+#   goes quiet. Counters and histograms of processes that have exited are kept,
+#   their requests in flight are not.
+#
+#   METRICS_DIR has to be shared by the workers, it defaults to a directory in the
+#   instance folder. Set it to None to only report the process that answers (the
+#   tests do this).
+#
+#   Works like the other extensions (see app/mail.py):
+#       metrics = Metrics()
+#       metrics.init_app(app)
+#
+import atexit
+import glob
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from collections import Counter
+
+from flask import current_app, g, request
+
+from .database import db
+
+log = logging.getLogger(__name__)
+
+# upper bounds of the histogram buckets in seconds, +Inf is added when written
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+POOL_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 30.0)
+
+PREFIX = 'lifelonglearning_'
+
+
+class Histogram(object) :
+    """
+    Counts of observations in each bucket (not cumulative), their sum and count
+    """
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        for i, bound in enumerate(self.buckets) :
+            if value <= bound :
+                break
+        else :
+            i = len(self.buckets)
+
+        self.counts[i] += 1
+        self.sum += value
+        self.count += 1
+
+    def dump(self):
+        return {'counts' : self.counts, 'sum' : self.sum, 'count' : self.count}
+
+    def add(self, dumped):
+        self.counts = [a + b for a, b in zip(self.counts, dumped['counts'])]
+        self.sum += dumped['sum']
+        self.count += dumped['count']
+
+
+class ProcessMetrics(object) :
+    """
+    What one worker process has counted
+    """
+
+    def __init__(self, directory, interval):
+        self.directory = directory
+        self.interval = interval
+        self.lock = threading.Lock()
+        self.requests = Counter()
+        self.latency = {}
+        self.in_flight = Counter()
+        self.pool_wait = Histogram(POOL_BUCKETS)
+        self.written = 0
+        self.changed = False
+        self.thread = None
+
+    def started(self, endpoint):
+        with self.lock :
+            self.in_flight[endpoint] += 1
+            self.changed = True
+
+        if self.thread == None and not self.directory == None :
+            self.start()
+
+    def finished(self, endpoint):
+        with self.lock :
+            self.in_flight[endpoint] -= 1
+            self.changed = True
+
+    def observe_request(self, endpoint, method, status, seconds):
+        with self.lock :
+            self.requests[(endpoint, method, str(status))] += 1
+            if not endpoint in self.latency :
+                self.latency[endpoint] = Histogram(LATENCY_BUCKETS)
+            self.latency[endpoint].observe(seconds)
+            self.changed = True
+
+    def observe_pool_wait(self, seconds):
+        with self.lock :
+            self.pool_wait.observe(seconds)
+            self.changed = True
+
+    def dump(self):
+        with self.lock :
+            return {
+                'pid' : os.getpid(),
+                'requests' : [list(key) + [n] for key, n in self.requests.items()],
+                'latency' : {endpoint : histogram.dump() for endpoint, histogram in self.latency.items()},
+                'in_flight' : dict(self.in_flight),
+                'pool_wait' : self.pool_wait.dump(),
+            }
+
+    #
+    # write
+    #   Writes this process' file if it has not been written in the last interval
+    #   (or always with force). The file is replaced in one step so a scrape never
+    #   reads half of it.
+    #
+    def write(self, force=False):
+        now = time.time()
+        if self.directory == None or (not force and now - self.written < self.interval) :
+            return
+
+        self.written = now
+        with self.lock :
+            self.changed = False
+
+        os.makedirs(self.directory, exist_ok=True)
+        handle, temp = tempfile.mkstemp(suffix='.tmp', dir=self.directory)
+        with os.fdopen(handle, 'w') as f :
+            json.dump(self.dump(), f)
+        os.replace(temp, os.path.join(self.directory, 'metrics-%d.json' % os.getpid()))
+
+    def start(self):
+        with self.lock :
+            if not self.thread == None :
+                return
+
+            self.thread = threading.Thread(target=self.run, name='metrics-writer', daemon=True)
+            self.thread.start()
+
+    #
+    # run
+    #   Writes what was counted since the last write, so the last requests before
+    #   a worker goes quiet are not held back until its next one
+    #
+    def run(self):
+        while True :
+            time.sleep(max(self.interval, 1))
+
+            if self.changed :
+                try :
+                    self.write(force=True)
+                except OSError :
+                    log.exception('Could not write the metrics of this worker')
+
+
+def process_alive(pid):
+    if pid == os.getpid() :
+        return True
+
+    try :
+        os.kill(pid, 0)
+    except ProcessLookupError :
+        return False
+    except PermissionError :
+        return True
+
+    return True
+
+
+#
+# read_processes
+#   What every process has written to the directory
+#
+def read_processes(directory):
+    processes = []
+    for path in glob.glob(os.path.join(directory, 'metrics-*.json')) :
+        try :
+            with open(path) as f :
+                processes.append(json.load(f))
+        except (OSError, ValueError) :
+            continue
+
+    return processes
+
+
+#
+# collect
+#   Adds up what the processes counted
+#
+def collect(processes):
+    requests = Counter()
+    latency = {}
+    in_flight = Counter()
+    pool_wait = Histogram(POOL_BUCKETS)
+
+    for dumped in processes :
+        for endpoint, method, status, n in dumped['requests'] :
+            requests[(endpoint, method, status)] += n
+
+        for endpoint, histogram in dumped['latency'].items() :
+            if not endpoint in latency :
+                latency[endpoint] = Histogram(LATENCY_BUCKETS)
+            latency[endpoint].add(histogram)
+
+        if process_alive(dumped['pid']) :
+            in_flight.update(dumped['in_flight'])
+
+        pool_wait.add(dumped['pool_wait'])
+
+    return requests, latency, in_flight, pool_wait
+
+
+def escape(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def labels(**values):
+    return '{' + ','.join('%s="%s"' % (name, escape(str(values[name]))) for name in sorted(values)) + '}'
+
+def histogram_lines(name, histogram, **label_values):
+    lines = []
+    cumulative = 0
+    for bound, count in zip(list(histogram.buckets) + ['+Inf'], histogram.counts) :
+        cumulative += count
+        lines.append('%s_bucket%s %d' % (name, labels(le=bound, **label_values), cumulative))
+    lines.append('%s_sum%s %r' % (name, labels(**label_values), histogram.sum))
+    lines.append('%s_count%s %d' % (name, labels(**label_values), histogram.count))
+    return lines
+
+
+#
+# exposition
+#   The metrics of the processes in the Prometheus text format
+#
+def exposition(processes):
+    requests, latency, in_flight, pool_wait = collect(processes)
+
+    lines = [
+        '# HELP %shttp_requests_total Requests handled, by endpoint, method and status code.' % PREFIX,
+        '# TYPE %shttp_requests_total counter' % PREFIX,
+    ]
+    for (endpoint, method, status), n in sorted(requests.items()) :
+        lines.append('%shttp_requests_total%s %d' % (PREFIX, labels(endpoint=endpoint, method=method, status=status), n))
+
+    lines.append('# HELP %shttp_request_duration_seconds Time taken to handle requests, by endpoint.' % PREFIX)
+    lines.append('# TYPE %shttp_request_duration_seconds histogram' % PREFIX)
+    for endpoint in sorted(latency) :
+        lines.extend(histogram_lines(PREFIX + 'http_request_duration_seconds', latency[endpoint], endpoint=endpoint))
+
+    lines.append('# HELP %shttp_requests_in_flight Requests being handled right now, by endpoint.' % PREFIX)
+    lines.append('# TYPE %shttp_requests_in_flight gauge' % PREFIX)
+    for endpoint, n in sorted(in_flight.items()) :
+        lines.append('%shttp_requests_in_flight%s %d' % (PREFIX, labels(endpoint=endpoint), n))
+
+    lines.append('# HELP %sdb_pool_checkout_seconds Time spent waiting for a database connection from the pool.' % PREFIX)
+    lines.append('# TYPE %sdb_pool_checkout_seconds histogram' % PREFIX)
+    lines.extend(histogram_lines(PREFIX + 'db_pool_checkout_seconds', pool_wait))
+
+    return '\n'.join(lines) + '\n'
+
+
+#
+# time_pool_checkouts
+#   SQLAlchemy has no event for when a checkout starts, so the pool's own get is
+#   wrapped to time how long it blocks.
+#
+def time_pool_checkouts(pool, process):
+    if getattr(pool, 'metrics_timed', False) :
+        return
+
+    do_get = pool._do_get
+    def timed_do_get():
+        start = time.perf_counter()
+        try :
+            return do_get()
+        finally :
+            process.observe_pool_wait(time.perf_counter() - start)
+
+    pool._do_get = timed_do_get
+    pool.metrics_timed = True
+
+
+def endpoint_name():
+    return request.endpoint or 'none'
+
+
+class Metrics(object) :
+    """
+    Prometheus style metrics added up over all of the worker processes
+    """
+
+    def __init__(self, app=None):
+        if not app == None :
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('METRICS_DIR', os.path.join(app.instance_path, 'metrics'))
+        app.config.setdefault('METRICS_WRITE_INTERVAL', 1)
+
+        process = ProcessMetrics(app.config['METRICS_DIR'], app.config['METRICS_WRITE_INTERVAL'])
+        app.extensions['metrics'] = process
+
+        app.before_request(self.start_request)
+        app.after_request(self.finish_request)
+        app.teardown_request(self.teardown_request)
+
+        if not process.directory == None :
+            atexit.register(process.write, True)
+
+    @property
+    def process(self):
+        return current_app.extensions['metrics']
+
+    def start_request(self):
+        # the engine is made lazily, so its pool is timed on the first request
+        time_pool_checkouts(db.get_engine(current_app).pool, self.process)
+
+        g.metrics_start = time.perf_counter()
+        g.metrics_endpoint = endpoint_name()
+        self.process.started(g.metrics_endpoint)
+        try :
+            self.process.write(force=True)
+        except OSError :
+            pass
+
+    def finish_request(self, response):
+        start = g.get('metrics_start')
+        if not start == None :
+            self.process.observe_request(g.metrics_endpoint, request.method, response.status_code,
+                time.perf_counter() - start)
+
+        return response
+
+    def teardown_request(self, exception=None):
+        start = g.pop('metrics_start', None)
+        if start == None :
+            return
+
+        self.process.finished(g.pop('metrics_endpoint'))
+        try :
+            self.process.write()
+        except OSError :
+            pass
+
+    #
+    # exposition
+    #   The metrics of every worker in the Prometheus text format
+    #
+    def exposition(self):
+        if self.process.directory == None :
+            return exposition([self.process.dump()])
+
+        self.process.write(force=True)
+        return exposition(read_processes(self.process.directory))
+
+
+metrics = Metrics()
@@ -1,6 +1,8 @@
+import time
 from flask import Flask
 from flask_sqlalchemy import SQLAlchemy
-from sqlalchemy import Column, Integer, String, ForeignKey, Text
+from sqlalchemy import Column, Integer, String, ForeignKey, Text, Float, Boolean, UniqueConstraint
+from sqlalchemy.dialects import mysql
 from sqlalchemy.orm import relationship, backref
 from app.database import db
 
@@ -72,19 +74,38 @@ class Worksheet(db.Model) :
 
     __tablename__ = 'worksheets'
 
+    # the worksheets page can be sorted by views and by trending (see
+    # app/queries.py), id breaks the ties
+    __table_args__ = (
+        db.Index('ix_worksheets_popular', 'count', 'id'),
+        db.Index('ix_worksheets_trending', 'trending_score', 'id'),
+    )
+
     id = Column(Integer, primary_key=True)
     name = Column(String(64), index=True, unique=True)
     pdf_url = Column(String(300), default=None, nullable=True)
     video_url = Column(String(300), default=None, nullable=True)
     count = Column(Integer, default=0, nullable=False)
 
+    # views and favourites that count for less the older they are (see
+    # app/trending.py), double precision so the page cursors compare exactly
+    trending_score = Column(Float(precision=53), default=0.0, server_default='0', nullable=False)
+
+    # the pdf in the content addressed store (see app/storage.py), empty for
+    # worksheets uploaded before it
+    sha256 = Column(String(64), index=True, default=None, nullable=True)
+    size = Column(Integer, default=None, nullable=True)
+
+    # png of the first page for the listing pages (see app/thumbnails.py)
+    thumbnail = Column(String(300), default=None, nullable=True)
+
     # relation to category
     category_id = Column(Integer, ForeignKey('worksheet_categories.id'), nullable=False)
 
     category = relationship('WorksheetCategory', backref=backref('worksheets', lazy=True))
 
-    # relation to author
-    author_id = Column(Integer, ForeignKey('authors.id'), nullable=False)
+    # relation to author, indexed for the author pages and dashboard
+    author_id = Column(Integer, ForeignKey('authors.id'), nullable=False, index=True)
 
     author = relationship('Author', backref=backref('worksheets', lazy=True))
 
@@ -144,9 +165,19 @@ class Author(db.Model) :
 # Helper Table for the favourites
 #   Will allow me to make a many to many relationship with learners and worksheets
 #
+#   The primary key starts with the worksheet, the indexes are for finding the
+#   favourites of a learner and listing them newest first
+#
+#   created_at: when the favourite was added, in seconds since the epoch (0 for
+#       favourites added before it was kept), double precision so the page
+#       cursors compare exactly
+#
 worksheets_identifier = db.Table('worksheets_identifier',
     db.Column('worksheet_id', db.Integer, db.ForeignKey('worksheets.id'), primary_key=True),
-    db.Column('learner_id', db.Integer, db.ForeignKey('learners.id'), primary_key=True)
+    db.Column('learner_id', db.Integer, db.ForeignKey('learners.id'), primary_key=True),
+    db.Column('created_at', db.Float(precision=53), default=time.time, server_default='0', nullable=False),
+    db.Index('ix_worksheets_identifier_learner_id', 'learner_id', 'worksheet_id'),
+    db.Index('ix_worksheets_identifier_learner_created', 'learner_id', 'created_at', 'worksheet_id')
 )
 
 #
@@ -155,7 +186,9 @@ worksheets_identifier = db.Table('worksheets_identifier',
 #   screenname: a name that is displayed on the platform
 #   email: The learners email
 #   password: the learners password
-#   favourites: A list of worksheets that a learner likes
+#   favourites: The worksheets that a learner likes. It is a query (lazy='dynamic')
+#       so loading a learner does not load them, use learner.favourites.all() or
+#       queries.favourite_ids() for the worksheets on a page
 #
 class Learner(db.Model):
     """
@@ -170,8 +203,299 @@ class Learner(db.Model):
     screenname = Column(String(64), default=None, nullable=True, unique=True)
     password = Column(String(200), nullable=False)
 
-    favourites = db.relationship('Worksheet', secondary=worksheets_identifier, lazy='subquery',
-        backref=db.backref('learners', lazy=True))
+    favourites = db.relationship('Worksheet', secondary=worksheets_identifier, lazy='dynamic',
+        backref=db.backref('learners', lazy='dynamic'))
 
     def __repr__(self):
         return '<Learner %r>' % self.name
+
+#
+# Version
+#   name: the name of the thing being versioned (for example 'categories')
+#   version: a number that goes up every time that thing changes
+#
+# Note: Each uWSGI worker keeps some tables in memory (see app/categories.py).
+#   This is how a worker finds out another worker has changed them.
+#
+class Version(db.Model):
+    """
+    Create Versions table
+    """
+
+    __tablename__ = 'versions'
+
+    name = Column(String(64), primary_key=True)
+    version = Column(Integer, default=0, nullable=False)
+
+    def __repr__(self):
+        return '<Version %r %r>' % (self.name, self.version)
+
+
+#
+# StoredFile
+#   One file in the content addressed store (see app/storage.py)
+#
+#   sha256: the hash of the contents, also the name of the file
+#
+#   refs: how many worksheets use the file, it is removed when this reaches 0
+#
+class StoredFile(db.Model):
+    """
+    Create Stored Files table
+    """
+
+    __tablename__ = 'stored_files'
+
+    sha256 = Column(String(64), primary_key=True)
+    size = Column(Integer, nullable=False)
+    refs = Column(Integer, default=0, nullable=False)
+
+    def __repr__(self):
+        return '<StoredFile %r %r>' % (self.sha256, self.refs)
+
+
+#
+# MailJob
+#   An email waiting to be sent (see app/mail_queue.py)
+#
+#   message: the message as json (subject, sender, recipients, body...)
+#
+#   attempts: how many times sending it has failed
+#
+#   run_at: when it can be tried next, in seconds since the epoch
+#
+#   locked_until: a worker that took the job has until then to send it
+#
+#   both times are double precision, a single precision FLOAT on MySQL would
+#   round them by minutes
+#
+#   failed: set once it has failed too many times to keep trying
+#
+class MailJob(db.Model):
+    """
+    Create Mail Jobs table
+    """
+
+    __tablename__ = 'mail_jobs'
+
+    id = Column(Integer, primary_key=True)
+    message = Column(Text, nullable=False)
+    attempts = Column(Integer, default=0, nullable=False)
+    run_at = Column(Float(precision=53), default=0, nullable=False, index=True)
+    locked_until = Column(Float(precision=53), default=0, nullable=False)
+    failed = Column(Boolean, default=False, nullable=False)
+    last_error = Column(Text, default=None, nullable=True)
+
+    def __repr__(self):
+        return '<MailJob %r>' % self.id
+
+
+#
+# StoredSession
+#   The session of one visitor (see app/sessions.py)
+#
+#   id: sha256 of the random id in the visitor's cookie
+#
+#   data: the session values as tagged json
+#
+#   version: goes up every time it is saved, a worker's cached copy is only used
+#       while it matches
+#
+#   expires_at: when it is removed, in seconds since the epoch (double
+#       precision, a single precision FLOAT on MySQL would round it by minutes)
+#
+class StoredSession(db.Model):
+    """
+    Create Sessions table
+    """
+
+    __tablename__ = 'sessions'
+
+    id = Column(String(64), primary_key=True)
+    data = Column(Text, nullable=False)
+    version = Column(Integer, default=1, server_default='1', nullable=False)
+    expires_at = Column(Float(precision=53), nullable=False, index=True)
+
+    def __repr__(self):
+        return '<StoredSession %r>' % self.id
+
+
+#
+# SearchDocument
+#   A worksheet or blog post as the search sees it (see app/search.py)
+#
+#   kind, object_id: 'worksheet' or 'post' and its id
+#
+#   title: the worksheet or post name
+#
+#   tags: the author and category names
+#
+#   content: the text of the pdf or the post
+#
+class SearchDocument(db.Model):
+    """
+    Create Search Documents table
+    """
+
+    __tablename__ = 'search_documents'
+    __table_args__ = (UniqueConstraint('kind', 'object_id'),)
+
+    id = Column(Integer, primary_key=True)
+    kind = Column(String(16), nullable=False)
+    object_id = Column(Integer, nullable=False)
+    title = Column(String(200), nullable=False, default='')
+    tags = Column(Text, nullable=False, default='')
+    # up to SEARCH_PDF_MAX_CHARS of pdf text, more than MySQL's TEXT holds
+    content = Column(Text().with_variant(mysql.MEDIUMTEXT(), 'mysql'), nullable=False, default='')
+
+    def __repr__(self):
+        return '<SearchDocument %r %r>' % (self.kind, self.object_id)
+
+
+#
+# SearchPosting
+#   How often a word appears in a document, for the built in search index used
+#   when the database has no full text search of its own (see app/search.py)
+#
+#   count: the number of times the word appears, weighted up in the title and tags
+#
+class SearchPosting(db.Model):
+    """
+    Create Search Postings table
+    """
+
+    __tablename__ = 'search_postings'
+
+    term = Column(String(64), primary_key=True)
+    document_id = Column(Integer, ForeignKey('search_documents.id'), primary_key=True, index=True)
+    count = Column(Integer, nullable=False)
+
+    def __repr__(self):
+        return '<SearchPosting %r %r>' % (self.term, self.document_id)
+
+
+#
+# WorksheetEvent
+#   Views or favourites of a worksheet at one time, what the trending scores are
+#   worked out from (see app/trending.py). Views are written in batches so one
+#   row can stand for several.
+#
+#   kind: 'view' or 'favourite'
+#
+#   count: how many of them there were
+#
+#   Not a foreign key so deleting a worksheet does not have to wait for its
+#   events, they are removed once they are too old to count.
+#
+class WorksheetEvent(db.Model):
+    """
+    Create Worksheet Events table
+    """
+
+    __tablename__ = 'worksheet_events'
+
+    id = Column(Integer, primary_key=True)
+    worksheet_id = Column(Integer, nullable=False, index=True)
+    kind = Column(String(16), nullable=False)
+    count = Column(Integer, nullable=False, default=1)
+    created_at = Column(Float(precision=53), nullable=False, index=True)
+
+    def __repr__(self):
+        return '<WorksheetEvent %r %r>' % (self.worksheet_id, self.kind)
+
+
+#
+# WorksheetNeighbour
+#   A worksheet that learners who like one worksheet also like, the top few
+#   for each worksheet are kept so showing them is one indexed lookup (see
+#   app/recommendations.py)
+#
+#   together: how many learners have both as favourites
+#
+#   score: together divided by the square root of how many learners like each
+#       of them (cosine similarity), so worksheets everybody likes do not come
+#       first for everything
+#
+#   Not foreign keys so deleting a worksheet does not have to wait for them,
+#   the lookups join the worksheets and the next rebuild removes them.
+#
+class WorksheetNeighbour(db.Model):
+    """
+    Create Worksheet Neighbours table
+    """
+
+    __tablename__ = 'worksheet_neighbours'
+
+    __table_args__ = (
+        db.Index('ix_worksheet_neighbours_score', 'worksheet_id', 'score'),
+    )
+
+    worksheet_id = Column(Integer, primary_key=True, autoincrement=False)
+    neighbour_id = Column(Integer, primary_key=True, autoincrement=False)
+    together = Column(Integer, nullable=False)
+    score = Column(Float(precision=53), nullable=False)
+
+    def __repr__(self):
+        return '<WorksheetNeighbour %r %r>' % (self.worksheet_id, self.neighbour_id)
+
+
+#
+# WorksheetTerm
+#   A word in the title or pdf of a worksheet and its TF-IDF weight, what the
+#   related worksheets are worked out from (see app/related.py)
+#
+#   count: how many times it is in the worksheet (the title counts more)
+#
+#   weight: the TF-IDF weight when the worksheet was last worked out, the
+#       weights of a worksheet add up (squared) to 1
+#
+#   The index on the term finds the other worksheets with a word and how many
+#   worksheets have it.
+#
+#   The term is compared byte for byte on MySQL, its default collation would
+#   take 'resume' and 'résumé' for the same key.
+#
+class WorksheetTerm(db.Model):
+    """
+    Create Worksheet Terms table
+    """
+
+    __tablename__ = 'worksheet_terms'
+
+    __table_args__ = (
+        db.Index('ix_worksheet_terms_term', 'term', 'worksheet_id'),
+    )
+
+    worksheet_id = Column(Integer, primary_key=True, autoincrement=False)
+    term = Column(String(64).with_variant(mysql.VARCHAR(64, collation='utf8mb4_bin'), 'mysql'), primary_key=True)
+    count = Column(Integer, nullable=False)
+    weight = Column(Float(precision=53), nullable=False)
+
+    def __repr__(self):
+        return '<WorksheetTerm %r %r>' % (self.worksheet_id, self.term)
+
+
+#
+# RelatedWorksheet
+#   A worksheet with words like another's, the top few for each worksheet are
+#   kept so showing them is one indexed lookup (see app/related.py)
+#
+#   score: the cosine similarity of their TF-IDF weights
+#
+class RelatedWorksheet(db.Model):
+    """
+    Create Related Worksheets table
+    """
+
+    __tablename__ = 'related_worksheets'
+
+    __table_args__ = (
+        db.Index('ix_related_worksheets_score', 'worksheet_id', 'score'),
+    )
+
+    worksheet_id = Column(Integer, primary_key=True, autoincrement=False)
+    related_id = Column(Integer, primary_key=True, autoincrement=False)
+    score = Column(Float(precision=53), nullable=False)
+
+    def __repr__(self):
+        return '<RelatedWorksheet %r %r>' % (self.worksheet_id, self.related_id)
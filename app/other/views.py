@@ -1,7 +1,21 @@
-from flask import render_template, current_app, session, redirect, url_for
+import hmac
+
+from flask import render_template, current_app, session, redirect, url_for, request, jsonify, abort
 from . import other
 from .. import db
-from ..models import Author, PostCategory, WorksheetCategory, Learner, Worksheet
+from ..models import Author, Learner, Worksheet
+from ..queries import worksheets_query
+from ..pagination import paginate
+from ..cache import response_cache
+from ..categories import category_registry
+from ..metrics import metrics
+from ..search import search_index
+
+# number of worksheets in each batch of slides on the home page carousel
+HOME_SLIDES = 5
+
+# number of results on each page of the search
+SEARCH_RESULTS_PER_PAGE = 10
 
 #
 # Home
@@ -11,22 +25,72 @@ from ..models import Author, PostCategory, WorksheetCategory, Learner, Worksheet
 #     requested
 #
 # Method:
-#     render the home page template
+#     render the home page template with the most recent worksheets. Only a
+#     small batch of slides is sent with the page, the carousel asks home_slides
+#     for more when it runs out so the page costs the same no matter how many
+#     worksheets there are.
 #
 @other.route('/')
 @other.route('/home')
 def home():
     try :
-        worksheets = Worksheet.query.all()
+        slides = paginate(worksheets_query(), Worksheet.id, HOME_SLIDES)
     except:
+        db.session.rollback()
         raise
-    return render_template("other_templates/home.html.j2", title='Home', worksheets=worksheets)
+
+    return render_template("other_templates/home.html.j2", title='Home', worksheets=slides.items, next_slides_url=slides.next_url('other.home_slides'))
+
+#
+# Home Slides
+# Purpose:
+#     gives the home page carousel the next batch of slides as json
+#
+# Method:
+#     'after' is the id of the last slide the carousel has. Returns the slides and
+#     the url of the batch after them (null once the carousel has every worksheet).
+#
+@other.route('/home_slides')
+def home_slides():
+    try :
+        slides = paginate(worksheets_query(), Worksheet.id, HOME_SLIDES, after=request.args.get('after', type=int))
+    except:
+        db.session.rollback()
+        raise
+
+    return jsonify(slides=[home_slide(worksheet) for worksheet in slides.items], next_url=slides.next_url('other.home_slides'))
+
+#
+# home_slide
+#   The information the carousel needs to show a worksheet
+#
+def home_slide(worksheet):
+    if worksheet.author.screenname is None :
+        author_name = worksheet.author.name
+    else :
+        author_name = worksheet.author.screenname
+
+    if worksheet.thumbnail is None :
+        thumbnail_url = None
+    else :
+        thumbnail_url = url_for('worksheets.worksheet_thumbnail', id=worksheet.id, v=worksheet.sha256)
+
+    return {
+        'id' : worksheet.id,
+        'name' : worksheet.name,
+        'pdf_url' : url_for('worksheets.worksheet_pdf', id=worksheet.id, v=worksheet.sha256),
+        'view_url' : url_for('worksheets.worksheets_count', id=worksheet.id),
+        'thumbnail_url' : thumbnail_url,
+        'author_url' : url_for('worksheets.worksheets_page', author=worksheet.author_id),
+        'author_name' : author_name,
+    }
 
 #
 # Contact/About
 #   will present the Contact/About page
 #
 @other.route('/contact')
+@response_cache.cached
 def contact():
     try :
         authors = Author.query.all()
@@ -44,15 +108,57 @@ def admin() :
     try :
         learners = Learner.query.all()
 
-        worksheetCategories = WorksheetCategory.query.all()
+        worksheetCategories = category_registry.worksheet_categories()
 
-        postCategories = PostCategory.query.all()
+        postCategories = category_registry.post_categories()
     except:
         db.session.rollback()
         return redirect(url_for('other.home'))
 
     return render_template('other_templates/admin.html.j2', worksheet_categories=worksheetCategories, post_categories=postCategories, learners=learners)
 
+#
+# Metrics
+# Purpose:
+#     the request metrics of every worker in the Prometheus text format (see
+#     app/metrics.py). Only the admin can see them, or a scraper sending
+#     METRICS_TOKEN as a bearer token.
+#
+@other.route('/metrics')
+def metrics_page():
+    token = current_app.config.get('METRICS_TOKEN')
+    # compared as bytes, compare_digest refuses strings that are not ascii
+    scraper = not token == None and hmac.compare_digest(request.headers.get('Authorization', '').encode('latin-1'),
+        ('Bearer ' + token).encode())
+
+    if not session.get('logged_in') and not scraper :
+        abort(403)
+
+    return current_app.response_class(metrics.exposition(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+#
+# Search
+# Purpose:
+#     finds the worksheets and blog posts that best match the words in 'q' (see
+#     app/search.py). 'page' counts from 0 like the other pages.
+#
+@other.route('/search')
+@response_cache.cached
+def search():
+    query = request.args.get('q', '').strip()
+    page = max(request.args.get('page', 0, type=int), 0)
+
+    try :
+        found = search_index.search(query, page, SEARCH_RESULTS_PER_PAGE)
+    except:
+        db.session.rollback()
+        raise
+
+    prev_url = url_for('other.search', q=query, page=page - 1) if page > 0 else None
+    next_url = url_for('other.search', q=query, page=page + 1) if found.has_next else None
+
+    return render_template('other_templates/search.html.j2', query=query, results=found.results, prev_url=prev_url, next_url=next_url)
+
 @other.route('/building')
 def building():
     return render_template("other_templates/building.html.j2")
@@ -0,0 +1,175 @@
+#
+# Keyset (seek) pagination
+#   Pages through a query by remembering the id of the last row that was shown
+#   (the cursor) instead of skipping rows with OFFSET. The database can jump
+#   straight to the cursor in the primary key index so page 1000 costs the same
+#   as page 0, and fetching 'per_page + 1' rows tells us if there is another
+#   page without running a second query.
+#
+#   Rows are listed newest first (descending id) like the listing pages always
+#   have been.
+#
+#   Cursors:
+#       after: show the rows that are older than this id (the 'next' direction)
+#       before: show the rows that are newer than this id (the 'prev' direction)
+#
+from flask import url_for
+from sqlalchemy import and_, or_
+
+
+#
+# KeysetPage
+#   items: the rows on this page
+#   has_next/has_prev: whether there are older/newer rows
+#   next_after: the cursor used to get the next (older) page
+#   prev_before: the cursor used to get the previous (newer) page. None means
+#       the previous page is the first page.
+#
+class KeysetPage(object) :
+    """
+    A single page of rows and the cursors of the pages beside it
+    """
+
+    def __init__(self, items, has_next=False, has_prev=False, next_after=None, prev_before=None):
+        self.items = items
+        self.has_next = has_next
+        self.has_prev = has_prev
+        self.next_after = next_after
+        self.prev_before = prev_before
+
+    def next_url(self, endpoint, **values):
+        if not self.has_next :
+            return None
+
+        values['after'] = self.next_after
+        return url_for(endpoint, **values)
+
+    def prev_url(self, endpoint, **values):
+        if not self.has_prev :
+            return None
+
+        values['before'] = self.prev_before
+        return url_for(endpoint, **values)
+
+
+#
+# cursor_for_page
+#   Maps an old style page number ('/worksheets_page/<int:page>') onto the cursor
+#   that page starts after. Only the id column is read so the database can answer
+#   it from the index. Returns None when the page is past the end.
+#
+def cursor_for_page(query, column, per_page, page):
+    row = query.with_entities(column).order_by(column.desc()).offset(page * per_page - 1).limit(1).first()
+
+    if row == None :
+        return None
+
+    return row[0]
+
+
+#
+# paginate
+#   query: the (filtered) query to page through
+#   column: the unique, indexed column used as the cursor (normally Model.id)
+#   per_page: the number of rows on a page
+#   after/before: cursors taken from the request (see above)
+#   page: an old style page number, only used when no cursor is given
+#
+def paginate(query, column, per_page, after=None, before=None, page=0):
+    if before is not None :
+        rows = query.filter(column > before).order_by(column.asc()).limit(per_page + 1).all()
+
+        # ran out of newer rows so this is really the first page
+        if len(rows) < per_page :
+            return paginate(query, column, per_page)
+
+        has_prev = len(rows) > per_page
+        rows = list(reversed(rows[:per_page]))
+
+        return KeysetPage(rows, has_next=True, has_prev=has_prev,
+            next_after=getattr(rows[-1], column.key), prev_before=getattr(rows[0], column.key))
+
+    if after is None and page > 0 :
+        after = cursor_for_page(query, column, per_page, page)
+
+        if after == None :
+            return KeysetPage([], has_prev=True)
+
+    if after is not None :
+        query = query.filter(column < after)
+
+    rows = query.order_by(column.desc()).limit(per_page + 1).all()
+
+    has_next = len(rows) > per_page
+    rows = rows[:per_page]
+
+    next_after = None
+    if has_next :
+        next_after = getattr(rows[-1], column.key)
+
+    # an old style 'page=1' already knows its previous page is the first page
+    prev_before = None
+    if after is not None and rows and not page == 1 :
+        prev_before = getattr(rows[0], column.key)
+
+    return KeysetPage(rows, has_next=has_next, has_prev=after is not None,
+        next_after=next_after, prev_before=prev_before)
+
+
+#
+# Keyset pagination on several columns
+#   For lists that are not sorted by id, for example favourites sorted by when
+#   they were added or by views. The rows are sorted on all of the columns
+#   (descending) and the last column has to be unique so there are no ties.
+#   The cursor holds the values of those columns for the last row shown:
+#
+#       after=1588291200.25,42
+#
+#   Only goes forwards, it is used by infinite scroll.
+#
+
+def encode_cursor(values):
+    return ','.join(str(value) for value in values)
+
+
+#
+# decode_cursor
+#   The values of a cursor taken from the request. Raises ValueError when it
+#   does not fit the columns.
+#
+def decode_cursor(text, columns):
+    parts = text.split(',')
+    if not len(parts) == len(columns) :
+        raise ValueError('cursor has %d values, expected %d' % (len(parts), len(columns)))
+
+    return [column.type.python_type(part) for column, part in zip(columns, parts)]
+
+
+#
+# seek
+#   query: the (filtered) query to page through
+#   columns: the columns it is sorted on, the last one unique
+#   per_page: the number of rows on a page
+#   key: a function giving the values of the columns for a row of the query
+#   after: a cursor from encode_cursor(), None for the first page
+#
+def seek(query, columns, per_page, key, after=None):
+    if not after == None :
+        values = decode_cursor(after, columns)
+
+        # (a, b) < (x, y) written out so every database can use an index for it
+        later = []
+        for i, column in enumerate(columns) :
+            later.append(and_(*[columns[j] == values[j] for j in range(i)] + [column < values[i]]))
+        query = query.filter(or_(*later))
+
+    rows = query.order_by(*[column.desc() for column in columns]).limit(per_page + 1).all()
+
+    has_next = len(rows) > per_page
+    rows = rows[:per_page]
+
+    next_after = None
+    if has_next :
+        next_after = encode_cursor(key(rows[-1]))
+
+    return KeysetPage(rows, has_next=has_next, has_prev=not after == None, next_after=next_after)
@@ -0,0 +1,101 @@
+#
+# Passwords
+#   Hashing and checking the passwords of the learners, authors and the admin.
+#
+#   The login views used to check a wrong password twice (once to see if it was
+#   right and again to see that it was wrong), each check is a full pbkdf2 run
+#   so every failed login cost double. Now every login checks exactly once:
+#
+#       if passwords.verify(learner, form.password.data) :
+#           log_in('learner', learner)
+#
+#   New passwords are hashed with PASSWORD_METHOD (any method werkzeug takes,
+#   'pbkdf2:sha256:150000' by default) and a salt of PASSWORD_SALT_LENGTH
+#   characters. When either is raised the old hashes keep working and each one
+#   is replaced the next time its owner logs in, the caller commits it with the
+#   login.
+#
+#   The time spent hashing is added to the request timer so it shows up in the
+#   Server-Timing header and the endpoint totals (see app/instrumentation.py).
+#
+#   Works like the other extensions (see app/mail.py):
+#       passwords = Passwords()
+#       passwords.init_app(app)
+#
+import time
+
+from flask import current_app
+from werkzeug.security import DEFAULT_PBKDF2_ITERATIONS, check_password_hash, generate_password_hash
+
+from .instrumentation import record_hash
+
+
+#
+# full_method
+#   The method as werkzeug writes it at the start of a hash, with the number of
+#   pbkdf2 iterations filled in when it was left out
+#
+def full_method(method):
+    if method.startswith('pbkdf2:') and method.count(':') == 1 :
+        return '%s:%d' % (method, DEFAULT_PBKDF2_ITERATIONS)
+    return method
+
+
+class Passwords(object) :
+    """
+    Hashes passwords and checks them once per login
+    """
+
+    def __init__(self, app=None):
+        if not app == None :
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('PASSWORD_METHOD', 'pbkdf2:sha256:150000')
+        app.config.setdefault('PASSWORD_SALT_LENGTH', 8)
+
+    def hash(self, password):
+        start = time.perf_counter()
+        try :
+            return generate_password_hash(password, method=current_app.config['PASSWORD_METHOD'],
+                salt_length=current_app.config['PASSWORD_SALT_LENGTH'])
+        finally :
+            record_hash(time.perf_counter() - start)
+
+    def check(self, pwhash, password):
+        start = time.perf_counter()
+        try :
+            return check_password_hash(pwhash, password)
+        finally :
+            record_hash(time.perf_counter() - start)
+
+    #
+    # needs_rehash
+    #   True when a hash was made with another method or a shorter salt than new
+    #   passwords get
+    #
+    def needs_rehash(self, pwhash):
+        parts = pwhash.split('$', 2)
+        if not len(parts) == 3 :
+            return True
+
+        method, salt, hashed = parts
+        return not method == full_method(current_app.config['PASSWORD_METHOD']) \
+            or len(salt) < current_app.config['PASSWORD_SALT_LENGTH']
+
+    #
+    # verify
+    #   Checks the password of a learner or author. When it is right but was
+    #   hashed the old way it is hashed again, the caller commits the change.
+    #
+    def verify(self, user, password):
+        if not self.check(user.password, password) :
+            return False
+
+        if self.needs_rehash(user.password) :
+            user.password = self.hash(password)
+
+        return True
+
+
+passwords = Passwords()
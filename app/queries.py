@@ -0,0 +1,194 @@
+#
+# Queries
+#   Helpers that build the queries used by the listing pages.
+#
+#   The templates show the author (and sometimes the category) of every
+#   worksheet. Those relationships are lazy so without these helpers each card
+#   on a page would run its own SELECT. Here they are loaded in the same round
+#   trip as the worksheets so a page costs the same number of queries no matter
+#   how many worksheets are on it.
+#
+from collections import namedtuple
+
+from sqlalchemy import func
+from sqlalchemy.orm import joinedload
+from .database import db
+from .models import Worksheet, WorksheetCategory, WorksheetNeighbour, RelatedWorksheet, worksheets_identifier
+from .pagination import seek
+
+
+#
+# worksheets_query
+#   Worksheet.query with the author and category joined in. Filter, order and
+#   paginate it like any other query.
+#
+def worksheets_query():
+    return Worksheet.query.options(joinedload(Worksheet.author), joinedload(Worksheet.category))
+
+
+#
+# get_worksheet
+#   Worksheet.query.get() with the author and category loaded as well
+#
+def get_worksheet(id):
+    return worksheets_query().filter(Worksheet.id == id).first()
+
+
+#
+# favourite_ids
+#   The ids of the given worksheets that the learner has as favourites, as a set
+#   so the template can check each card without scanning a list. One query using
+#   the learner's index on worksheets_identifier, only for the page's worksheets.
+#
+def favourite_ids(learner, worksheets):
+    ids = [worksheet.id for worksheet in worksheets]
+    if learner == None or not ids :
+        return set()
+
+    rows = db.session.query(worksheets_identifier.c.worksheet_id).filter(
+        worksheets_identifier.c.learner_id == learner.id, worksheets_identifier.c.worksheet_id.in_(ids))
+    return {id for (id,) in rows}
+
+
+# how the favourites on the learner dashboard can be sorted: the columns seek()
+# pages on and how to get their values from a (worksheet, created_at) row
+FAVOURITE_SORTS = {
+    'recent' : ((worksheets_identifier.c.created_at, worksheets_identifier.c.worksheet_id),
+        lambda row: (row.created_at, row.Worksheet.id)),
+    'viewed' : ((Worksheet.count, Worksheet.id),
+        lambda row: (row.Worksheet.count, row.Worksheet.id)),
+}
+
+
+#
+# favourites_page
+#   One page of a learner's favourites as (worksheet, created_at) rows, sorted by
+#   one of FAVOURITE_SORTS. 'viewed' follows the view counts as they change so a
+#   worksheet can move between pages while someone scrolls.
+#
+def favourites_page(learner, sort, per_page, after=None):
+    columns, key = FAVOURITE_SORTS[sort]
+    query = db.session.query(Worksheet, worksheets_identifier.c.created_at) \
+        .join(worksheets_identifier, worksheets_identifier.c.worksheet_id == Worksheet.id) \
+        .filter(worksheets_identifier.c.learner_id == learner.id) \
+        .options(joinedload(Worksheet.author))
+
+    return seek(query, columns, per_page, key, after=after)
+
+
+# how the worksheets page can be sorted besides newest first (which pages on the
+# id alone, see worksheets_page): the columns seek() pages on, each pair has its
+# own index (see Worksheet)
+WORKSHEET_SORTS = {
+    'popular' : (Worksheet.count, Worksheet.id),
+    'trending' : (Worksheet.trending_score, Worksheet.id),
+}
+
+
+#
+# sorted_worksheets
+#   One page of the worksheets in the query sorted by one of WORKSHEET_SORTS.
+#   Raises ValueError when the cursor is not one of ours.
+#
+def sorted_worksheets(query, sort, per_page, after=None):
+    columns = WORKSHEET_SORTS[sort]
+    return seek(query, columns, per_page, lambda worksheet: [getattr(worksheet, column.key) for column in columns],
+        after=after)
+
+
+#
+# favourite_counts
+#   How many learners have each of the given worksheets as a favourite, in one
+#   grouped query. Worksheets nobody likes are left out.
+#
+def favourite_counts(worksheets):
+    ids = [worksheet.id for worksheet in worksheets]
+    if not ids :
+        return {}
+
+    rows = db.session.query(worksheets_identifier.c.worksheet_id, func.count()) \
+        .filter(worksheets_identifier.c.worksheet_id.in_(ids)) \
+        .group_by(worksheets_identifier.c.worksheet_id)
+    return dict(rows)
+
+
+#
+# recommended_for_worksheet
+#   The worksheets learners who like this one also like, most alike first. They
+#   were worked out ahead of time (see app/recommendations.py) so this is one
+#   lookup in the worksheet's index.
+#
+def recommended_for_worksheet(worksheet_id, limit):
+    return worksheets_query().join(WorksheetNeighbour, WorksheetNeighbour.neighbour_id == Worksheet.id) \
+        .filter(WorksheetNeighbour.worksheet_id == worksheet_id) \
+        .order_by(WorksheetNeighbour.score.desc(), Worksheet.id) \
+        .limit(limit).all()
+
+
+#
+# related_to_worksheet
+#   The worksheets with the most words like this one's, worked out ahead of time
+#   (see app/related.py)
+#
+def related_to_worksheet(worksheet_id, limit):
+    return worksheets_query().join(RelatedWorksheet, RelatedWorksheet.related_id == Worksheet.id) \
+        .filter(RelatedWorksheet.worksheet_id == worksheet_id) \
+        .order_by(RelatedWorksheet.score.desc(), Worksheet.id) \
+        .limit(limit).all()
+
+
+#
+# recommended_for_learner
+#   The neighbours of all of a learner's favourites that they do not have yet,
+#   the ones alike to more of them first. The scores are added up by the
+#   database so only the worksheets shown are loaded.
+#
+def recommended_for_learner(learner, limit):
+    favourites = db.session.query(worksheets_identifier.c.worksheet_id) \
+        .filter(worksheets_identifier.c.learner_id == learner.id)
+
+    scores = db.session.query(WorksheetNeighbour.neighbour_id.label('worksheet_id'),
+            func.sum(WorksheetNeighbour.score).label('score')) \
+        .filter(WorksheetNeighbour.worksheet_id.in_(favourites.subquery())) \
+        .filter(~WorksheetNeighbour.neighbour_id.in_(favourites.subquery())) \
+        .group_by(WorksheetNeighbour.neighbour_id) \
+        .subquery()
+
+    return worksheets_query().join(scores, scores.c.worksheet_id == Worksheet.id) \
+        .order_by(scores.c.score.desc(), Worksheet.id) \
+        .limit(limit).all()
+
+
+# the totals on the author dashboard, for all of an author's worksheets and for
+# each category they have written in
+AuthorStats = namedtuple('AuthorStats', ['worksheets', 'views', 'favourites', 'categories'])
+CategoryStats = namedtuple('CategoryStats', ['id', 'name', 'worksheets', 'views', 'favourites'])
+
+
+#
+# author_stats
+#   Worksheets, views and favourites of an author by category. The database adds
+#   them up in one grouped query (the favourites of each worksheet are counted in
+#   a subquery first so they are not multiplied by the join), only the few
+#   category rows are added up here.
+#
+def author_stats(author_id):
+    favourites = db.session.query(worksheets_identifier.c.worksheet_id.label('worksheet_id'),
+            func.count().label('favourites')) \
+        .join(Worksheet, Worksheet.id == worksheets_identifier.c.worksheet_id) \
+        .filter(Worksheet.author_id == author_id) \
+        .group_by(worksheets_identifier.c.worksheet_id) \
+        .subquery()
+
+    rows = db.session.query(WorksheetCategory.id, WorksheetCategory.name, func.count(Worksheet.id),
+            func.coalesce(func.sum(Worksheet.count), 0), func.coalesce(func.sum(favourites.c.favourites), 0)) \
+        .join(Worksheet, Worksheet.category_id == WorksheetCategory.id) \
+        .outerjoin(favourites, favourites.c.worksheet_id == Worksheet.id) \
+        .filter(Worksheet.author_id == author_id) \
+        .group_by(WorksheetCategory.id, WorksheetCategory.name) \
+        .order_by(WorksheetCategory.name) \
+        .all()
+
+    categories = [CategoryStats(*row) for row in rows]
+    return AuthorStats(sum(c.worksheets for c in categories), sum(c.views for c in categories),
+        sum(c.favourites for c in categories), categories)
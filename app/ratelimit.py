@@ -0,0 +1,367 @@
+#
+# Rate Limiting
+#   Every login checks a password (a full pbkdf2 run, see app/passwords.py) and
+#   every click on a worksheet is counted, so one client sending requests as
+#   fast as it can keeps all of the uWSGI workers busy. Each limited endpoint
+#   gets token buckets, one for each client address and one for each account
+#   (the email or username posted to it). A request takes a token from each of
+#   its buckets and the buckets fill up again at the configured rate. When one
+#   is empty the request is answered with 429 and a Retry-After header.
+#
+#   The limits are checked in front of the Flask app (app.wsgi_app is wrapped)
+#   so a refused request never opens the session, touches the database or
+#   hashes anything.
+#
+#   RATE_LIMITS maps endpoints to their limits, for example
+#
+#       'learner.learner_login' : {'methods' : ('POST',), 'ip' : '20/minute', 'account' : '5/minute'}
+#
+#   Limits are a number of requests per second, minute, hour or day, that many
+#   can be sent at once and then they are let through evenly over the period.
+#
+#   The buckets have to be shared by the workers, RATE_LIMIT_STORAGE picks where
+#   they are kept:
+#       'sqlite'    a small sqlite file (RATE_LIMIT_SQLITE_PATH, in the instance
+#                   folder by default) shared by the workers on this server
+#       'redis://'  a Redis (or compatible) server shared by every server, needs
+#                   the redis package
+#       'memory'    only this process
+#
+#   Works like the other extensions (see app/mail.py):
+#       rate_limiter = RateLimiter()
+#       rate_limiter.init_app(app)
+#
+import hashlib
+import io
+import logging
+import math
+import os
+import sqlite3
+import threading
+import time
+from collections import namedtuple
+
+from werkzeug.exceptions import HTTPException
+from werkzeug.formparser import parse_form_data
+from werkzeug.wrappers import Response
+
+log = logging.getLogger(__name__)
+
+PERIODS = {'second' : 1, 'minute' : 60, 'hour' : 3600, 'day' : 86400}
+
+# forms bigger than this are not read to find the account, logins are tiny
+MAX_FORM_BYTES = 64 * 1024
+
+# seconds between removing the buckets that have filled up again
+SWEEP_INTERVAL = 60
+
+DEFAULT_LIMITS = {
+    'learner.learner_login' : {'methods' : ('POST',), 'ip' : '20/minute', 'account' : '5/minute'},
+    'author.author_login' : {'methods' : ('POST',), 'ip' : '20/minute', 'account' : '5/minute'},
+    'auth.login' : {'methods' : ('POST',), 'ip' : '10/minute', 'account' : '5/minute'},
+    'learner.learner_signup' : {'methods' : ('POST',), 'ip' : '5/minute', 'account' : '5/hour'},
+    'worksheets.worksheets_count' : {'methods' : ('GET', 'POST'), 'ip' : '120/minute'},
+}
+
+# burst: how many tokens a full bucket holds, rate: tokens added each second
+Limit = namedtuple('Limit', ['burst', 'rate'])
+
+
+#
+# parse_limit
+#   '5/minute' -> Limit(burst=5, rate=5 / 60)
+#
+def parse_limit(text):
+    count, period = text.split('/')
+    count = int(count)
+    seconds = PERIODS[period.strip().rstrip('s')]
+    if count <= 0 :
+        raise ValueError('A rate limit has to let something through: %r' % text)
+
+    return Limit(count, count / seconds)
+
+
+#
+# fill
+#   The tokens in a bucket now and, if one can be taken, what is left after it.
+#   Returns (tokens, wait), wait is 0 when a token was taken.
+#
+def fill(tokens, updated, limit, now):
+    if tokens == None :
+        tokens = limit.burst
+    else :
+        tokens = min(limit.burst, tokens + (now - updated) * limit.rate)
+
+    if tokens >= 1 :
+        return tokens - 1, 0.0
+
+    return tokens, (1 - tokens) / limit.rate
+
+def full_at(tokens, limit, now):
+    return now + (limit.burst - tokens) / limit.rate
+
+
+class MemoryStorage(object) :
+    """
+    Buckets kept by this process only
+    """
+
+    def __init__(self):
+        self.buckets = {}
+        self.lock = threading.Lock()
+        self.swept = time.time()
+
+    def take(self, key, limit, now):
+        with self.lock :
+            tokens, updated, full = self.buckets.get(key, (None, None, None))
+            tokens, wait = fill(tokens, updated, limit, now)
+            self.buckets[key] = (tokens, now, full_at(tokens, limit, now))
+
+            if now - self.swept > SWEEP_INTERVAL :
+                self.swept = now
+                for old in [key for key, bucket in self.buckets.items() if bucket[2] < now] :
+                    del self.buckets[old]
+
+        return wait
+
+
+class SqliteStorage(object) :
+    """
+    Buckets in a sqlite file shared by the worker processes on one server
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.local = threading.local()
+        self.swept = time.time()
+
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        connection = self.connect()
+        try :
+            connection.execute('CREATE TABLE IF NOT EXISTS buckets (key TEXT PRIMARY KEY, tokens REAL NOT NULL, '
+                'updated REAL NOT NULL, full_at REAL NOT NULL)')
+        finally :
+            connection.close()
+
+    def connect(self):
+        connection = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+        connection.execute('PRAGMA journal_mode=WAL')
+        connection.execute('PRAGMA synchronous=OFF')
+        return connection
+
+    #
+    # connection
+    #   One connection for each thread, made again after a fork
+    #
+    def connection(self):
+        if not getattr(self.local, 'pid', None) == os.getpid() :
+            self.local.connection = self.connect()
+            self.local.pid = os.getpid()
+        return self.local.connection
+
+    def take(self, key, limit, now):
+        connection = self.connection()
+
+        # IMMEDIATE takes the write lock first so two workers cannot both take
+        # the last token
+        connection.execute('BEGIN IMMEDIATE')
+        try :
+            row = connection.execute('SELECT tokens, updated FROM buckets WHERE key = ?', (key,)).fetchone()
+            tokens, wait = fill(*(row or (None, None)), limit, now)
+            connection.execute('INSERT OR REPLACE INTO buckets (key, tokens, updated, full_at) VALUES (?, ?, ?, ?)',
+                (key, tokens, now, full_at(tokens, limit, now)))
+
+            if now - self.swept > SWEEP_INTERVAL :
+                self.swept = now
+                connection.execute('DELETE FROM buckets WHERE full_at < ?', (now,))
+
+            connection.execute('COMMIT')
+        except :
+            connection.execute('ROLLBACK')
+            raise
+
+        return wait
+
+
+# the same as fill() run inside Redis so the read and the write are one step
+REDIS_TAKE = '''
+local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'updated')
+local burst, rate, now = tonumber(ARGV[1]), tonumber(ARGV[2]), tonumber(ARGV[3])
+local tokens = burst
+if bucket[1] then
+    tokens = math.min(burst, tonumber(bucket[1]) + (now - tonumber(bucket[2])) * rate)
+end
+local wait = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+else
+    wait = (1 - tokens) / rate
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'updated', tostring(now))
+redis.call('PEXPIRE', KEYS[1], math.ceil((burst - tokens) / rate * 1000) + 1000)
+return tostring(wait)
+'''
+
+class RedisStorage(object) :
+    """
+    Buckets in a Redis server shared by every server
+    """
+
+    def __init__(self, url):
+        import redis
+
+        self.client = redis.Redis.from_url(url)
+        self.script = self.client.register_script(REDIS_TAKE)
+
+    def take(self, key, limit, now):
+        return float(self.script(keys=['rate_limit:' + key], args=[limit.burst, limit.rate, now]))
+
+
+def make_storage(app):
+    storage = app.config['RATE_LIMIT_STORAGE']
+    if not isinstance(storage, str) :
+        # anything with take(key, limit, now)
+        return storage
+
+    if storage == 'memory' :
+        return MemoryStorage()
+    if storage == 'sqlite' :
+        return SqliteStorage(app.config['RATE_LIMIT_SQLITE_PATH'])
+    if storage.startswith('redis://') or storage.startswith('rediss://') :
+        return RedisStorage(storage)
+
+    raise ValueError('Unknown RATE_LIMIT_STORAGE %r' % storage)
+
+
+def hash_account(value):
+    return hashlib.sha256(value.strip().lower().encode()).hexdigest()[:32]
+
+#
+# posted_account
+#   The email or username posted with the request. The body is read here so it
+#   is put back for the app to read again.
+#
+def posted_account(environ, fields):
+    try :
+        length = int(environ.get('CONTENT_LENGTH') or 0)
+    except ValueError :
+        return None
+
+    if length <= 0 or length > MAX_FORM_BYTES :
+        return None
+
+    body = environ['wsgi.input'].read(length)
+    environ['wsgi.input'] = io.BytesIO(body)
+
+    copy = dict(environ)
+    copy['wsgi.input'] = io.BytesIO(body)
+    stream, form, files = parse_form_data(copy)
+
+    for field in fields :
+        if form.get(field) :
+            return form[field]
+
+    return None
+
+
+def too_many_requests(wait):
+    return Response('Too many requests, please try again later.\n', status=429, mimetype='text/plain',
+        headers={'Retry-After' : str(max(1, int(math.ceil(wait))))})
+
+
+class RateLimitMiddleware(object) :
+    """
+    Refuses requests to the limited endpoints when their buckets are empty
+    """
+
+    def __init__(self, wsgi_app, app):
+        self.wsgi_app = wsgi_app
+        self.url_map = app.url_map
+        self.storage = make_storage(app)
+        self.fields = app.config['RATE_LIMIT_ACCOUNT_FIELDS']
+        self.limits = {}
+        for endpoint, settings in app.config['RATE_LIMITS'].items() :
+            self.limits[endpoint] = (
+                tuple(method.upper() for method in settings.get('methods', ('GET', 'POST'))),
+                parse_limit(settings['ip']) if settings.get('ip') else None,
+                parse_limit(settings['account']) if settings.get('account') else None,
+            )
+
+    def endpoint(self, environ):
+        try :
+            endpoint, arguments = self.url_map.bind_to_environ(environ).match()
+        except HTTPException :
+            return None
+
+        return endpoint
+
+    #
+    # wait
+    #   How long the client has to wait before the request would be let through,
+    #   0 if it is let through now (and its tokens have been taken)
+    #
+    def wait(self, environ):
+        endpoint = self.endpoint(environ)
+        if not endpoint in self.limits :
+            return 0.0
+
+        methods, ip_limit, account_limit = self.limits[endpoint]
+        if not environ.get('REQUEST_METHOD', 'GET') in methods :
+            return 0.0
+
+        now = time.time()
+        if not ip_limit == None :
+            wait = self.storage.take('%s|ip|%s' % (endpoint, environ.get('REMOTE_ADDR', '')), ip_limit, now)
+            if wait > 0 :
+                log.info('Rate limited %s from %s', endpoint, environ.get('REMOTE_ADDR'))
+                return wait
+
+        if not account_limit == None :
+            account = posted_account(environ, self.fields)
+            if not account == None :
+                wait = self.storage.take('%s|account|%s' % (endpoint, hash_account(account)), account_limit, now)
+                if wait > 0 :
+                    log.info('Rate limited %s for one account from %s', endpoint, environ.get('REMOTE_ADDR'))
+                    return wait
+
+        return 0.0
+
+    def __call__(self, environ, start_response):
+        try :
+            wait = self.wait(environ)
+        except Exception :
+            # a broken limiter should not take the site down with it
+            log.exception('Could not check the rate limits')
+            wait = 0.0
+
+        if wait > 0 :
+            return too_many_requests(wait)(environ, start_response)
+
+        return self.wsgi_app(environ, start_response)
+
+
+class RateLimiter(object) :
+    """
+    Token bucket rate limits for the endpoints that are expensive to abuse
+    """
+
+    def __init__(self, app=None):
+        if not app == None :
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('RATE_LIMIT_ENABLED', True)
+        app.config.setdefault('RATE_LIMIT_STORAGE', 'sqlite')
+        app.config.setdefault('RATE_LIMIT_SQLITE_PATH', os.path.join(app.instance_path, 'ratelimit.sqlite'))
+        app.config.setdefault('RATE_LIMIT_ACCOUNT_FIELDS', ('email', 'username'))
+        app.config.setdefault('RATE_LIMITS', DEFAULT_LIMITS)
+
+        if not app.config['RATE_LIMIT_ENABLED'] :
+            return
+
+        middleware = RateLimitMiddleware(app.wsgi_app, app)
+        app.extensions['rate_limiter'] = middleware
+        app.wsgi_app = middleware
+
+
+rate_limiter = RateLimiter()
@@ -0,0 +1,281 @@
+#
+# Recommendations
+#   "Learners who liked this also liked". Two worksheets are alike when the same
+#   learners have them as favourites (worksheets_identifier). For every
+#   worksheet the RECOMMENDATIONS_TOP_K most alike are kept in the
+#   worksheet_neighbours table so a page only has to look them up (see
+#   recommended_for_worksheet and recommended_for_learner in app/queries.py).
+#
+#   How alike two worksheets are is how many learners like both divided by the
+#   square root of how many like each (cosine similarity of their columns in
+#   the learner x worksheet matrix).
+#
+#   The whole table is worked out again by a batch job, from cron for example
+#       flask recommendations rebuild
+#   which multiplies the sparse matrix by itself with SciPy when it is
+#   installed and counts the pairs of each learner's favourites otherwise.
+#
+#   Between rebuilds add_favourite keeps it close: the worksheet that was liked
+#   gets its neighbours worked out again and it is offered to each of the
+#   learner's other favourites, all in the transaction that adds the favourite.
+#   It is not exact. The liked worksheet now has one more learner, which lowers
+#   its score in the lists of the worksheets this learner does not like, and
+#   those keep the old, too high score until the next rebuild. A deleted
+#   worksheet is taken out of every list straight away.
+#
+#   Works like the other extensions (see app/mail.py):
+#       recommendations = Recommendations()
+#       recommendations.init_app(app)
+#
+import logging
+import math
+from collections import Counter, defaultdict
+
+import click
+from flask import current_app
+from flask.cli import AppGroup
+from sqlalchemy import and_, bindparam, func, or_, select
+
+from .database import db
+from .models import WorksheetNeighbour, worksheets_identifier
+
+try :
+    import numpy
+    from scipy import sparse
+except ImportError :
+    numpy = None
+    sparse = None
+
+log = logging.getLogger(__name__)
+
+# neighbours are written this many rows at a time by rebuild
+CHUNK = 1000
+
+
+def similarity(together, likes, other_likes):
+    return together / math.sqrt(likes * other_likes)
+
+
+#
+# top_neighbours
+#   The k worksheets most alike to one, as (neighbour_id, together, score) with
+#   the best first (the smaller id first when they tie)
+#
+#   together: {neighbour_id : learners who like both}
+#   likes: how many learners like the worksheet
+#   counts: {worksheet_id : learners who like it}, for at least the neighbours
+#
+def top_neighbours(together, likes, counts, k):
+    neighbours = [(neighbour_id, n, similarity(n, likes, counts[neighbour_id])) for neighbour_id, n in together.items() if n]
+    neighbours.sort(key=lambda neighbour: (-neighbour[2], neighbour[0]))
+    return neighbours[:k]
+
+
+#
+# neighbours_in_python / neighbours_with_scipy
+#   {worksheet_id : top_neighbours()} for every worksheet someone likes, from the
+#   (learner_id, worksheet_id) pairs of worksheets_identifier
+#
+def neighbours_in_python(pairs, k):
+    favourites = defaultdict(list)
+    counts = Counter()
+    for learner_id, worksheet_id in pairs :
+        favourites[learner_id].append(worksheet_id)
+        counts[worksheet_id] += 1
+
+    together = defaultdict(Counter)
+    for worksheet_ids in favourites.values() :
+        for worksheet_id in worksheet_ids :
+            for other_id in worksheet_ids :
+                if not other_id == worksheet_id :
+                    together[worksheet_id][other_id] += 1
+
+    return {worksheet_id : top_neighbours(together[worksheet_id], counts[worksheet_id], counts, k) for worksheet_id in counts}
+
+def neighbours_with_scipy(pairs, k):
+    if not pairs :
+        return {}
+
+    learner_ids, worksheet_ids = zip(*pairs)
+    learners, rows = numpy.unique(numpy.asarray(learner_ids), return_inverse=True)
+    ids, columns = numpy.unique(numpy.asarray(worksheet_ids), return_inverse=True)
+
+    likes = sparse.csr_matrix((numpy.ones(len(pairs)), (rows, columns)), shape=(len(learners), len(ids)))
+    counts = numpy.asarray(likes.sum(axis=0)).ravel()
+
+    # worksheet x worksheet, how many learners like both
+    together = (likes.T @ likes).tocsr()
+    together.setdiag(0)
+    together.eliminate_zeros()
+
+    neighbours = {}
+    for column, worksheet_id in enumerate(ids) :
+        start, end = together.indptr[column], together.indptr[column + 1]
+        others = together.indices[start:end]
+        shared = together.data[start:end]
+        scores = shared / numpy.sqrt(counts[column] * counts[others])
+
+        best = numpy.lexsort((ids[others], -scores))[:k]
+        neighbours[int(worksheet_id)] = [(int(ids[others[i]]), int(shared[i]), float(scores[i])) for i in best]
+
+    return neighbours
+
+def all_neighbours(pairs, k):
+    if sparse == None :
+        return neighbours_in_python(pairs, k)
+    return neighbours_with_scipy(pairs, k)
+
+
+def neighbour_rows(worksheet_id, neighbours):
+    return [dict(worksheet_id=worksheet_id, neighbour_id=neighbour_id, together=together, score=score)
+        for neighbour_id, together, score in neighbours]
+
+
+class RecommendationsState(object) :
+    """
+    The settings of one app
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self.k = app.config['RECOMMENDATIONS_TOP_K']
+
+    #
+    # rebuild
+    #   Works out the neighbours of every worksheet and replaces the table in one
+    #   transaction. Returns how many worksheets have neighbours.
+    #
+    def rebuild(self):
+        table = WorksheetNeighbour.__table__
+
+        with db.get_engine(self.app).begin() as connection :
+            pairs = connection.execute(select([worksheets_identifier.c.learner_id, worksheets_identifier.c.worksheet_id])).fetchall()
+            neighbours = all_neighbours([tuple(pair) for pair in pairs], self.k)
+
+            rows = []
+            for worksheet_id, best in neighbours.items() :
+                rows.extend(neighbour_rows(worksheet_id, best))
+
+            connection.execute(table.delete())
+            for start in range(0, len(rows), CHUNK) :
+                connection.execute(table.insert(), rows[start:start + CHUNK])
+
+        scored = len([best for best in neighbours.values() if best])
+        log.info('Rebuilt the recommendations of %d worksheets', scored)
+        return scored
+
+    #
+    # added_favourite
+    #   Brings the neighbours up to date after the learner liked the worksheet,
+    #   in the connection's transaction (which has to see the new favourite)
+    #
+    def added_favourite(self, connection, learner_id, worksheet_id):
+        liked = worksheets_identifier.alias('liked')
+        other = worksheets_identifier.alias('other')
+        table = WorksheetNeighbour.__table__
+
+        # every worksheet liked by someone who likes this one, with how many
+        together = dict(connection.execute(select([other.c.worksheet_id, func.count()])
+            .select_from(liked.join(other, liked.c.learner_id == other.c.learner_id))
+            .where(and_(liked.c.worksheet_id == worksheet_id, other.c.worksheet_id != worksheet_id))
+            .group_by(other.c.worksheet_id)).fetchall())
+
+        counts = dict(connection.execute(select([worksheets_identifier.c.worksheet_id, func.count()])
+            .where(worksheets_identifier.c.worksheet_id.in_(list(together) + [worksheet_id]))
+            .group_by(worksheets_identifier.c.worksheet_id)).fetchall())
+
+        likes = counts.get(worksheet_id, 0)
+        if not likes :
+            return
+
+        connection.execute(table.delete().where(table.c.worksheet_id == worksheet_id))
+        best = top_neighbours(together, likes, counts, self.k)
+        if best :
+            connection.execute(table.insert(), neighbour_rows(worksheet_id, best))
+
+        # the learner's other favourites are the only worksheets that are now
+        # liked together with this one more often than before
+        favourites = [id for (id,) in connection.execute(select([worksheets_identifier.c.worksheet_id])
+            .where(and_(worksheets_identifier.c.learner_id == learner_id, worksheets_identifier.c.worksheet_id != worksheet_id)))]
+        if not favourites :
+            return
+
+        current = defaultdict(list)
+        for row in connection.execute(select([table.c.worksheet_id, table.c.neighbour_id, table.c.together, table.c.score])
+                .where(and_(table.c.worksheet_id.in_(favourites), table.c.neighbour_id != worksheet_id))) :
+            current[row.worksheet_id].append((row.neighbour_id, row.together, row.score))
+
+        offered, evicted = [], []
+        for favourite_id in favourites :
+            offer = (worksheet_id, together[favourite_id], similarity(together[favourite_id], counts[favourite_id], likes))
+            neighbours = sorted(current[favourite_id] + [offer], key=lambda neighbour: (-neighbour[2], neighbour[0]))
+
+            if offer in neighbours[:self.k] :
+                offered.extend(neighbour_rows(favourite_id, [offer]))
+            evicted.extend(dict(worksheet_id=favourite_id, neighbour_id=neighbour[0])
+                for neighbour in neighbours[self.k:] if not neighbour == offer)
+
+        connection.execute(table.delete().where(and_(table.c.worksheet_id.in_(favourites), table.c.neighbour_id == worksheet_id)))
+        if evicted :
+            connection.execute(table.delete().where(and_(table.c.worksheet_id == bindparam('worksheet_id'),
+                table.c.neighbour_id == bindparam('neighbour_id'))), evicted)
+        if offered :
+            connection.execute(table.insert(), offered)
+
+    #
+    # removed
+    #   Forgets a worksheet that has been deleted, so it no longer takes a place
+    #   in the lists of other worksheets
+    #
+    def removed(self, connection, worksheet_id):
+        table = WorksheetNeighbour.__table__
+        connection.execute(table.delete().where(or_(table.c.worksheet_id == worksheet_id, table.c.neighbour_id == worksheet_id)))
+
+
+recommendations_cli = AppGroup('recommendations', help='Look after the worksheet recommendations.')
+
+@recommendations_cli.command('rebuild')
+def rebuild_command():
+    """
+    Work out the neighbours of every worksheet again from the favourites
+    """
+    scored = current_app.extensions['recommendations'].rebuild()
+    click.echo('%d worksheets have recommendations' % scored)
+
+
+class Recommendations(object) :
+    """
+    Worksheets liked by the same learners, worked out ahead of time
+    """
+
+    def __init__(self, app=None):
+        if not app == None :
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('RECOMMENDATIONS_TOP_K', 10)
+        app.config.setdefault('RECOMMENDATIONS_SHOWN', 5)
+
+        app.extensions['recommendations'] = RecommendationsState(app)
+        app.cli.add_command(recommendations_cli)
+
+    @property
+    def state(self):
+        return current_app.extensions['recommendations']
+
+    #
+    # added_favourite
+    #   Call after adding a favourite to the session, before committing it
+    #
+    def added_favourite(self, learner_id, worksheet_id):
+        db.session.flush()
+        self.state.added_favourite(db.session.connection(), learner_id, worksheet_id)
+
+    def removed(self, worksheet_id):
+        self.state.removed(db.session.connection(), worksheet_id)
+
+    def rebuild(self):
+        return self.state.rebuild()
+
+
+recommendations = Recommendations()
@@ -0,0 +1,362 @@
+#
+# Related Worksheets
+#   Worksheets about the same thing, going by the words in their titles and
+#   pdfs. The search index already keeps the text of every pdf (read with
+#   PyPDF2 when the pdf is uploaded, see app/search.py) so it is taken from
+#   search_documents instead of reading the pdfs again.
+#
+#   Each worksheet's words are weighted with TF-IDF (words used a lot in it
+#   but in few other worksheets weigh the most) and two worksheets are as
+#   related as the cosine of their weights. The RELATED_TOP_N most related to
+#   each worksheet are kept in the related_worksheets table so a page only has
+#   to look them up (see related_to_worksheet in app/queries.py).
+#
+#   The whole catalog is worked out again by a batch job, from cron for example
+#       flask related rebuild
+#   which multiplies the sparse matrix of weights by itself with SciPy when it
+#   is installed and adds up the shared words in plain Python otherwise.
+#
+#   Between rebuilds add_worksheet and edit_worksheet work out only the
+#   worksheet that changed: its weights with the current word counts, the
+#   worksheets sharing its RELATED_QUERY_TERMS heaviest words and where it
+#   now fits in their lists. The other worksheets keep the weights they had
+#   until the next rebuild.
+#
+#   Works like the other extensions (see app/mail.py):
+#       related_worksheets = RelatedWorksheets()
+#       related_worksheets.init_app(app)
+#
+import logging
+import math
+from collections import Counter, defaultdict
+
+import click
+from flask import current_app
+from flask.cli import AppGroup
+from sqlalchemy import and_, bindparam, func, or_, select
+
+from .database import db
+from .models import RelatedWorksheet, SearchDocument, WorksheetTerm
+from .search import STOPWORDS, TITLE_WEIGHT, WORKSHEET, words
+
+try :
+    import numpy
+    from scipy import sparse
+except ImportError :
+    numpy = None
+    sparse = None
+
+log = logging.getLogger(__name__)
+
+# rows are written (and terms looked up) this many at a time
+CHUNK = 500
+
+
+#
+# term_counts
+#   The words of a worksheet and how many times each is used, the title
+#   counts more like it does for search
+#
+def term_counts(title, content):
+    counts = Counter(word for word in words(content or '') if not word in STOPWORDS)
+    for word in words(title or '') :
+        if not word in STOPWORDS :
+            counts[word] += TITLE_WEIGHT
+    return counts
+
+def idf(documents, having):
+    return math.log((1 + documents) / (1 + having)) + 1
+
+#
+# tf_idf
+#   {term : weight} for a worksheet's term_counts, normalised so the weights
+#   squared add up to 1
+#
+#   documents: how many worksheets there are
+#   df: {term : how many worksheets use it}
+#
+def tf_idf(counts, documents, df):
+    weights = {term : (1 + math.log(count)) * idf(documents, df[term]) for term, count in counts.items()}
+    norm = math.sqrt(sum(weight * weight for weight in weights.values()))
+    return {term : weight / norm for term, weight in weights.items()} if norm else {}
+
+
+#
+# best_related
+#   The n best (related_id, score), best first (the smaller id first when they
+#   tie) from {related_id : score}
+#
+def best_related(scores, n):
+    best = sorted(((related_id, score) for related_id, score in scores.items() if score > 0),
+        key=lambda related: (-related[1], related[0]))
+    return best[:n]
+
+
+#
+# related_in_python / related_with_scipy
+#   The weights of every worksheet and the best related to each from
+#   {worksheet_id : term_counts()}, as ({worksheet_id : tf_idf()},
+#   {worksheet_id : best_related()})
+#
+def related_in_python(counts, n):
+    df = Counter()
+    for terms in counts.values() :
+        df.update(terms.keys())
+
+    vectors = {worksheet_id : tf_idf(terms, len(counts), df) for worksheet_id, terms in counts.items()}
+
+    postings = defaultdict(list)
+    for worksheet_id, vector in vectors.items() :
+        for term, weight in vector.items() :
+            postings[term].append((worksheet_id, weight))
+
+    related = {}
+    for worksheet_id, vector in vectors.items() :
+        scores = defaultdict(float)
+        for term, weight in vector.items() :
+            for other_id, other_weight in postings[term] :
+                if not other_id == worksheet_id :
+                    scores[other_id] += weight * other_weight
+        related[worksheet_id] = best_related(scores, n)
+
+    return vectors, related
+
+def related_with_scipy(counts, n):
+    if not counts :
+        return {}, {}
+
+    ids = numpy.asarray(sorted(counts))
+    vocabulary = {}
+    rows, columns, values = [], [], []
+    for row, worksheet_id in enumerate(ids) :
+        for term, count in counts[int(worksheet_id)].items() :
+            rows.append(row)
+            columns.append(vocabulary.setdefault(term, len(vocabulary)))
+            values.append(count)
+
+    terms = numpy.empty(len(vocabulary), dtype=object)
+    for term, column in vocabulary.items() :
+        terms[column] = term
+
+    matrix = sparse.csr_matrix((numpy.asarray(values, dtype=float), (rows, columns)), shape=(len(ids), len(vocabulary)))
+    df = numpy.bincount(matrix.indices, minlength=len(vocabulary))
+    matrix.data = (1 + numpy.log(matrix.data)) * (numpy.log((1 + len(ids)) / (1 + df)) + 1)[matrix.indices]
+
+    norms = numpy.sqrt(numpy.asarray(matrix.multiply(matrix).sum(axis=1)).ravel())
+    norms[norms == 0] = 1
+    matrix = sparse.diags(1 / norms) @ matrix
+
+    similar = (matrix @ matrix.T).tocsr()
+    similar.setdiag(0)
+    similar.eliminate_zeros()
+
+    vectors, related = {}, {}
+    for row, worksheet_id in enumerate(ids) :
+        start, end = matrix.indptr[row], matrix.indptr[row + 1]
+        vectors[int(worksheet_id)] = dict(zip(terms[matrix.indices[start:end]], matrix.data[start:end].tolist()))
+
+        start, end = similar.indptr[row], similar.indptr[row + 1]
+        others, scores = similar.indices[start:end], similar.data[start:end]
+        best = numpy.lexsort((ids[others], -scores))[:n]
+        related[int(worksheet_id)] = [(int(ids[others[i]]), float(scores[i])) for i in best if scores[i] > 0]
+
+    return vectors, related
+
+def all_related(counts, n):
+    if sparse == None :
+        return related_in_python(counts, n)
+    return related_with_scipy(counts, n)
+
+
+def chunks(items):
+    items = list(items)
+    for start in range(0, len(items), CHUNK) :
+        yield items[start:start + CHUNK]
+
+
+class RelatedState(object) :
+    """
+    The settings of one app
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self.n = app.config['RELATED_TOP_N']
+        self.query_terms = app.config['RELATED_QUERY_TERMS']
+
+    #
+    # rebuild
+    #   Works out the weights and related worksheets of every worksheet the
+    #   search has indexed and replaces both tables in one transaction. Returns
+    #   how many worksheets have related ones.
+    #
+    def rebuild(self):
+        documents = SearchDocument.__table__
+        terms = WorksheetTerm.__table__
+        table = RelatedWorksheet.__table__
+
+        with db.get_engine(self.app).begin() as connection :
+            counts = {row.object_id : term_counts(row.title, row.content) for row in connection.execute(
+                select([documents.c.object_id, documents.c.title, documents.c.content]).where(documents.c.kind == WORKSHEET))}
+            vectors, related = all_related(counts, self.n)
+
+            connection.execute(terms.delete())
+            for rows in chunks(dict(worksheet_id=worksheet_id, term=term, count=counts[worksheet_id][term], weight=weight)
+                    for worksheet_id, vector in vectors.items() for term, weight in vector.items()) :
+                connection.execute(terms.insert(), rows)
+
+            connection.execute(table.delete())
+            for rows in chunks(dict(worksheet_id=worksheet_id, related_id=related_id, score=score)
+                    for worksheet_id, best in related.items() for related_id, score in best) :
+                connection.execute(table.insert(), rows)
+
+        scored = len([best for best in related.values() if best])
+        log.info('Rebuilt the related worksheets of %d worksheets', scored)
+        return scored
+
+    #
+    # removed
+    #   Forgets a worksheet that has been deleted
+    #
+    def removed(self, connection, worksheet_id):
+        table = RelatedWorksheet.__table__
+        connection.execute(WorksheetTerm.__table__.delete().where(WorksheetTerm.worksheet_id == worksheet_id))
+        connection.execute(table.delete().where(or_(table.c.worksheet_id == worksheet_id, table.c.related_id == worksheet_id)))
+
+    #
+    # refresh
+    #   Works out one worksheet again after it was added or changed, in the
+    #   connection's transaction (which has to see its search document). Nothing
+    #   is written when its words are the same as before.
+    #
+    def refresh(self, connection, worksheet_id):
+        documents = SearchDocument.__table__
+        terms = WorksheetTerm.__table__
+        table = RelatedWorksheet.__table__
+
+        document = connection.execute(select([documents.c.title, documents.c.content])
+            .where(and_(documents.c.kind == WORKSHEET, documents.c.object_id == worksheet_id))).first()
+        if document == None :
+            self.removed(connection, worksheet_id)
+            return
+
+        counts = term_counts(document.title, document.content)
+        old = dict(connection.execute(select([terms.c.term, terms.c.count]).where(terms.c.worksheet_id == worksheet_id)).fetchall())
+        if old == counts :
+            return
+
+        connection.execute(terms.delete().where(terms.c.worksheet_id == worksheet_id))
+        connection.execute(table.delete().where(or_(table.c.worksheet_id == worksheet_id, table.c.related_id == worksheet_id)))
+        if not counts :
+            return
+
+        # the word counts of the other worksheets, this one counts as well
+        total = connection.execute(select([func.count(func.distinct(terms.c.worksheet_id))])).scalar() + 1
+        df = Counter(counts.keys())
+        for batch in chunks(counts) :
+            df.update(dict(connection.execute(select([terms.c.term, func.count()])
+                .where(terms.c.term.in_(batch)).group_by(terms.c.term)).fetchall()))
+
+        vector = tf_idf(counts, total, df)
+        for rows in chunks(dict(worksheet_id=worksheet_id, term=term, count=counts[term], weight=weight)
+                for term, weight in vector.items()) :
+            connection.execute(terms.insert(), rows)
+
+        # the other worksheets with its heaviest words, using the weights they
+        # were given when they were last worked out
+        heaviest = sorted(vector, key=lambda term: (-vector[term], term))[:self.query_terms]
+        scores = defaultdict(float)
+        for row in connection.execute(select([terms.c.worksheet_id, terms.c.term, terms.c.weight])
+                .where(and_(terms.c.term.in_(heaviest), terms.c.worksheet_id != worksheet_id))) :
+            scores[row.worksheet_id] += vector[row.term] * row.weight
+
+        best = best_related(scores, self.n)
+        if best :
+            connection.execute(table.insert(), [dict(worksheet_id=worksheet_id, related_id=related_id, score=score)
+                for related_id, score in best])
+
+        self.offer(connection, worksheet_id, scores)
+
+    #
+    # offer
+    #   Puts the worksheet in the lists of the others it is related to when it
+    #   is one of their best, pushing out the worst when a list is full
+    #
+    def offer(self, connection, worksheet_id, scores):
+        table = RelatedWorksheet.__table__
+        others = [other_id for other_id, score in scores.items() if score > 0]
+        if not others :
+            return
+
+        current = defaultdict(list)
+        for batch in chunks(others) :
+            for row in connection.execute(select([table.c.worksheet_id, table.c.related_id, table.c.score])
+                    .where(table.c.worksheet_id.in_(batch))) :
+                current[row.worksheet_id].append((row.related_id, row.score))
+
+        offered, evicted = [], []
+        for other_id in others :
+            offer = (worksheet_id, scores[other_id])
+            related = sorted(current[other_id] + [offer], key=lambda related: (-related[1], related[0]))
+
+            if offer in related[:self.n] :
+                offered.append(dict(worksheet_id=other_id, related_id=worksheet_id, score=offer[1]))
+            evicted.extend(dict(worksheet_id=other_id, related_id=related_id)
+                for related_id, score in related[self.n:] if not related_id == worksheet_id)
+
+        if evicted :
+            connection.execute(table.delete().where(and_(table.c.worksheet_id == bindparam('worksheet_id'),
+                table.c.related_id == bindparam('related_id'))), evicted)
+        if offered :
+            connection.execute(table.insert(), offered)
+
+
+related_cli = AppGroup('related', help='Look after the related worksheets.')
+
+@related_cli.command('rebuild')
+def rebuild_command():
+    """
+    Work out the related worksheets of the whole catalog again
+    """
+    scored = current_app.extensions['related_worksheets'].rebuild()
+    click.echo('%d worksheets have related worksheets' % scored)
+
+
+class RelatedWorksheets(object) :
+    """
+    Worksheets with words like each other's, worked out ahead of time
+    """
+
+    def __init__(self, app=None):
+        if not app == None :
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('RELATED_TOP_N', 10)
+        app.config.setdefault('RELATED_SHOWN', 5)
+        app.config.setdefault('RELATED_QUERY_TERMS', 50)
+
+        app.extensions['related_worksheets'] = RelatedState(app)
+        app.cli.add_command(related_cli)
+
+    @property
+    def state(self):
+        return current_app.extensions['related_worksheets']
+
+    #
+    # refresh / removed
+    #   Call after adding, changing or deleting a worksheet in the session,
+    #   before committing it. A new worksheet gets its id from the flush.
+    #
+    def refresh(self, worksheet):
+        db.session.flush()
+        self.state.refresh(db.session.connection(), worksheet.id)
+
+    def removed(self, worksheet_id):
+        self.state.removed(db.session.connection(), worksheet_id)
+
+    def rebuild(self):
+        return self.state.rebuild()
+
+
+related_worksheets = RelatedWorksheets()
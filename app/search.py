@@ -0,0 +1,532 @@
+#
+# Search
+#   Full text search over the worksheets (their name, author, category and the
+#   text of their pdf) and the blog posts (their title, category and content),
+#   ranked by relevance, at /search (see app/other/views.py).
+#
+#   Each worksheet and post has a row in search_documents with the text that is
+#   searched. The rows are kept up to date after every flush that adds, edits or
+#   deletes a worksheet or post, or renames the category or author they show, in
+#   the same transaction as the change. The pdf is only read again when it
+#   changes.
+#
+#   SEARCH_BACKEND picks how the documents are searched:
+#       'fts5'      an FTS5 table over search_documents (sqlite), ranked by bm25
+#       'fulltext'  a FULLTEXT index on search_documents (MySQL)
+#       'inverted'  the search_postings table kept here, for databases with
+#                   neither, ranked by bm25 without the length normalisation
+#       'auto'      (the default) the first of these the database can do
+#
+#   The text of the pdfs is read with PyPDF2. SEARCH_PDF_EXTRACTOR can be set to
+#   any function(pdf_path, max_chars) instead, at most SEARCH_PDF_MAX_CHARS of it
+#   is kept.
+#
+#   Worksheets and posts added before search existed (or added without the ORM,
+#   like the benchmark seeds) are indexed with
+#       flask search rebuild
+#
+#   Works like the other extensions (see app/mail.py):
+#       search_index = SearchIndex()
+#       search_index.init_app(app)
+#
+import html
+import logging
+import math
+import os
+import re
+from collections import Counter, namedtuple
+
+import click
+from flask import current_app, has_app_context
+from flask.cli import AppGroup
+from sqlalchemy import DDL, case, event, func, inspect, literal, select, text
+from sqlalchemy.exc import DBAPIError
+
+from .database import db
+from .models import Author, Post, PostCategory, SearchDocument, SearchPosting, Worksheet, WorksheetCategory
+from .queries import worksheets_query
+
+log = logging.getLogger(__name__)
+
+WORKSHEET = 'worksheet'
+POST = 'post'
+
+# a word counts this many times when it is in the title or the tags
+TITLE_WEIGHT = 3
+TAGS_WEIGHT = 2
+
+# words that are too common to be worth searching for
+STOPWORDS = frozenset('''
+    a an and are as at be but by for from has have in is it its of on or that the
+    this to was were will with
+'''.split())
+
+WORD = re.compile(r'[^\W_]+')
+TAG = re.compile(r'<[^>]+>')
+
+# how many worksheets or posts are indexed at once by rebuild
+REBUILD_BATCH = 500
+
+# a worksheet or post found by search() and a page of them
+SearchResult = namedtuple('SearchResult', ['kind', 'item'])
+SearchPage = namedtuple('SearchPage', ['results', 'page', 'has_next'])
+
+
+def words(text):
+    return [word for word in WORD.findall(text.lower()) if 2 <= len(word) <= 64]
+
+#
+# query_words
+#   The words searched for, without the common ones unless that leaves nothing
+#
+def query_words(text):
+    found = list(dict.fromkeys(words(text)))
+    return [word for word in found if not word in STOPWORDS] or found
+
+def plain_text(content):
+    return html.unescape(TAG.sub(' ', content or ''))
+
+
+#
+# extract_with_pypdf2
+#   The text of a pdf, page by page until there is enough
+#
+def extract_with_pypdf2(pdf_path, max_chars):
+    from PyPDF2 import PdfFileReader
+
+    pages = []
+    length = 0
+    with open(pdf_path, 'rb') as f :
+        reader = PdfFileReader(f, strict=False)
+        for number in range(reader.getNumPages()) :
+            page = reader.getPage(number).extractText()
+            pages.append(page)
+            length += len(page)
+            if length >= max_chars :
+                break
+
+    return '\n'.join(pages)
+
+
+#
+# Backends
+#   add and remove keep a backend's index in step with a row of
+#   search_documents, search returns the (kind, object_id) of the best matches.
+#
+class Fts5Backend(object) :
+    """
+    An FTS5 table that reads its text from search_documents
+    """
+
+    name = 'fts5'
+
+    def add(self, connection, document):
+        connection.execute(text('INSERT INTO search_fts(rowid, title, tags, content) VALUES (:id, :title, :tags, :content)'),
+            **document)
+
+    def remove(self, connection, document):
+        # an external content table has to be told the text that is going away
+        connection.execute(text("INSERT INTO search_fts(search_fts, rowid, title, tags, content) "
+            "VALUES ('delete', :id, :title, :tags, :content)"), **document)
+
+    def clear(self, connection):
+        connection.execute(text("INSERT INTO search_fts(search_fts) VALUES ('delete-all')"))
+
+    def search(self, connection, terms, offset, limit):
+        match = ' OR '.join('"%s"' % term for term in terms)
+        return connection.execute(text('SELECT d.kind, d.object_id FROM search_fts '
+            'JOIN search_documents AS d ON d.id = search_fts.rowid WHERE search_fts MATCH :match '
+            'ORDER BY bm25(search_fts, 10.0, 5.0, 1.0), d.id LIMIT :limit OFFSET :offset'),
+            match=match, limit=limit, offset=offset).fetchall()
+
+
+class FulltextBackend(object) :
+    """
+    MySQL's FULLTEXT index on search_documents
+    """
+
+    name = 'fulltext'
+
+    def add(self, connection, document):
+        pass
+
+    def remove(self, connection, document):
+        pass
+
+    def clear(self, connection):
+        pass
+
+    def search(self, connection, terms, offset, limit):
+        return connection.execute(text('SELECT kind, object_id FROM search_documents '
+            'WHERE MATCH(title, tags, content) AGAINST (:query IN NATURAL LANGUAGE MODE) '
+            'ORDER BY MATCH(title, tags, content) AGAINST (:query IN NATURAL LANGUAGE MODE) DESC, id '
+            'LIMIT :limit OFFSET :offset'), query=' '.join(terms), limit=limit, offset=offset).fetchall()
+
+
+class InvertedBackend(object) :
+    """
+    How often each word is in each document, kept in search_postings
+    """
+
+    name = 'inverted'
+
+    def add(self, connection, document):
+        counts = Counter(words(document['content']))
+        for word in words(document['title']) :
+            counts[word] += TITLE_WEIGHT
+        for word in words(document['tags']) :
+            counts[word] += TAGS_WEIGHT
+
+        if counts :
+            connection.execute(SearchPosting.__table__.insert(),
+                [dict(term=term, document_id=document['id'], count=count) for term, count in counts.items()])
+
+    def remove(self, connection, document):
+        connection.execute(SearchPosting.__table__.delete().where(SearchPosting.document_id == document['id']))
+
+    def clear(self, connection):
+        connection.execute(SearchPosting.__table__.delete())
+
+    def search(self, connection, terms, offset, limit):
+        documents = connection.execute(select([func.count()]).select_from(SearchDocument.__table__)).scalar()
+        frequencies = dict(connection.execute(select([SearchPosting.term, func.count()])
+            .where(SearchPosting.term.in_(terms)).group_by(SearchPosting.term)).fetchall())
+        if not frequencies :
+            return []
+
+        # rarer words count for more, the more often a word is in a document the
+        # less each extra time adds
+        idf = {term : math.log(1 + (documents - n + 0.5) / (n + 0.5)) for term, n in frequencies.items()}
+        weight = case({term : literal(value) for term, value in idf.items()}, value=SearchPosting.term, else_=literal(0.0))
+        score = func.sum(weight * SearchPosting.count * 2.2 / (SearchPosting.count + 1.2))
+
+        return connection.execute(select([SearchDocument.kind, SearchDocument.object_id])
+            .select_from(SearchPosting.__table__.join(SearchDocument.__table__))
+            .where(SearchPosting.term.in_(list(idf)))
+            .group_by(SearchDocument.id, SearchDocument.kind, SearchDocument.object_id)
+            .order_by(score.desc(), SearchDocument.id).limit(limit).offset(offset)).fetchall()
+
+
+BACKENDS = {backend.name : backend for backend in (Fts5Backend(), FulltextBackend(), InvertedBackend())}
+
+
+#
+# The FTS5 table and the FULLTEXT index are made and dropped with
+# search_documents. sqlite without FTS5 simply goes without the table.
+#
+def create_fts5(target, connection, **kw):
+    if not connection.dialect.name == 'sqlite' :
+        return
+
+    try :
+        connection.execute(text("CREATE VIRTUAL TABLE IF NOT EXISTS search_fts USING fts5(title, tags, content, "
+            "content='search_documents', content_rowid='id')"))
+    except DBAPIError :
+        log.warning('This sqlite has no FTS5, search uses its own index')
+
+def drop_fts5(target, connection, **kw):
+    if connection.dialect.name == 'sqlite' :
+        connection.execute(text('DROP TABLE IF EXISTS search_fts'))
+
+event.listen(SearchDocument.__table__, 'after_create', create_fts5)
+event.listen(SearchDocument.__table__, 'before_drop', drop_fts5)
+event.listen(SearchDocument.__table__, 'after_create', DDL('ALTER TABLE search_documents '
+    'ADD FULLTEXT INDEX ix_search_documents_fulltext (title, tags, content)').execute_if(dialect='mysql'))
+
+
+def has_fts5(connection):
+    return not connection.execute(text("SELECT name FROM sqlite_master WHERE name = 'search_fts'")).first() == None
+
+#
+# choose_backend
+#   What SEARCH_BACKEND means for the database the connection is to
+#
+def choose_backend(setting, connection):
+    if not setting == 'auto' :
+        return BACKENDS[setting]
+
+    dialect = connection.dialect.name
+    if dialect == 'sqlite' and has_fts5(connection) :
+        return BACKENDS['fts5']
+    if dialect == 'mysql' :
+        return BACKENDS['fulltext']
+
+    return BACKENDS['inverted']
+
+
+#
+# Documents
+#   The text of each worksheet and post as it is in the database now
+#
+def worksheet_rows(connection, ids):
+    worksheets = Worksheet.__table__
+    authors = Author.__table__
+    categories = WorksheetCategory.__table__
+    return connection.execute(select([worksheets.c.id, worksheets.c.name, worksheets.c.pdf_url,
+            authors.c.name.label('author_name'), authors.c.screenname, categories.c.name.label('category_name')])
+        .select_from(worksheets.outerjoin(authors, authors.c.id == worksheets.c.author_id)
+            .outerjoin(categories, categories.c.id == worksheets.c.category_id))
+        .where(worksheets.c.id.in_(ids))).fetchall()
+
+def post_rows(connection, ids):
+    posts = Post.__table__
+    categories = PostCategory.__table__
+    return connection.execute(select([posts.c.id, posts.c.name, posts.c.content, categories.c.name.label('category_name')])
+        .select_from(posts.outerjoin(categories, categories.c.id == posts.c.category_id))
+        .where(posts.c.id.in_(ids))).fetchall()
+
+def tags(*names):
+    return ' '.join(name for name in names if name)
+
+
+class SearchState(object) :
+    """
+    The settings of one app and the backend it ended up with
+    """
+
+    def __init__(self, app):
+        self.setting = app.config['SEARCH_BACKEND']
+        self.extractor = app.config['SEARCH_PDF_EXTRACTOR']
+        self.max_chars = app.config['SEARCH_PDF_MAX_CHARS']
+        self.upload_folder = app.config['UPLOAD_FOLDER']
+        self.chosen = None
+
+    def backend(self, connection):
+        if self.chosen == None :
+            self.chosen = choose_backend(self.setting, connection)
+        return self.chosen
+
+    #
+    # pdf_text
+    #   Never raises so a pdf that cannot be read does not stop the upload
+    #
+    def pdf_text(self, pdf_url):
+        if not pdf_url :
+            return ''
+
+        try :
+            return (self.extractor(os.path.join(self.upload_folder, pdf_url), self.max_chars) or '')[:self.max_chars]
+        except Exception :
+            log.warning('Could not read the text of %s', pdf_url, exc_info=True)
+            return ''
+
+    #
+    # index
+    #   Brings the documents of the given worksheets or posts up to date, removing
+    #   the ones that no longer exist. The pdfs of the worksheets in read_pdfs are
+    #   read again, the others keep the text they had.
+    #
+    def index(self, connection, kind, ids, read_pdfs=()):
+        ids = list(ids)
+        if not ids :
+            return
+
+        backend = self.backend(connection)
+        documents = SearchDocument.__table__
+        old = {row.object_id : dict(row) for row in connection.execute(documents.select()
+            .where(documents.c.kind == kind).where(documents.c.object_id.in_(ids)))}
+
+        if kind == WORKSHEET :
+            current = {row.id : row for row in worksheet_rows(connection, ids)}
+        else :
+            current = {row.id : row for row in post_rows(connection, ids)}
+
+        for id in ids :
+            document = old.get(id)
+            if not document == None :
+                backend.remove(connection, document)
+
+            row = current.get(id)
+            if row == None :
+                if not document == None :
+                    connection.execute(documents.delete().where(documents.c.id == document['id']))
+                continue
+
+            if kind == WORKSHEET :
+                title, keywords = row.name, tags(row.author_name, row.screenname, row.category_name)
+                if document == None or id in read_pdfs :
+                    content = self.pdf_text(row.pdf_url)
+                else :
+                    content = document['content']
+            else :
+                title, keywords, content = row.name, tags(row.category_name), plain_text(row.content)
+
+            values = dict(title=(title or '')[:200], tags=keywords, content=content)
+            if document == None :
+                result = connection.execute(documents.insert().values(kind=kind, object_id=id, **values))
+                values['id'] = result.inserted_primary_key[0]
+            else :
+                connection.execute(documents.update().where(documents.c.id == document['id']).values(**values))
+                values['id'] = document['id']
+
+            backend.add(connection, values)
+
+    def search(self, connection, terms, offset, limit):
+        return self.backend(connection).search(connection, terms, offset, limit)
+
+    def clear(self, connection):
+        self.backend(connection).clear(connection)
+        connection.execute(SearchPosting.__table__.delete())
+        connection.execute(SearchDocument.__table__.delete())
+
+
+def changed(obj, *names):
+    state = inspect(obj)
+    return any(state.attrs[name].history.has_changes() for name in names)
+
+#
+# index_after_flush
+#   Runs after every flush, in the same transaction, and indexes again whatever
+#   the flush changed that shows up in search
+#
+def index_after_flush(session, flush_context):
+    if not has_app_context() :
+        return
+
+    state = current_app.extensions.get('search_index')
+    if state == None :
+        return
+
+    worksheets = set()
+    read_pdfs = set()
+    posts = set()
+    worksheet_categories = set()
+    post_categories = set()
+    authors = set()
+
+    for obj in session.new :
+        if isinstance(obj, Worksheet) :
+            worksheets.add(obj.id)
+            read_pdfs.add(obj.id)
+        elif isinstance(obj, Post) :
+            posts.add(obj.id)
+
+    for obj in session.dirty :
+        if isinstance(obj, Worksheet) and changed(obj, 'name', 'pdf_url', 'category_id', 'category', 'author_id', 'author') :
+            worksheets.add(obj.id)
+            if changed(obj, 'pdf_url') :
+                read_pdfs.add(obj.id)
+        elif isinstance(obj, Post) and changed(obj, 'name', 'content', 'category_id', 'category') :
+            posts.add(obj.id)
+        elif isinstance(obj, WorksheetCategory) and changed(obj, 'name') :
+            worksheet_categories.add(obj.id)
+        elif isinstance(obj, PostCategory) and changed(obj, 'name') :
+            post_categories.add(obj.id)
+        elif isinstance(obj, Author) and changed(obj, 'name', 'screenname') :
+            authors.add(obj.id)
+
+    for obj in session.deleted :
+        if isinstance(obj, Worksheet) :
+            worksheets.add(obj.id)
+        elif isinstance(obj, Post) :
+            posts.add(obj.id)
+        elif isinstance(obj, WorksheetCategory) :
+            worksheet_categories.add(obj.id)
+        elif isinstance(obj, PostCategory) :
+            post_categories.add(obj.id)
+        elif isinstance(obj, Author) :
+            authors.add(obj.id)
+
+    connection = session.connection()
+
+    # renaming a category or author changes the tags of everything it has
+    if worksheet_categories or authors :
+        table = Worksheet.__table__
+        worksheets.update(id for (id,) in connection.execute(select([table.c.id])
+            .where(table.c.category_id.in_(worksheet_categories) | table.c.author_id.in_(authors))))
+    if post_categories :
+        table = Post.__table__
+        posts.update(id for (id,) in connection.execute(select([table.c.id]).where(table.c.category_id.in_(post_categories))))
+
+    state.index(connection, WORKSHEET, sorted(worksheets), read_pdfs)
+    state.index(connection, POST, sorted(posts))
+
+
+search_cli = AppGroup('search', help='Look after the search index.')
+
+@search_cli.command('rebuild')
+def rebuild_command():
+    """
+    Index every worksheet and post again, reading every pdf
+    """
+    worksheets, posts = search_index.rebuild()
+    click.echo('Indexed %d worksheets and %d posts' % (worksheets, posts))
+
+
+class SearchIndex(object) :
+    """
+    Full text search over the worksheets and blog posts
+    """
+
+    def __init__(self, app=None):
+        if not app == None :
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('SEARCH_BACKEND', 'auto')
+        app.config.setdefault('SEARCH_PDF_EXTRACTOR', extract_with_pypdf2)
+        app.config.setdefault('SEARCH_PDF_MAX_CHARS', 100000)
+
+        app.extensions['search_index'] = SearchState(app)
+        app.cli.add_command(search_cli)
+
+        if not event.contains(db.session, 'after_flush', index_after_flush) :
+            event.listen(db.session, 'after_flush', index_after_flush)
+
+    @property
+    def state(self):
+        return current_app.extensions['search_index']
+
+    def backend(self):
+        return self.state.backend(db.session.connection()).name
+
+    #
+    # search
+    #   A page (counting from 0) of the worksheets and posts that best match the
+    #   words of the query, best first
+    #
+    def search(self, query, page=0, per_page=10):
+        terms = query_words(query or '')
+        if not terms :
+            return SearchPage([], page, False)
+
+        rows = self.state.search(db.session.connection(), terms, page * per_page, per_page + 1)
+        has_next = len(rows) > per_page
+        rows = rows[:per_page]
+
+        worksheet_ids = [object_id for kind, object_id in rows if kind == WORKSHEET]
+        post_ids = [object_id for kind, object_id in rows if kind == POST]
+
+        found = {}
+        if worksheet_ids :
+            found.update(((WORKSHEET, worksheet.id), worksheet) for worksheet in
+                worksheets_query().filter(Worksheet.id.in_(worksheet_ids)))
+        if post_ids :
+            found.update(((POST, post.id), post) for post in Post.query.filter(Post.id.in_(post_ids)))
+
+        results = [SearchResult(kind, found[(kind, object_id)]) for kind, object_id in rows if (kind, object_id) in found]
+        return SearchPage(results, page, has_next)
+
+    #
+    # rebuild
+    #   Empties the index and indexes every worksheet and post again. Returns how
+    #   many of each there were.
+    #
+    def rebuild(self):
+        connection = db.session.connection()
+        self.state.clear(connection)
+        db.session.commit()
+
+        counts = []
+        for kind, table in ((WORKSHEET, Worksheet.__table__), (POST, Post.__table__)) :
+            ids = [id for (id,) in db.session.execute(select([table.c.id]).order_by(table.c.id))]
+            for start in range(0, len(ids), REBUILD_BATCH) :
+                batch = ids[start:start + REBUILD_BATCH]
+                self.state.index(db.session.connection(), kind, batch, batch)
+                db.session.commit()
+            counts.append(len(ids))
+
+        return tuple(counts)
+
+
+search_index = SearchIndex()
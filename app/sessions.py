@@ -0,0 +1,340 @@
+#
+# Server Side Sessions
+#   Flask keeps the session in a cookie signed with SECRET_KEY. Every uWSGI
+#   worker made its own random key so a cookie signed by one worker was thrown
+#   away by the others and learners were logged out at random.
+#
+#   Now the session is kept in the sessions table and the cookie only holds a
+#   random id signed with the key, so any worker (on any server using the same
+#   database) can read it. The table holds a hash of the id, not the id itself.
+#
+#   The key comes from SECRET_KEY (set it in the environment when running more
+#   than one server). Without one a key is made once and kept in the instance
+#   folder so every worker on the server uses the same one.
+#
+#   Each worker keeps the last SESSION_CACHE_SIZE sessions it has read or written
+#   in memory with their version, which goes up every time a session is saved.
+#   Opening a session still asks the table for its version but only gets the
+#   data back when the version is not the one in memory, so a copy another
+#   worker has changed since is never used (or written back over its change).
+#
+#   Sessions are kept for PERMANENT_SESSION_LIFETIME after they were last
+#   changed. Each worker removes expired ones every SESSION_SWEEP_INTERVAL
+#   seconds, or run
+#       flask sessions sweep
+#
+#   SESSION_BACKEND = 'cookie' goes back to Flask's signed cookies.
+#
+#   Works like the other extensions (see app/mail.py):
+#       server_sessions = ServerSessions()
+#       server_sessions.init_app(app)
+#
+import hashlib
+import logging
+import os
+import secrets
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+
+import click
+from flask import current_app, session
+from flask.cli import AppGroup
+from flask.json.tag import TaggedJSONSerializer
+from flask.sessions import SessionInterface, SessionMixin
+from itsdangerous import BadSignature, Signer
+from sqlalchemy import case, null, select
+from werkzeug.datastructures import CallbackDict
+
+from .database import db
+from .models import StoredSession
+
+log = logging.getLogger(__name__)
+
+# unchanged sessions are only written again (to push back when they expire)
+# once this much of their lifetime has gone
+TOUCH_AFTER = 3600
+
+
+#
+# stable_secret_key
+#   The key in the instance folder, made the first time. The first worker to
+#   link its key in place wins and the others read that one.
+#
+def stable_secret_key(instance_path):
+    path = os.path.join(instance_path, 'secret_key')
+    if not os.path.exists(path) :
+        os.makedirs(instance_path, exist_ok=True)
+        handle, temp = tempfile.mkstemp(dir=instance_path)
+        with os.fdopen(handle, 'w') as f :
+            f.write(secrets.token_urlsafe(32))
+        try :
+            os.link(temp, path)
+        except FileExistsError :
+            pass
+        finally :
+            os.remove(temp)
+
+    with open(path) as f :
+        return f.read().strip()
+
+
+def hash_id(sid):
+    return hashlib.sha256(sid.encode()).hexdigest()
+
+
+class ServerSession(CallbackDict, SessionMixin) :
+    """
+    A session kept in the database, the cookie only holds its id
+    """
+
+    def __init__(self, initial=None, sid=None, expires_at=None):
+        def on_update(self):
+            self.modified = True
+
+        CallbackDict.__init__(self, initial, on_update)
+        self.sid = sid
+        self.expires_at = expires_at
+        self.new = sid == None
+        self.modified = False
+
+    #
+    # regenerate
+    #   Keeps what is in the session under a new id and removes the old one, so
+    #   an id someone else saw (or planted) before a login is no good after it
+    #
+    def regenerate(self):
+        if not self.sid == None :
+            current_app.extensions['server_sessions'].delete(self.sid)
+
+        self.sid = None
+        self.expires_at = None
+        self.new = True
+        self.modified = True
+
+
+#
+# regenerate_session
+#   Gives the session of this request a new id when logging in or out. Signed
+#   cookie sessions (SESSION_BACKEND = 'cookie') have no id to change.
+#
+def regenerate_session():
+    regenerate = getattr(session, 'regenerate', None)
+    if not regenerate == None :
+        regenerate()
+
+
+class SessionStore(object) :
+    """
+    The sessions table of one app with the sessions this worker has seen lately
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self.cache_size = app.config['SESSION_CACHE_SIZE']
+        self.sweep_interval = app.config['SESSION_SWEEP_INTERVAL']
+        self.serializer = TaggedJSONSerializer()
+        self.cache = OrderedDict()
+        self.lock = threading.Lock()
+        self.swept = time.time()
+
+    def cached(self, key):
+        with self.lock :
+            entry = self.cache.get(key)
+            if not entry == None :
+                self.cache.move_to_end(key)
+            return entry
+
+    def remember(self, key, version, data):
+        if self.cache_size <= 0 :
+            return
+
+        with self.lock :
+            self.cache[key] = (version, data)
+            self.cache.move_to_end(key)
+            while len(self.cache) > self.cache_size :
+                self.cache.popitem(last=False)
+
+    def forget(self, key):
+        with self.lock :
+            self.cache.pop(key, None)
+
+    #
+    # load
+    #   The data and expiry of a session, or None if there is no such session or
+    #   it has expired. The data is only sent by the database when the copy in
+    #   memory is not the latest version.
+    #
+    def load(self, sid):
+        key = hash_id(sid)
+        cached = self.cached(key)
+        known = -1 if cached == None else cached[0]
+        table = StoredSession.__table__
+
+        data = case([(table.c.version == known, null())], else_=table.c.data)
+        with db.get_engine(self.app).connect() as connection :
+            row = connection.execute(select([table.c.version, table.c.expires_at, data.label('data')])
+                .where(table.c.id == key)).first()
+
+        if row == None :
+            self.forget(key)
+            return None
+
+        if row.data == None :
+            data = cached[1]
+        else :
+            data = row.data
+            self.remember(key, row.version, data)
+
+        if row.expires_at < time.time() :
+            return None
+
+        return self.serializer.loads(data), row.expires_at
+
+    def save(self, sid, values, expires_at):
+        key = hash_id(sid)
+        data = self.serializer.dumps(dict(values))
+        table = StoredSession.__table__
+
+        with db.get_engine(self.app).begin() as connection :
+            updated = connection.execute(table.update().where(table.c.id == key)
+                .values(data=data, expires_at=expires_at, version=table.c.version + 1))
+            if updated.rowcount == 0 :
+                connection.execute(table.insert().values(id=key, data=data, expires_at=expires_at, version=1))
+            version = connection.execute(select([table.c.version]).where(table.c.id == key)).scalar()
+
+        self.remember(key, version, data)
+        self.sweep_if_due()
+
+    def delete(self, sid):
+        key = hash_id(sid)
+        self.forget(key)
+
+        with db.get_engine(self.app).begin() as connection :
+            connection.execute(StoredSession.__table__.delete().where(StoredSession.id == key))
+
+    #
+    # sweep
+    #   Removes the expired sessions. Returns how many there were.
+    #
+    def sweep(self):
+        self.swept = time.time()
+        with db.get_engine(self.app).begin() as connection :
+            removed = connection.execute(StoredSession.__table__.delete().where(StoredSession.expires_at < time.time()))
+
+        return removed.rowcount
+
+    def sweep_if_due(self):
+        if self.sweep_interval <= 0 or time.time() - self.swept < self.sweep_interval :
+            return
+
+        try :
+            self.sweep()
+        except Exception :
+            log.exception('Could not remove expired sessions')
+
+
+class DatabaseSessionInterface(SessionInterface) :
+    """
+    Keeps sessions in the database instead of the cookie
+    """
+
+    salt = 'server-session'
+
+    def signer(self, app):
+        return Signer(app.secret_key, salt=self.salt)
+
+    def open_session(self, app, request):
+        if not app.secret_key :
+            return None
+
+        store = app.extensions['server_sessions']
+        cookie = request.cookies.get(app.session_cookie_name)
+        if not cookie :
+            return ServerSession()
+
+        try :
+            sid = self.signer(app).unsign(cookie).decode()
+        except BadSignature :
+            return ServerSession()
+
+        loaded = store.load(sid)
+        if loaded == None :
+            # never reuse an id the server does not know
+            return ServerSession()
+
+        values, expires_at = loaded
+        return ServerSession(values, sid=sid, expires_at=expires_at)
+
+    def save_session(self, app, session, response):
+        store = app.extensions['server_sessions']
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+
+        if not session :
+            if not session.new :
+                store.delete(session.sid)
+                response.delete_cookie(app.session_cookie_name, domain=domain, path=path)
+            return
+
+        if session.accessed :
+            response.vary.add('Cookie')
+
+        lifetime = app.permanent_session_lifetime.total_seconds()
+        now = time.time()
+        stale = not session.expires_at == None and session.expires_at - now < lifetime - TOUCH_AFTER
+
+        if session.new or session.modified or stale :
+            if session.new :
+                session.sid = secrets.token_urlsafe(32)
+            session.expires_at = now + lifetime
+            store.save(session.sid, session, session.expires_at)
+        elif not self.should_set_cookie(app, session) :
+            return
+
+        response.set_cookie(app.session_cookie_name, self.signer(app).sign(session.sid).decode(),
+            expires=self.get_expiration_time(app, session), httponly=self.get_cookie_httponly(app),
+            domain=domain, path=path, secure=self.get_cookie_secure(app), samesite=self.get_cookie_samesite(app))
+
+
+sessions_cli = AppGroup('sessions', help='Look after the server side sessions.')
+
+@sessions_cli.command('sweep')
+def sweep_command():
+    """
+    Remove the sessions that have expired
+    """
+    removed = current_app.extensions['server_sessions'].sweep()
+    click.echo('Removed %d expired sessions' % removed)
+
+
+class ServerSessions(object) :
+    """
+    Stores sessions in the database so every worker can read them
+    """
+
+    def __init__(self, app=None):
+        if not app == None :
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('SESSION_BACKEND', 'database')
+        app.config.setdefault('SESSION_CACHE_SIZE', 1000)
+        app.config.setdefault('SESSION_SWEEP_INTERVAL', 3600)
+
+        if not app.config.get('SECRET_KEY') :
+            app.config['SECRET_KEY'] = stable_secret_key(app.instance_path)
+
+        if not app.config['SESSION_BACKEND'] == 'database' :
+            return
+
+        app.extensions['server_sessions'] = SessionStore(app)
+        app.session_interface = DatabaseSessionInterface()
+        app.cli.add_command(sessions_cli)
+
+    def sweep(self):
+        return current_app.extensions['server_sessions'].sweep()
+
+
+server_sessions = ServerSessions()
@@ -0,0 +1,185 @@
+#
+# PDF Store
+#   Uploaded worksheet pdfs are stored under the sha256 of their contents
+#   instead of the name they were uploaded with, so two authors uploading
+#   'worksheet.pdf' no longer overwrite each other, the same file uploaded twice
+#   is only kept once and a file at a given url never changes (which lets
+#   /worksheet_pdf/<id>?v=<sha256> be cached forever, see app/delivery.py).
+#
+#   Files live in UPLOAD_FOLDER/PDF_STORE_DIR sharded on the first characters of
+#   the hash so no directory gets too big:
+#
+#       pdfs/3a/7b/3a7bd3e2360a3d29eea436fcfb7e44c735d117c42d1c1835420b6b9942dd4f1b.pdf
+#
+#   The stored_files table counts how many worksheets use each file. Saving a
+#   file adds a reference and releasing it takes one away, both in the same
+#   transaction as the worksheet change. The file itself is only removed after
+#   the commit that drops the last reference.
+#
+#   Files uploaded before the store have no count. Several worksheets can point
+#   at the same one (two uploads of 'worksheet.pdf' used to get the same name),
+#   so such a file is only removed once no worksheet's pdf_url names it.
+#
+#   Works like the other extensions (see app/mail.py):
+#       pdf_store = PdfStore()
+#       pdf_store.init_app(app)
+#
+import hashlib
+import logging
+import os
+import tempfile
+from collections import namedtuple
+
+from flask import current_app, has_app_context
+from sqlalchemy import event
+
+from .database import db
+from .models import StoredFile, Worksheet
+from .thumbnails import thumbnail_path
+
+log = logging.getLogger(__name__)
+
+# how much of an upload is read at once while hashing it
+CHUNK_SIZE = 64 * 1024
+
+# what save() hands back, pdf_url is relative to UPLOAD_FOLDER
+StoredPdf = namedtuple('StoredPdf', ['pdf_url', 'sha256', 'size'])
+
+
+#
+# stored_path
+#   Where a file with the given hash is kept, relative to UPLOAD_FOLDER
+#
+def stored_path(sha256):
+    return '/'.join([current_app.config['PDF_STORE_DIR'], sha256[:2], sha256[2:4], sha256 + '.pdf'])
+
+
+def full_path(pdf_url):
+    return os.path.join(current_app.config['UPLOAD_FOLDER'], pdf_url)
+
+
+#
+# remove_unreferenced
+#   Removes files (and their thumbnails) that no worksheet uses anymore. Runs
+#   after a transaction has ended so the references are checked again on a new
+#   connection in case another upload of the same file was committed in the
+#   meantime. Files from before the store are kept while a worksheet still
+#   points at them.
+#
+def remove_unreferenced(files):
+    if not files or not has_app_context() :
+        return
+
+    with db.get_engine(current_app).connect() as connection :
+        for sha256, pdf_url in files :
+            if not sha256 == None :
+                refs = connection.execute(StoredFile.__table__.select().where(StoredFile.sha256 == sha256)).first()
+                if not refs == None and refs.refs > 0 :
+                    continue
+            else :
+                users = connection.execute(Worksheet.__table__.select().where(Worksheet.pdf_url == pdf_url)).first()
+                if not users == None :
+                    continue
+
+            try :
+                os.remove(full_path(pdf_url))
+            except OSError :
+                log.warning('Could not remove %s', pdf_url)
+
+            if not sha256 == None and os.path.exists(full_path(thumbnail_path(sha256))) :
+                os.remove(full_path(thumbnail_path(sha256)))
+
+def remove_after_commit(session):
+    session.info.pop('pdf_store_written', None)
+    remove_unreferenced(session.info.pop('pdf_store_released', None))
+
+def remove_after_rollback(session):
+    session.info.pop('pdf_store_released', None)
+    remove_unreferenced(session.info.pop('pdf_store_written', None))
+
+
+class PdfStore(object) :
+    """
+    Stores uploaded pdfs once each under the hash of their contents
+    """
+
+    def __init__(self, app=None):
+        if not app == None :
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('PDF_STORE_DIR', 'pdfs')
+
+        if not event.contains(db.session, 'after_commit', remove_after_commit) :
+            event.listen(db.session, 'after_commit', remove_after_commit)
+            event.listen(db.session, 'after_rollback', remove_after_rollback)
+
+    #
+    # save
+    #   Streams an upload (a werkzeug FileStorage or any file object) into the
+    #   store while hashing it and adds a reference to it in the current session.
+    #   Returns a StoredPdf with the pdf_url, sha256 and size for the worksheet.
+    #
+    def save(self, file):
+        stream = getattr(file, 'stream', file)
+        root = os.path.join(current_app.config['UPLOAD_FOLDER'], current_app.config['PDF_STORE_DIR'])
+        os.makedirs(root, exist_ok=True)
+
+        digest = hashlib.sha256()
+        size = 0
+        handle, temp = tempfile.mkstemp(suffix='.part', dir=root)
+        try :
+            with os.fdopen(handle, 'wb') as out :
+                for chunk in iter(lambda: stream.read(CHUNK_SIZE), b'') :
+                    digest.update(chunk)
+                    size += len(chunk)
+                    out.write(chunk)
+
+            sha256 = digest.hexdigest()
+            pdf_url = stored_path(sha256)
+            path = full_path(pdf_url)
+
+            if os.path.exists(path) :
+                # already stored, only a new reference is needed
+                os.remove(temp)
+                written = False
+            else :
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                os.replace(temp, path)
+                written = True
+        except :
+            if os.path.exists(temp) :
+                os.remove(temp)
+            raise
+
+        session = db.session()
+        updated = session.execute(StoredFile.__table__.update().where(StoredFile.sha256 == sha256).values(refs=StoredFile.refs + 1))
+        if updated.rowcount == 0 :
+            session.execute(StoredFile.__table__.insert().values(sha256=sha256, size=size, refs=1))
+
+        if written :
+            # a new file is removed again if the transaction is rolled back
+            session.info.setdefault('pdf_store_written', []).append((sha256, pdf_url))
+
+        return StoredPdf(pdf_url, sha256, size)
+
+    #
+    # release
+    #   Drops the reference a worksheet has to its pdf. The file is removed after
+    #   the commit if nothing else uses it. Worksheets uploaded before the store
+    #   existed have no reference, their file is removed after the commit if no
+    #   other worksheet points at it.
+    #
+    def release(self, worksheet):
+        if worksheet.pdf_url == None :
+            return
+
+        session = db.session()
+        if not worksheet.sha256 == None :
+            session.execute(StoredFile.__table__.update().where(StoredFile.sha256 == worksheet.sha256).values(refs=StoredFile.refs - 1))
+            session.execute(StoredFile.__table__.delete().where(StoredFile.sha256 == worksheet.sha256).where(StoredFile.refs <= 0))
+
+        session.info.setdefault('pdf_store_released', []).append((worksheet.sha256, worksheet.pdf_url))
+
+
+pdf_store = PdfStore()
@@ -0,0 +1,103 @@
+#
+# Worksheet Thumbnails
+#   The listing pages used to embed every pdf in an iframe, so a page of nine
+#   worksheets made the browser download nine whole pdfs. Instead the first page
+#   of each pdf is drawn once, when it is uploaded, into a small png that the
+#   listing pages show.
+#
+#   Thumbnails are kept next to the pdf store (see app/storage.py), named after
+#   the hash of the pdf so duplicates share one:
+#
+#       thumbs/3a/7b/3a7bd3e2360a3d29eea436fcfb7e44c735d117c42d1c1835420b6b9942dd4f1b.png
+#
+#   PyPDF2 and pdfkit can read and write pdfs but not draw them, so by default
+#   pdftoppm from poppler is used (sudo apt install poppler-utils).
+#   THUMBNAIL_RENDERER can be set to any function(pdf_path, png_path, width)
+#   instead. When nothing can draw the pdf the worksheet simply has no thumbnail
+#   and the pages show a pdf icon.
+#
+#   Worksheets uploaded before thumbnails existed are filled in with
+#       flask worksheets backfill-thumbnails
+#
+#   Works like the other extensions (see app/mail.py):
+#       thumbnails = Thumbnails()
+#       thumbnails.init_app(app)
+#
+import logging
+import os
+import subprocess
+import tempfile
+
+from flask import current_app
+
+log = logging.getLogger(__name__)
+
+
+#
+# thumbnail_path
+#   Where the thumbnail of the pdf with the given hash is kept, relative to
+#   UPLOAD_FOLDER
+#
+def thumbnail_path(sha256):
+    return '/'.join([current_app.config['THUMBNAIL_DIR'], sha256[:2], sha256[2:4], sha256 + '.png'])
+
+
+#
+# render_with_pdftoppm
+#   Draws the first page of a pdf into a png the given number of pixels wide
+#
+def render_with_pdftoppm(pdf_path, png_path, width):
+    # pdftoppm adds the .png itself
+    subprocess.run(['pdftoppm', '-png', '-singlefile', '-f', '1', '-l', '1',
+        '-scale-to-x', str(width), '-scale-to-y', '-1', pdf_path, png_path[:-len('.png')]],
+        check=True, timeout=30, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+class Thumbnails(object) :
+    """
+    Draws the first page of uploaded pdfs for the listing pages
+    """
+
+    def __init__(self, app=None):
+        if not app == None :
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('THUMBNAIL_DIR', 'thumbs')
+        app.config.setdefault('THUMBNAIL_WIDTH', 400)
+        app.config.setdefault('THUMBNAIL_RENDERER', render_with_pdftoppm)
+
+    #
+    # make
+    #   Draws the thumbnail of a pdf in the store unless it already exists.
+    #   Returns where it is (relative to UPLOAD_FOLDER) or None if it could not be
+    #   drawn. Never raises so a broken pdf does not stop the upload.
+    #
+    def make(self, pdf_url, sha256):
+        thumbnail = thumbnail_path(sha256)
+        path = os.path.join(current_app.config['UPLOAD_FOLDER'], thumbnail)
+        if os.path.exists(path) :
+            return thumbnail
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        handle, temp = tempfile.mkstemp(suffix='.png', dir=os.path.dirname(path))
+        os.close(handle)
+        try :
+            current_app.config['THUMBNAIL_RENDERER'](os.path.join(current_app.config['UPLOAD_FOLDER'], pdf_url),
+                temp, current_app.config['THUMBNAIL_WIDTH'])
+
+            if os.path.getsize(temp) == 0 :
+                raise OSError('empty thumbnail')
+
+            os.replace(temp, path)
+        except Exception :
+            log.warning('Could not draw a thumbnail of %s', pdf_url, exc_info=True)
+            return None
+        finally :
+            if os.path.exists(temp) :
+                os.remove(temp)
+
+        return thumbnail
+
+
+thumbnails = Thumbnails()
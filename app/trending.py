@@ -0,0 +1,263 @@
+#
+# Trending
+#   Worksheet.count only ever goes up so the worksheets that were popular years
+#   ago stay on top forever. The trending score counts every view and favourite
+#   for half as much every TRENDING_HALF_LIFE seconds, so what is being used now
+#   comes first.
+#
+#   Decaying every score all of the time would mean writing every worksheet.
+#   Instead each event is added already scaled up by how long after a fixed
+#   epoch it happened:
+#
+#       trending_score += weight * 2 ** ((now - epoch) / TRENDING_HALF_LIFE)
+#
+#   Every score would have to be multiplied by the same 2 ** (-(now - epoch) / half
+#   life) to get its real value now, so the order never changes and the scores
+#   can be sorted by their index as they are (see WORKSHEET_SORTS in
+#   app/queries.py). An event only touches the row of its own worksheet.
+#
+#   The scaled numbers keep growing, so every TRENDING_RECOMPUTE_INTERVAL seconds
+#   the epoch is moved up to now and every score is worked out again from the
+#   worksheet_events table (with NumPy when it is installed), dropping the events
+#   older than TRENDING_MAX_AGE that no longer count for anything. The worker
+#   writing the view counts does it when it is due (see app/counters.py), or run
+#       flask trending recompute
+#
+#   Views are recorded in the batches app/counters.py writes, favourites in the
+#   transaction that adds them. TRENDING_WEIGHTS says how much each counts.
+#
+#   Works like the other extensions (see app/mail.py):
+#       trending = Trending()
+#       trending.init_app(app)
+#
+import logging
+import threading
+import time
+from collections import defaultdict
+
+import click
+from flask import current_app
+from flask.cli import AppGroup
+from sqlalchemy import bindparam, select
+
+from .database import db
+from .models import Version, Worksheet, WorksheetEvent
+
+try :
+    import numpy
+except ImportError :
+    numpy = None
+
+log = logging.getLogger(__name__)
+
+# name of the row in the versions table holding the epoch, in hours
+EPOCH = 'trending_epoch'
+
+# scores are written this many rows at a time by recompute
+CHUNK = 1000
+
+
+def epoch_seconds(hours):
+    return hours * 3600
+
+def scale(now, epoch, half_life):
+    return 2 ** ((now - epoch_seconds(epoch)) / half_life)
+
+
+#
+# scores_in_python / scores_with_numpy
+#   The score of each worksheet from its events, scaled from the epoch. Both
+#   take lists of worksheet ids, weights (count times the weight of the kind)
+#   and times and return {worksheet_id : score}.
+#
+def scores_in_python(worksheet_ids, weights, times, epoch, half_life):
+    scores = defaultdict(float)
+    for worksheet_id, weight, at in zip(worksheet_ids, weights, times) :
+        scores[worksheet_id] += weight * scale(at, epoch, half_life)
+    return dict(scores)
+
+def scores_with_numpy(worksheet_ids, weights, times, epoch, half_life):
+    if not worksheet_ids :
+        return {}
+
+    ids, index = numpy.unique(numpy.asarray(worksheet_ids), return_inverse=True)
+    scaled = numpy.asarray(weights, dtype=float) * numpy.exp2((numpy.asarray(times, dtype=float) - epoch_seconds(epoch)) / half_life)
+    totals = numpy.bincount(index, weights=scaled, minlength=len(ids))
+    return {int(worksheet_id) : float(total) for worksheet_id, total in zip(ids, totals)}
+
+def decayed_scores(worksheet_ids, weights, times, epoch, half_life):
+    if numpy == None :
+        return scores_in_python(worksheet_ids, weights, times, epoch, half_life)
+    return scores_with_numpy(worksheet_ids, weights, times, epoch, half_life)
+
+
+#
+# read_epoch
+#   The epoch, the first call makes it. recompute locks the row so two of them
+#   cannot move it at once, events only lock it when it moved under them (see
+#   record).
+#
+def read_epoch(connection, now, lock=False):
+    table = Version.__table__
+    query = select([table.c.version]).where(table.c.name == EPOCH)
+    epoch = connection.execute(query.with_for_update() if lock else query).scalar()
+    if epoch == None :
+        epoch = int(now // 3600)
+        connection.execute(table.insert().values(name=EPOCH, version=epoch))
+
+    return epoch
+
+
+class TrendingState(object) :
+    """
+    The settings of one app and the epoch it last saw
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self.half_life = app.config['TRENDING_HALF_LIFE']
+        self.weights = app.config['TRENDING_WEIGHTS']
+        self.interval = app.config['TRENDING_RECOMPUTE_INTERVAL']
+        self.max_age = app.config['TRENDING_MAX_AGE']
+        self.epoch = None
+        self.recomputing = threading.Lock()
+
+    #
+    # record
+    #   Adds events ({worksheet_id : count} of one kind) and their share of the
+    #   scores in the connection's transaction.
+    #
+    #   The epoch is read without a lock so favourites and view batches do not
+    #   queue up behind each other, and the scores are only added to while it is
+    #   still the one they were scaled from. If a recompute moved it in between
+    #   nothing is added, the epoch is read again with a lock (which waits for a
+    #   running recompute and sees what it committed, not the transaction's
+    #   snapshot) and the scores are scaled from that one instead.
+    #
+    def record(self, connection, counts, kind, now=None):
+        counts = {worksheet_id : n for worksheet_id, n in counts.items() if n}
+        if not counts :
+            return
+
+        now = time.time() if now == None else now
+        epoch = read_epoch(connection, now)
+
+        connection.execute(WorksheetEvent.__table__.insert(),
+            [dict(worksheet_id=worksheet_id, kind=kind, count=n, created_at=now) for worksheet_id, n in counts.items()])
+
+        table = Worksheet.__table__
+        versions = Version.__table__
+        statement = table.update().where(table.c.id == bindparam('worksheet_id')).values(
+            trending_score=table.c.trending_score + bindparam('amount'))
+
+        def amounts(epoch):
+            factor = self.weights[kind] * scale(now, epoch, self.half_life)
+            return [dict(worksheet_id=worksheet_id, amount=n * factor) for worksheet_id, n in counts.items()]
+
+        current = select([versions.c.version]).where(versions.c.name == EPOCH).as_scalar()
+        updated = connection.execute(statement.where(current == epoch), amounts(epoch))
+
+        # nothing was added, either the epoch moved or the worksheets are gone
+        if updated.rowcount == 0 :
+            locked = read_epoch(connection, now, lock=True)
+            if not locked == epoch :
+                epoch = locked
+                connection.execute(statement, amounts(epoch))
+
+        self.epoch = epoch
+
+    def due(self, now):
+        return not self.epoch == None and now - epoch_seconds(self.epoch) >= self.interval
+
+    #
+    # recompute
+    #   Moves the epoch up to now, removes the events too old to count and works
+    #   out every score again. Returns how many worksheets have a score.
+    #
+    def recompute(self, now=None):
+        now = time.time() if now == None else now
+        events = WorksheetEvent.__table__
+        worksheets = Worksheet.__table__
+
+        with self.recomputing, db.get_engine(self.app).begin() as connection :
+            read_epoch(connection, now, lock=True)
+            epoch = int(now // 3600)
+            connection.execute(Version.__table__.update().where(Version.name == EPOCH).values(version=epoch))
+
+            connection.execute(events.delete().where(events.c.created_at < now - self.max_age))
+
+            worksheet_ids, weights, times = [], [], []
+            for worksheet_id, kind, count, created_at in connection.execute(select([events.c.worksheet_id,
+                    events.c.kind, events.c.count, events.c.created_at])) :
+                worksheet_ids.append(worksheet_id)
+                weights.append(count * self.weights.get(kind, 0))
+                times.append(created_at)
+
+            scores = decayed_scores(worksheet_ids, weights, times, epoch, self.half_life)
+
+            connection.execute(worksheets.update().where(worksheets.c.trending_score != 0).values(trending_score=0))
+            rows = [dict(worksheet_id=worksheet_id, score=score) for worksheet_id, score in scores.items()]
+            statement = worksheets.update().where(worksheets.c.id == bindparam('worksheet_id')).values(
+                trending_score=bindparam('score'))
+            for start in range(0, len(rows), CHUNK) :
+                connection.execute(statement, rows[start:start + CHUNK])
+
+        self.epoch = epoch
+        log.info('Recomputed the trending scores of %d worksheets', len(scores))
+        return len(scores)
+
+    def recompute_if_due(self, now=None):
+        now = time.time() if now == None else now
+        if self.due(now) :
+            self.recompute(now)
+
+
+trending_cli = AppGroup('trending', help='Look after the trending scores.')
+
+@trending_cli.command('recompute')
+def recompute_command():
+    """
+    Work out every trending score again from the recent events
+    """
+    scored = current_app.extensions['trending'].recompute()
+    click.echo('%d worksheets are trending' % scored)
+
+
+class Trending(object) :
+    """
+    Time decayed scores of how much each worksheet is being used
+    """
+
+    def __init__(self, app=None):
+        if not app == None :
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('TRENDING_HALF_LIFE', 3 * 86400)
+        app.config.setdefault('TRENDING_WEIGHTS', {'view' : 1.0, 'favourite' : 5.0})
+        app.config.setdefault('TRENDING_RECOMPUTE_INTERVAL', 86400)
+        # after ten half lives an event counts for less than a thousandth
+        app.config.setdefault('TRENDING_MAX_AGE', 10 * app.config['TRENDING_HALF_LIFE'])
+
+        app.extensions['trending'] = TrendingState(app)
+        app.cli.add_command(trending_cli)
+
+    def state_of(self, app):
+        return app.extensions['trending']
+
+    @property
+    def state(self):
+        return self.state_of(current_app)
+
+    #
+    # record_favourite
+    #   Counts a new favourite in the current transaction
+    #
+    def record_favourite(self, worksheet_id):
+        self.state.record(db.session.connection(), {worksheet_id : 1}, 'favourite')
+
+    def recompute(self, now=None):
+        return self.state.recompute(now)
+
+
+trending = Trending()
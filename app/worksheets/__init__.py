@@ -5,4 +5,6 @@ from flask import Blueprint
 
 worksheets = Blueprint('worksheets', __name__)
 
-from app.worksheets import views
+from app.worksheets import views, commands
+
+worksheets.cli.add_command(commands.backfill_thumbnails_command)
@@ -0,0 +1,73 @@
+#
+# Worksheet Commands
+#   Run with the flask command, for example
+#       FLASK_APP=run.py flask worksheets backfill-thumbnails
+#
+import os
+
+import click
+from flask import current_app
+
+from .. import db
+from ..models import Worksheet
+from ..storage import pdf_store
+from ..thumbnails import thumbnails
+from ..cache import response_cache
+
+
+#
+# backfill_thumbnails
+#   Draws the thumbnails of worksheets that do not have one. A thumbnail is named
+#   after the hash of its pdf, so worksheets uploaded before the pdf store are
+#   moved into it first (see app/storage.py). Their old file stays until the
+#   last worksheet pointing at it has moved. Each worksheet is committed on its
+#   own so a run that is stopped part way keeps what it did.
+#
+#   Returns the number of thumbnails drawn and the number that could not be.
+#
+def backfill_thumbnails():
+    drawn = 0
+    failed = 0
+
+    ids = [id for (id,) in db.session.query(Worksheet.id).filter(Worksheet.thumbnail == None).order_by(Worksheet.id)]
+    for id in ids :
+        worksheet = Worksheet.query.get(id)
+
+        try :
+            if worksheet.sha256 == None :
+                path = os.path.join(current_app.config['UPLOAD_FOLDER'], worksheet.pdf_url or '')
+                if not os.path.isfile(path) :
+                    failed += 1
+                    continue
+
+                with open(path, 'rb') as f :
+                    stored = pdf_store.save(f)
+
+                pdf_store.release(worksheet)
+                worksheet.pdf_url = stored.pdf_url
+                worksheet.sha256 = stored.sha256
+                worksheet.size = stored.size
+
+            worksheet.thumbnail = thumbnails.make(worksheet.pdf_url, worksheet.sha256)
+            db.session.commit()
+        except :
+            db.session.rollback()
+            raise
+
+        if worksheet.thumbnail == None :
+            failed += 1
+        else :
+            drawn += 1
+
+    response_cache.clear()
+
+    return drawn, failed
+
+
+@click.command('backfill-thumbnails')
+def backfill_thumbnails_command():
+    """
+    Draw thumbnails for worksheets that do not have one
+    """
+    drawn, failed = backfill_thumbnails()
+    click.echo('Drew %d thumbnails, %d worksheets could not be drawn' % (drawn, failed))
@@ -3,13 +3,16 @@ from wtforms import StringField, SubmitField, TextAreaField
 from wtforms.validators import DataRequired
 from wtforms.ext.sqlalchemy.fields import QuerySelectField
 from flask_wtf.file import FileField, FileRequired
-from ..models import Author, WorksheetCategory
+from ..models import Author
+from ..categories import category_registry
 
 #
 # This function is designed to obtain choices for the categories in the PostForm.
+#   The categories come from the category registry so the table is not read
+#   every time a form is shown or checked.
 #
 def category_choices() :
-    return WorksheetCategory.query
+    return category_registry.worksheet_categories()
 
 #
 # WorksheetForm
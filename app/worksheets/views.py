@@ -1,117 +1,148 @@
 from . import worksheets
-from flask import render_template, session, redirect, url_for, request, current_app
-from ..models import WorksheetCategory, Worksheet, Author, Learner
+from flask import render_template, session, redirect, url_for, request, abort, current_app
+from ..models import WorksheetCategory, Worksheet
 from .forms import WorksheetForm, WorksheetCategoryForm, EditWorksheetForm
-from werkzeug.utils import secure_filename
-import os
 from .. import db
+from ..pagination import paginate
+from ..queries import worksheets_query, get_worksheet, favourite_ids, sorted_worksheets, recommended_for_worksheet, \
+    related_to_worksheet, WORKSHEET_SORTS
+from ..counters import download_counter
+from ..cache import response_cache
+from ..categories import category_registry
+from ..delivery import send_upload
+from ..storage import pdf_store
+from ..thumbnails import thumbnails
+from ..current_user import current_users
+from ..related import related_worksheets
+from ..recommendations import recommendations
+
+# number of worksheets shown on each page of the worksheets page
+WORKSHEETS_PER_PAGE = 9
 
 #
 # Worksheets
 #   will display the worksheets
 #
+#   Pagination uses a cursor (the id of the last worksheet shown) so that deep
+#   pages are as cheap as the first one. The old '/worksheets_page/<int:page>'
+#   urls still work and are mapped onto a cursor. See app/pagination.py
+#
+#   'sort' is 'newest' (the default), 'popular' (most viewed) or 'trending'
+#   (most viewed and liked lately, see app/trending.py). The other sorts page
+#   forwards with a cursor of the sort value and the id.
+#
 # Note: will have to make a call to the database for each author so that the
 #   template can distinguish
 #
 @worksheets.route('/worksheets_page/<int:page>', methods=['GET', 'POST'])
 @worksheets.route('/worksheets_page', defaults={'page': 0}, methods=['GET', 'POST'])
+@response_cache.cached
 def worksheets_page(page) :
     try :
-        categories = WorksheetCategory.query.all()
+        categories = category_registry.worksheet_categories()
         author = request.args.get('author')
         category = request.args.get('category')
+        sort = request.args.get('sort')
+        if not sort in WORKSHEET_SORTS :
+            sort = 'newest'
     except:
         db.session.rollback()
         raise
 
     if session.get('learner_logged_in') :
         try :
-            learner = Learner.query.filter_by(name=session.get('learner_name')).first()
-            favourites = learner.favourites
-            learner_id = learner.id
+            learner = current_users.learner()
         except :
             db.session.rollback()
             raise
     else :
-        favourites = []
-        learner_id = None
+        learner = None
+
+    learner_id = None if learner == None else learner.id
 
     if not author == None :
         try :
             # get the worksheets done by a specific author
-            worksheets = Worksheet.query.filter_by(author_id=author).order_by(Worksheet.id.desc()).offset(page * 9).limit(9).all()
-
-            more = Worksheet.query.filter_by(author_id=author).offset((page + 1) * 9).first()
+            worksheets = worksheets_sorted(worksheets_query().filter_by(author_id=author), sort, page)
+            favourites = favourite_ids(learner, worksheets.items)
         except:
             db.session.rollback()
             raise
 
-        prev_url = None
-        next_url = None
-        if not page == 0 :
-            prev_url = url_for('worksheets.worksheets_page', author=author, category=category, page=page - 1)
-
-        if not more == None :
-            next_url = url_for('worksheets.worksheets_page', author=author, category=category, page=page + 1)
+        prev_url = worksheets.prev_url('worksheets.worksheets_page', author=author, category=category, sort=sort_value(sort))
+        next_url = worksheets.next_url('worksheets.worksheets_page', author=author, category=category, sort=sort_value(sort))
 
-
-        return render_template('worksheet_templates/worksheets.html.j2', worksheets=worksheets, categories=categories, favourites=favourites, learner_id=learner_id, next_url=next_url, prev_url=prev_url)
+        return render_template('worksheet_templates/worksheets.html.j2', worksheets=worksheets.items, categories=categories, favourites=favourites, learner_id=learner_id, next_url=next_url, prev_url=prev_url, sort=sort, author=author, category=category)
 
     elif not category == None:
         try :
             # get the worksheets from a specific category
-            worksheets = Worksheet.query.filter_by(category_id=category).order_by(Worksheet.id.desc()).offset(page * 9).limit(9).all()
-
-            more = Worksheet.query.filter_by(category_id=category).offset((page + 1) * 9).first()
+            worksheets = worksheets_sorted(worksheets_query().filter_by(category_id=category), sort, page)
+            favourites = favourite_ids(learner, worksheets.items)
         except:
             db.session.rollback()
             raise
 
-        prev_url = None
-        next_url = None
-        if not page == 0 :
-            prev_url = url_for('worksheets.worksheets_page', author=author, category=category, page=page - 1)
+        prev_url = worksheets.prev_url('worksheets.worksheets_page', author=author, category=category, sort=sort_value(sort))
+        next_url = worksheets.next_url('worksheets.worksheets_page', author=author, category=category, sort=sort_value(sort))
 
-        if not more == None :
-            next_url = url_for('worksheets.worksheets_page', author=author, category=category, page=page + 1)
-
-        return render_template('worksheet_templates/worksheets.html.j2', worksheets=worksheets, categories=categories, favourites=favourites, learner_id=learner_id, next_url=next_url, prev_url=prev_url)
+        return render_template('worksheet_templates/worksheets.html.j2', worksheets=worksheets.items, categories=categories, favourites=favourites, learner_id=learner_id, next_url=next_url, prev_url=prev_url, sort=sort, author=author, category=category)
     else :
         try :
             # get all the worksheets
             # if a no specific worksheet or category has been selected this if statement will be ran
-            worksheets = Worksheet.query.order_by(Worksheet.id.desc()).offset(page * 9).limit(9).all()
-
-            more = Worksheet.query.offset((page + 1) * 9).first()
+            worksheets = worksheets_sorted(worksheets_query(), sort, page)
+            favourites = favourite_ids(learner, worksheets.items)
         except:
             db.session.rollback()
             raise
 
-        prev_url = None
-        next_url = None
-        if not page == 0 :
-            prev_url = url_for('worksheets.worksheets_page', author=author, category=category, page=page - 1)
+        prev_url = worksheets.prev_url('worksheets.worksheets_page', author=author, category=category, sort=sort_value(sort))
+        next_url = worksheets.next_url('worksheets.worksheets_page', author=author, category=category, sort=sort_value(sort))
 
-        if not more == None :
-            next_url = url_for('worksheets.worksheets_page', author=author, category=category, page=page + 1)
+        return render_template('worksheet_templates/worksheets.html.j2', worksheets=worksheets.items, categories=categories, favourites=favourites, learner_id=learner_id, next_url=next_url, prev_url=prev_url, sort=sort, author=author, category=category)
 
-        return render_template('worksheet_templates/worksheets.html.j2', worksheets=worksheets, categories=categories, favourites=favourites, learner_id=learner_id, next_url=next_url, prev_url=prev_url)
+
+#
+# worksheets_sorted
+#   One page of the worksheets in the query. Newest first pages on the id with
+#   the cursors from the request (or an old page number), the other sorts with
+#   seek(). A cursor that is not ours is a bad request.
+#
+def worksheets_sorted(query, sort, page):
+    if sort == 'newest' :
+        return paginate(query, Worksheet.id, WORKSHEETS_PER_PAGE,
+            after=request.args.get('after', type=int), before=request.args.get('before', type=int), page=page)
+
+    try :
+        return sorted_worksheets(query, sort, WORKSHEETS_PER_PAGE, after=request.args.get('after'))
+    except ValueError :
+        abort(400)
+
+# newest is left out of the urls so they look the way they always have
+def sort_value(sort):
+    return None if sort == 'newest' else sort
 
 
 #
 # Specific Worksheet:
 #   Displays a specified worksheet. It had to be added to make it easier to share
-#   worksheets on Twitter.
+#   worksheets on Twitter. Under it are the worksheets that learners who like it
+#   also like (see app/recommendations.py) and the ones about the same thing (see
+#   app/related.py).
 #
 @worksheets.route('/specific_worksheet/<int:id>', methods=['GET', 'POST'])
+@response_cache.cached
 def specific_worksheet(id):
     try :
-        worksheet = Worksheet.query.get(id)
+        worksheet = get_worksheet(id)
 
-        categories = WorksheetCategory.query.all()
+        categories = category_registry.worksheet_categories()
 
         if not worksheet == None :
-            return render_template('worksheet_templates/specific_worksheet.html.j2', worksheet=worksheet, categories=categories)
+            recommended = recommended_for_worksheet(worksheet.id, current_app.config['RECOMMENDATIONS_SHOWN'])
+            related = related_to_worksheet(worksheet.id, current_app.config['RELATED_SHOWN'])
+            return render_template('worksheet_templates/specific_worksheet.html.j2', worksheet=worksheet, categories=categories, recommended=recommended, related=related)
         else :
             return redirect(url_for('other.home'))
     except :
@@ -121,21 +152,59 @@ def specific_worksheet(id):
 #
 # Worksheet Count
 #   Will increment the download count of a worksheet when one requests to view it.
+#   The view is buffered and written later in a batch (see app/counters.py) so
+#   the click does not wait on a commit.
 #
 @worksheets.route('/worksheets_count/<int:id>', methods=['GET', 'POST'])
 def worksheets_count(id):
     try :
         worksheet = Worksheet.query.get(id)
-        worksheet.count = worksheet.count + 1
 
-        db.session.commit()
+        download_counter.increment(worksheet.id)
 
-        return redirect(url_for('static', filename=worksheet.pdf_url))
+        return redirect(url_for('worksheets.worksheet_pdf', id=worksheet.id))
     except :
         db.session.rollback()
         raise
 
 
+#
+# Worksheet File
+#   Sends an uploaded worksheet pdf. Depending on PDF_DELIVERY the front end
+#   server is told to send it or Flask streams it (see app/delivery.py).
+#
+@worksheets.route('/uploads/<path:filename>')
+def worksheet_file(filename):
+    return send_upload(filename)
+
+
+#
+# Worksheet Pdf
+#   The pdf of a worksheet. Answers Range requests and revalidation with a strong
+#   ETag (the sha256 of the file). Links that add ?v=<sha256> are cached for a
+#   year since a different file would have a different hash.
+#
+@worksheets.route('/worksheet_pdf/<int:id>')
+def worksheet_pdf(id):
+    worksheet = Worksheet.query.get(id)
+    if worksheet == None :
+        abort(404)
+
+    return send_upload(worksheet.pdf_url, version=request.args.get('v'), etag=worksheet.sha256)
+
+
+#
+# Worksheet Thumbnail
+#   The png of the first page shown on the listing pages. Cached the same way as
+#   the pdf it was drawn from.
+#
+@worksheets.route('/worksheet_thumbnail/<int:id>')
+def worksheet_thumbnail(id):
+    worksheet = Worksheet.query.get(id)
+    if worksheet == None or worksheet.thumbnail == None :
+        abort(404)
+
+    return send_upload(worksheet.thumbnail, version=request.args.get('v'), etag=worksheet.sha256)
 
 
 #
@@ -157,16 +226,19 @@ def add_worksheet():
     if request.method == 'POST':
         if form.validate_on_submit():
             try :
-                author = Author.query.filter_by(name=session.get('author_name')).first()
+                author = current_users.author()
 
-                file = request.files['worksheet_pdf']
-                filename = secure_filename(file.filename)
-                file.save(os.path.join(current_app.config['UPLOAD_FOLDER'], filename))
+                # stored under its hash, see app/storage.py
+                stored = pdf_store.save(request.files['worksheet_pdf'])
                 new_worksheet = Worksheet(name=form.title.data, video_url=form.video_url.data,
-                    pdf_url=filename, category_id=form.category.data.id, category=form.category.data,
+                    pdf_url=stored.pdf_url, sha256=stored.sha256, size=stored.size,
+                    thumbnail=thumbnails.make(stored.pdf_url, stored.sha256),
+                    category_id=form.category.data.id, category=form.category.data,
                     author_id=author, author=author)
                 db.session.add(new_worksheet)
+                related_worksheets.refresh(new_worksheet)
                 db.session.commit()
+                response_cache.clear()
                 return redirect(url_for('other.home'))
             except :
                 db.session.rollback()
@@ -187,10 +259,10 @@ def edit_worksheet(id):
         return redirect(url_for('other.home'))
 
     worksheet = Worksheet.query.get(id)
-    author = Author.query.get(worksheet.author_id)
+    author = current_users.author()
 
-    # check if user is logged in
-    if not author.name == session.get('author_name') :
+    # only the author of the worksheet can change it
+    if worksheet == None or author == None or not worksheet.author_id == author.id :
         return redirect(url_for('other.home'))
 
     form = EditWorksheetForm(obj=worksheet)
@@ -199,24 +271,27 @@ def edit_worksheet(id):
         try :
             if 'worksheet_pdf' in request.files:
                 if not request.files['worksheet_pdf'].filename == '':
-                    # removing the old pdf
-                    os.remove(os.path.join(current_app.config['UPLOAD_FOLDER'], worksheet.pdf_url))
-
                     # adding the new pdf
-                    file = request.files['worksheet_pdf']
-                    filename = secure_filename(file.filename)
-                    file.save(os.path.join(current_app.config['UPLOAD_FOLDER'], filename))
+                    stored = pdf_store.save(request.files['worksheet_pdf'])
 
-                    # updating the database values
-                    worksheet.pdf_url = filename
+                    # the old pdf is removed after the commit if nothing else uses it
+                    pdf_store.release(worksheet)
 
+                    # updating the database values
+                    worksheet.pdf_url = stored.pdf_url
+                    worksheet.sha256 = stored.sha256
+                    worksheet.size = stored.size
+                    worksheet.thumbnail = thumbnails.make(stored.pdf_url, stored.sha256)
 
             worksheet.name = form.title.data
             worksheet.video_url = form.video_url.data
             worksheet.category_id = form.category.data.id
             worksheet.category = form.category.data
 
+            # only this worksheet is worked out again, and only if its words changed
+            related_worksheets.refresh(worksheet)
             db.session.commit()
+            response_cache.clear()
 
             # redirect to the home page
             return redirect(url_for('other.home'))
@@ -244,17 +319,21 @@ def delete_worksheet(id):
     if not session.get('author_logged_in') :
         return redirect(url_for('other.home'))
     worksheet = Worksheet.query.get(id)
-    author = Author.query.get(worksheet.author_id)
+    author = current_users.author()
 
-    # check if user is logged in
-    if not author.name == session.get('author_name') :
+    # only the author of the worksheet can delete it
+    if worksheet == None or author == None or not worksheet.author_id == author.id :
         return redirect(url_for('other.home'))
 
     try :
-        os.remove(os.path.join(current_app.config['UPLOAD_FOLDER'], worksheet.pdf_url))
+        # the pdf is removed after the commit if nothing else uses it
+        pdf_store.release(worksheet)
 
         db.session.delete(worksheet)
+        related_worksheets.removed(worksheet.id)
+        recommendations.removed(worksheet.id)
         db.session.commit()
+        response_cache.clear()
 
         # redirect to the home page
         return redirect(url_for('other.home'))
@@ -281,6 +360,7 @@ def add_worksheet_category():
             new_category = WorksheetCategory(name=form.name.data)
             db.session.add(new_category)
             db.session.commit()
+            response_cache.clear()
 
             return redirect(url_for('other.home'))
         except:
@@ -310,6 +390,7 @@ def edit_worksheet_category(id) :
             category.name = form.name.data
 
             db.session.commit()
+            response_cache.clear()
 
             # redirect to the home page
             return redirect(url_for('other.home'))
@@ -338,6 +419,7 @@ def delete_worksheet_category(id):
         category = WorksheetCategory.query.get(id)
         db.session.delete(category)
         db.session.commit()
+        response_cache.clear()
 
 
         # redirect to the home page
@@ -4,7 +4,7 @@ from config import TestConfiguration
 from app import create_app as c_app
 import os
 from flask import session, url_for, template_rendered
-from app.models import Author, Worksheet, WorksheetCategory
+from app.models import Author, Worksheet, WorksheetCategory, Learner
 from app.database import db
 from contextlib import contextmanager
 
@@ -444,6 +444,53 @@ class DatabaseEditTests(TestCase):
                 self.assertEqual(context['worksheets'], [worksheet_11, worksheet_5, worksheet_1, worksheet])
                 c.get('/author_logout', follow_redirects=True)
 
+    def test_author_dashboard_stats(self):
+        w_cat = WorksheetCategory(name='maths')
+        w_cat_1 = WorksheetCategory(name='english')
+        auth_1 = Author(name='KJsa', email='kodyrogers21@gmail.com', password='x')
+        auth_2 = Author(name='Kif', email='kodyrogers22@gmail.com', password='x')
+        db.session.add_all([w_cat, w_cat_1, auth_1, auth_2])
+        db.session.commit()
+
+        worksheets = []
+        for i in range(25) :
+            worksheets.append(Worksheet(pdf_url='w' + str(i) + '.pdf', name='worksheet ' + str(i), author=auth_1,
+                category=w_cat if i < 20 else w_cat_1, count=i))
+        other = Worksheet(pdf_url='other.pdf', name='other', author=auth_2, category=w_cat, count=1000)
+        db.session.add_all(worksheets + [other])
+
+        learner = Learner(name='l', email='l@example.com', password='x')
+        learner_1 = Learner(name='l1', email='l1@example.com', password='x')
+        learner.favourites.append(worksheets[24])
+        learner.favourites.append(worksheets[0])
+        learner.favourites.append(other)
+        learner_1.favourites.append(worksheets[24])
+        db.session.add_all([learner, learner_1])
+        db.session.commit()
+
+        with self.app.test_client() as c:
+            with c.session_transaction() as sess:
+                sess['author_logged_in'] = True
+                sess['author_id'] = auth_1.id
+
+            with captured_templates(self.app) as templates:
+                c.get(url_for('author.author_dashboard'))
+                template, context = templates[0]
+
+                self.assertEqual(context['worksheets'], list(reversed(worksheets))[:20])
+                self.assertEqual(context['favourites'], {worksheets[24].id : 2})
+                self.assertEqual(context['prev_url'], None)
+
+                stats = context['stats']
+                self.assertEqual((stats.worksheets, stats.views, stats.favourites), (25, sum(range(25)), 3))
+                self.assertEqual([(s.name, s.worksheets, s.views, s.favourites) for s in stats.categories],
+                    [('english', 5, sum(range(20, 25)), 2), ('maths', 20, sum(range(20)), 1)])
+
+                c.get(context['next_url'])
+                template, context = templates[1]
+                self.assertEqual(context['worksheets'], list(reversed(worksheets))[20:])
+                self.assertEqual(context['favourites'], {worksheets[0].id : 1})
+
         
         
     
@@ -0,0 +1,14 @@
+#
+# Benchmarks
+#   Small scripts that measure how the site performs with a lot of data in the
+#   database. They are not ran with the tests, run them as modules from the top
+#   level directory, for example:
+#
+#       python -m benchmarks.pagination
+#
+#
+#   benchmarks.load sends requests to the public pages from several threads and
+#   prints the latency percentiles as json to compare between commits:
+#
+#       python -m benchmarks.load --output results.json
+#
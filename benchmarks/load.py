@@ -0,0 +1,272 @@
+#
+# Load Benchmark
+#   Seeds a database with a lot of authors, learners, worksheets, favourites and
+#   blog posts, then sends requests to the public pages through the WSGI app from
+#   several threads at once and reports the latency percentiles and requests per
+#   second of each page as json, so the numbers of two commits can be compared:
+#
+#       python -m benchmarks.load --output before.json
+#       git checkout other-branch
+#       python -m benchmarks.load --output after.json
+#
+#   The same --seed gives the same data and the same requests every run.
+#
+#   By default the data goes in a new sqlite file in a temporary directory.
+#   --database can point at another database (for example a MySQL one), it is
+#   EMPTIED and seeded again.
+#
+#   The full sized run:
+#       python -m benchmarks.load --worksheets 100000 --authors 10000 --learners 20000 --favourites 1000000
+#
+import argparse
+import json
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from werkzeug.security import generate_password_hash
+
+from config import TestConfiguration
+from app import create_app
+from app.counters import download_counter
+from app.database import db
+from app.models import Worksheet, WorksheetCategory, Author, Learner, Post, PostCategory, worksheets_identifier
+
+# every seeded account has this password
+PASSWORD = 'benchmark'
+
+# rows written per insert while seeding
+CHUNK = 10000
+
+
+class BenchmarkConfiguration(TestConfiguration):
+    # the caches and buffers are set up like production, the tests turn them off.
+    # CSRF stays off so the login forms can be posted.
+    RESPONSE_CACHE_TYPE = 'simple'
+    DOWNLOAD_COUNT_FLUSH_INTERVAL = 10
+    CATEGORY_REGISTRY_CHECK_INTERVAL = 5
+
+
+def insert(table, rows):
+    for start in range(0, len(rows), CHUNK) :
+        db.session.execute(table.insert(), rows[start:start + CHUNK])
+    db.session.commit()
+
+
+#
+# seed
+#   Fills the database. The password is hashed once and shared by every account
+#   so seeding does not take minutes.
+#
+def seed(options, rand):
+    password = generate_password_hash(PASSWORD)
+
+    insert(WorksheetCategory.__table__, [dict(id=i + 1, name='category ' + str(i)) for i in range(options.categories)])
+    insert(PostCategory.__table__, [dict(id=i + 1, name='category ' + str(i)) for i in range(options.categories)])
+
+    insert(Author.__table__, [dict(id=i + 1, name='author ' + str(i), email='author%d@example.com' % i,
+        password=password) for i in range(options.authors)])
+    insert(Learner.__table__, [dict(id=i + 1, name='learner ' + str(i), email='learner%d@example.com' % i,
+        password=password) for i in range(options.learners)])
+
+    insert(Worksheet.__table__, [dict(id=i + 1, name='worksheet ' + str(i), pdf_url='worksheet_' + str(i) + '.pdf',
+        count=rand.randrange(1000), category_id=rand.randrange(options.categories) + 1,
+        author_id=rand.randrange(options.authors) + 1) for i in range(options.worksheets)])
+
+    insert(Post.__table__, [dict(id=i + 1, name='post ' + str(i), content='lorem ipsum ' * 50,
+        category_id=rand.randrange(options.categories) + 1) for i in range(options.posts)])
+
+    # favourites are spread over the learners, each pair only once
+    per_learner, extra = divmod(min(options.favourites, options.learners * options.worksheets), options.learners)
+    rows = []
+    for learner in range(options.learners) :
+        count = per_learner + (1 if learner < extra else 0)
+        for worksheet in rand.sample(range(options.worksheets), count) :
+            rows.append(dict(learner_id=learner + 1, worksheet_id=worksheet + 1))
+        if len(rows) >= CHUNK :
+            insert(worksheets_identifier, rows)
+            rows = []
+    insert(worksheets_identifier, rows)
+
+
+#
+# scenarios
+#   What is sent for each page. Each one is a function(client, rand) that sends
+#   one request and returns the response.
+#
+def scenarios(options):
+    def worksheet_id(rand):
+        return rand.randrange(options.worksheets) + 1
+
+    def author_login(client, rand):
+        return client.post('/author_login', data=dict(email='author%d@example.com' % rand.randrange(options.authors),
+            password=PASSWORD))
+
+    def learner_login(client, rand):
+        return client.post('/learner_login', data=dict(email='learner%d@example.com' % rand.randrange(options.learners),
+            password=PASSWORD))
+
+    # what credential stuffing looks like, every password is wrong
+    def author_login_wrong(client, rand):
+        return client.post('/author_login', data=dict(email='author%d@example.com' % rand.randrange(options.authors),
+            password='wrong'))
+
+    def learner_login_wrong(client, rand):
+        return client.post('/learner_login', data=dict(email='learner%d@example.com' % rand.randrange(options.learners),
+            password='wrong'))
+
+    return {
+        'home' : lambda client, rand: client.get('/'),
+        'worksheets_page' : lambda client, rand: client.get('/worksheets_page'),
+        'blog' : lambda client, rand: client.get('/blog'),
+        'specific_worksheet' : lambda client, rand: client.get('/specific_worksheet/%d' % worksheet_id(rand)),
+        'worksheets_count' : lambda client, rand: client.get('/worksheets_count/%d' % worksheet_id(rand)),
+        'author_login' : author_login,
+        'learner_login' : learner_login,
+        'author_login_wrong' : author_login_wrong,
+        'learner_login_wrong' : learner_login_wrong,
+    }
+
+
+def percentile(ordered, fraction):
+    if not ordered :
+        return None
+
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+
+#
+# run_scenario
+#   Sends requests from concurrency threads, each with its own client (and so
+#   its own cookies), and times every one of them
+#
+def run_scenario(app, scenario, options, seed):
+    local = threading.local()
+    lock = threading.Lock()
+    latencies = []
+    errors = []
+
+    def send(number):
+        if not hasattr(local, 'client') :
+            local.client = app.test_client()
+
+        rand = random.Random(seed * 1000003 + number)
+        start = time.perf_counter()
+        try :
+            response = scenario(local.client, rand)
+            failed = response.status_code >= 500
+        except Exception :
+            failed = True
+        elapsed = time.perf_counter() - start
+
+        with lock :
+            latencies.append(elapsed)
+            if failed :
+                errors.append(number)
+
+    for number in range(options.warmup) :
+        send(-number - 1)
+    latencies.clear()
+    errors.clear()
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=options.concurrency) as pool :
+        list(pool.map(send, range(options.requests)))
+    wall = time.perf_counter() - start
+
+    latencies.sort()
+    return {
+        'requests' : len(latencies),
+        'errors' : len(errors),
+        'requests_per_second' : round(len(latencies) / wall, 2),
+        'mean_ms' : round(sum(latencies) / len(latencies) * 1000, 3),
+        'p50_ms' : round(percentile(latencies, 0.50) * 1000, 3),
+        'p95_ms' : round(percentile(latencies, 0.95) * 1000, 3),
+        'p99_ms' : round(percentile(latencies, 0.99) * 1000, 3),
+        'max_ms' : round(latencies[-1] * 1000, 3),
+    }
+
+
+def current_commit():
+    try :
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], check=True, capture_output=True, text=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError) :
+        return None
+
+
+def parse_arguments(arguments):
+    parser = argparse.ArgumentParser(prog='python -m benchmarks.load', description='Load test the public pages.')
+    parser.add_argument('--worksheets', type=int, default=10000)
+    parser.add_argument('--authors', type=int, default=1000)
+    parser.add_argument('--learners', type=int, default=2000)
+    parser.add_argument('--favourites', type=int, default=100000)
+    parser.add_argument('--posts', type=int, default=1000)
+    parser.add_argument('--categories', type=int, default=20)
+    parser.add_argument('--requests', type=int, default=500, help='requests sent to each page')
+    parser.add_argument('--concurrency', type=int, default=8, help='threads sending requests at once')
+    parser.add_argument('--warmup', type=int, default=10, help='requests sent to each page before timing')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--database', help='database url, it is emptied (default: a new sqlite file)')
+    parser.add_argument('--scenario', action='append', help='only run these pages (may be repeated)')
+    parser.add_argument('--output', help='write the json here instead of printing it')
+    return parser.parse_args(arguments)
+
+
+def run(arguments=None):
+    options = parse_arguments(arguments)
+    rand = random.Random(options.seed)
+
+    directory = tempfile.mkdtemp(prefix='benchmark-')
+    database = options.database or 'sqlite:///' + os.path.join(directory, 'load.sqlite')
+    app = create_app(type('LoadConfiguration', (BenchmarkConfiguration,), {'SQLALCHEMY_DATABASE_URI' : database}))
+
+    with app.app_context() :
+        db.drop_all()
+        db.create_all()
+        seed_start = time.perf_counter()
+        seed(options, rand)
+        seed_time = time.perf_counter() - seed_start
+        db.session.remove()
+
+    pages = scenarios(options)
+    names = options.scenario or list(pages)
+
+    results = {}
+    try :
+        for i, name in enumerate(names) :
+            results[name] = run_scenario(app, pages[name], options, options.seed + i)
+    finally :
+        # write the buffered views and close the connections while the database
+        # is still there, otherwise the flush at exit fails on a missing file
+        with app.app_context() :
+            download_counter.flush()
+            db.engine.dispose()
+        shutil.rmtree(directory, ignore_errors=True)
+
+    report = {
+        'commit' : current_commit(),
+        'database' : app.config['SQLALCHEMY_DATABASE_URI'].split(':')[0],
+        'python' : sys.version.split()[0],
+        'options' : {name : value for name, value in vars(options).items() if not name in ('output', 'database')},
+        'seed_seconds' : round(seed_time, 2),
+        'results' : results,
+    }
+
+    text = json.dumps(report, indent=2)
+    if options.output :
+        with open(options.output, 'w') as f :
+            f.write(text + '\n')
+    else :
+        print(text)
+
+    return report
+
+
+if __name__ == '__main__':
+    run(sys.argv[1:])
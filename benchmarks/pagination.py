@@ -0,0 +1,73 @@
+#
+# Pagination Benchmark
+#   Seeds an in memory database with a lot of worksheets and compares how long it
+#   takes to get page 0 and page 1000 of the worksheets page with the old
+#   OFFSET queries and with the keyset pagination in app/pagination.py
+#
+#   Usage: python -m benchmarks.pagination [number of worksheets] [repeats]
+#
+import sys
+import timeit
+
+from config import TestConfiguration
+from app import create_app
+from app.database import db
+from app.models import Worksheet, WorksheetCategory, Author
+from app.pagination import paginate, cursor_for_page
+
+PER_PAGE = 9
+
+
+class BenchmarkConfiguration(TestConfiguration):
+    SQLALCHEMY_DATABASE_URI = 'sqlite://'
+
+
+def seed(count):
+    db.session.add(WorksheetCategory(id=1, name='benchmark'))
+    db.session.add(Author(id=1, name='benchmark', email='benchmark@example.com', password='x'))
+    db.session.commit()
+
+    db.session.bulk_insert_mappings(Worksheet, [
+        dict(name='worksheet ' + str(i), pdf_url='worksheet_' + str(i) + '.pdf', category_id=1, author_id=1, count=0)
+        for i in range(count)])
+    db.session.commit()
+
+
+# the queries the worksheets page used before keyset pagination
+def offset_page(page):
+    worksheets = Worksheet.query.order_by(Worksheet.id.desc()).offset(page * PER_PAGE).limit(PER_PAGE).all()
+    more = Worksheet.query.offset((page + 1) * PER_PAGE).first()
+    return worksheets, more
+
+
+def keyset_page(cursor):
+    return paginate(Worksheet.query, Worksheet.id, PER_PAGE, after=cursor).items
+
+
+def run(count=20000, repeats=200):
+    app = create_app(BenchmarkConfiguration)
+
+    with app.app_context():
+        seed(count)
+
+        # the cursor a visitor following 'Older Worksheets' links would have
+        cursor = cursor_for_page(Worksheet.query, Worksheet.id, PER_PAGE, 1000)
+
+        results = {
+            'offset page 0': timeit.timeit(lambda: offset_page(0), number=repeats),
+            'offset page 1000': timeit.timeit(lambda: offset_page(1000), number=repeats),
+            'keyset page 0': timeit.timeit(lambda: keyset_page(None), number=repeats),
+            'keyset page 1000': timeit.timeit(lambda: keyset_page(cursor), number=repeats),
+        }
+
+        db.session.remove()
+
+    print('%d worksheets, %d repeats' % (count, repeats))
+    for name, total in results.items() :
+        print('%-18s %8.3f ms/page' % (name, total / repeats * 1000))
+
+    return results
+
+
+if __name__ == '__main__':
+    run(*[int(arg) for arg in sys.argv[1:]])
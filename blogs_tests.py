@@ -335,7 +335,7 @@ class DatabaseTests(TestCase):
                 template, context = templates[0]
                 self.assertEqual(context['posts'], [post_23, post_19, post_15, post_11, post_7])
                 self.assertEqual(context['categories'], [p_cat, p_cat_1, p_cat_2, p_cat_3])
-                self.assertEqual(context['next_url'], url_for('blogs.blog', category=3, page=1, post=None))
+                self.assertEqual(context['next_url'], url_for('blogs.blog', category=3, after=post_7.id, post=None))
                 self.assertEqual(context['prev_url'], None)
 
         with self.app.test_client() as c:
@@ -369,7 +369,7 @@ class DatabaseTests(TestCase):
                 template, context = templates[0]
                 self.assertEqual(context['posts'], [post_24, post_23, post_22, post_21, post_20])
                 self.assertEqual(context['categories'], [p_cat, p_cat_1, p_cat_2, p_cat_3])
-                self.assertEqual(context['next_url'], url_for('blogs.blog', category=None, page=1, post=None))
+                self.assertEqual(context['next_url'], url_for('blogs.blog', category=None, after=post_20.id, post=None))
                 self.assertEqual(context['prev_url'], None)
 
         with self.app.test_client() as c:
@@ -378,7 +378,7 @@ class DatabaseTests(TestCase):
                 template, context = templates[0]
                 self.assertEqual(context['posts'], [post_19, post_18, post_17, post_16, post_15])
                 self.assertEqual(context['categories'], [p_cat, p_cat_1, p_cat_2, p_cat_3])
-                self.assertEqual(context['next_url'], url_for('blogs.blog', category=None, page=2, post=None))
+                self.assertEqual(context['next_url'], url_for('blogs.blog', category=None, after=post_15.id, post=None))
                 self.assertEqual(context['prev_url'], url_for('blogs.blog', category=None, page=0, post=None))
 
         with self.app.test_client() as c:
@@ -387,8 +387,8 @@ class DatabaseTests(TestCase):
                 template, context = templates[0]
                 self.assertEqual(context['posts'], [post_14, post_13, post_12, post_11, post_10])
                 self.assertEqual(context['categories'], [p_cat, p_cat_1, p_cat_2, p_cat_3])
-                self.assertEqual(context['next_url'], url_for('blogs.blog', category=None, page=3, post=None))
-                self.assertEqual(context['prev_url'], url_for('blogs.blog', category=None, page=1, post=None))
+                self.assertEqual(context['next_url'], url_for('blogs.blog', category=None, after=post_10.id, post=None))
+                self.assertEqual(context['prev_url'], url_for('blogs.blog', category=None, before=post_14.id, post=None))
 
         with self.app.test_client() as c:
             with captured_templates(self.app) as templates:
@@ -396,8 +396,8 @@ class DatabaseTests(TestCase):
                 template, context = templates[0]
                 self.assertEqual(context['posts'], [post_9, post_8, post_7, post_6, post_5])
                 self.assertEqual(context['categories'], [p_cat, p_cat_1, p_cat_2, p_cat_3])
-                self.assertEqual(context['next_url'], url_for('blogs.blog', category=None, page=4, post=None))
-                self.assertEqual(context['prev_url'], url_for('blogs.blog', category=None, page=2, post=None))
+                self.assertEqual(context['next_url'], url_for('blogs.blog', category=None, after=post_5.id, post=None))
+                self.assertEqual(context['prev_url'], url_for('blogs.blog', category=None, before=post_9.id, post=None))
 
         with self.app.test_client() as c:
             with captured_templates(self.app) as templates:
@@ -406,7 +406,7 @@ class DatabaseTests(TestCase):
                 self.assertEqual(context['posts'], [post_4, post_3, post_2, post_1, post])
                 self.assertEqual(context['categories'], [p_cat, p_cat_1, p_cat_2, p_cat_3])
                 self.assertEqual(context['next_url'], None)
-                self.assertEqual(context['prev_url'], url_for('blogs.blog', category=None, page=3, post=None))
+                self.assertEqual(context['prev_url'], url_for('blogs.blog', category=None, before=post_4.id, post=None))
 
 
 class DatabaseModelsTests(TestCase):
@@ -0,0 +1,190 @@
+import unittest
+import shutil
+import tempfile
+from flask_testing import TestCase
+from config import TestConfiguration
+from app import create_app as c_app
+from flask import template_rendered, make_response
+from app.models import Worksheet, WorksheetCategory, Author
+from app.database import db
+from app.cache import LRUCache, FileSystemCache, RedisCache, response_cache
+from contextlib import contextmanager
+
+@contextmanager
+def captured_templates(app):
+    recorded = []
+    def record(sender, template, context, **extra):
+        recorded.append((template, context))
+    template_rendered.connect(record, app)
+    try:
+        yield recorded
+    finally:
+        template_rendered.disconnect(record, app)
+
+def login_author(client, email, password):
+    return client.post('/author_login', data=dict(
+        email=email,
+        password=password
+    ), follow_redirects=True)
+
+#
+# Stand in for a Redis client, only has what RedisCache uses
+#
+class FakeRedis(object) :
+    def __init__(self):
+        self.values = {}
+
+    def get(self, key):
+        return self.values.get(key)
+
+    def setex(self, key, ttl, value):
+        self.values[key] = value
+
+    def delete(self, key):
+        self.values.pop(key, None)
+
+    def scan_iter(self, pattern):
+        return [key for key in list(self.values) if key.startswith(pattern.rstrip('*'))]
+
+
+class BackendTests(unittest.TestCase):
+    def test_lru_cache(self):
+        cache = LRUCache(size=2)
+        cache.set('a', 1, 60)
+        cache.set('b', 2, 60)
+        self.assertEqual(cache.get('a'), 1)
+
+        # 'b' is the least recently used so it goes
+        cache.set('c', 3, 60)
+        self.assertEqual(cache.get('b'), None)
+        self.assertEqual(cache.get('a'), 1)
+        self.assertEqual(cache.get('c'), 3)
+
+        cache.set('d', 4, -1)
+        self.assertEqual(cache.get('d'), None)
+
+        cache.clear()
+        self.assertEqual(cache.get('a'), None)
+
+    def test_filesystem_cache(self):
+        directory = tempfile.mkdtemp()
+        try :
+            cache = FileSystemCache(directory)
+            cache.set('/blog?category=1', (b'html', 200, 'text/html'), 60)
+            self.assertEqual(FileSystemCache(directory).get('/blog?category=1'), (b'html', 200, 'text/html'))
+
+            cache.set('/blog', b'old', -1)
+            self.assertEqual(cache.get('/blog'), None)
+
+            cache.clear()
+            self.assertEqual(cache.get('/blog?category=1'), None)
+        finally :
+            shutil.rmtree(directory)
+
+    def test_redis_cache(self):
+        client = FakeRedis()
+        client.setex('someone else', 60, b'keep')
+
+        cache = RedisCache(client)
+        cache.set('/contact?', (b'html', 200, 'text/html'), 60)
+        self.assertEqual(cache.get('/contact?'), (b'html', 200, 'text/html'))
+
+        cache.clear()
+        self.assertEqual(cache.get('/contact?'), None)
+        self.assertEqual(client.get('someone else'), b'keep')
+
+
+class CachedConfiguration(TestConfiguration):
+    RESPONSE_CACHE_TYPE = 'simple'
+
+
+class ResponseCacheTests(TestCase):
+    def create_app(self):
+        app = c_app(CachedConfiguration)
+        return app
+
+    # executed prior to each test
+    def setUp(self):
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+
+        w_cat = WorksheetCategory(name='dundk')
+        db.session.add(w_cat)
+
+        auth_1 = Author(name='Kidkaidf', email='kodyrogers21@gmail.com', screenname='kod', password='pbkdf2:sha256:150000$73fMtgAp$1a1d8be4973cb2676c5f17275c43dc08583c8e450c94a282f9c443d34f72464c')
+        db.session.add(auth_1)
+
+        db.session.add(Worksheet(pdf_url='tudolsoos.pdf', name='tudoloods', author=auth_1, category=w_cat))
+        db.session.commit()
+
+    # executed after each test
+    def tearDown(self):
+        response_cache.clear()
+
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def test_anonymous_pages_are_cached(self):
+        for url in ['/worksheets_page', '/worksheets_page?category=1', '/blog', '/specific_worksheet/1', '/contact'] :
+            with captured_templates(self.app) as templates:
+                r = self.client.get(url)
+                self.assertEqual(r.status_code, 200)
+                self.assertEqual(r.headers['X-Cache'], 'MISS')
+
+                cached = self.client.get(url)
+                self.assertEqual(cached.headers['X-Cache'], 'HIT')
+                self.assertEqual(cached.data, r.data)
+
+                # only the first request rendered a template
+                self.assertEqual(len(templates), 1)
+
+    def test_logged_in_skips_cache(self):
+        self.client.get('/worksheets_page')
+
+        with self.app.test_client() as c:
+            login_author(c, email='kodyrogers21@gmail.com', password='RockOn')
+
+            with captured_templates(self.app) as templates:
+                r = c.get('/worksheets_page')
+                self.assertNotIn('X-Cache', r.headers)
+                self.assertEqual(len(templates), 1)
+
+    def test_changes_clear_cache(self):
+        r = self.client.get('/contact')
+        self.assertIn(b'kod', r.data)
+        self.assertEqual(self.client.get('/contact').headers['X-Cache'], 'HIT')
+
+        with self.app.test_client() as c:
+            login_author(c, email='kodyrogers21@gmail.com', password='RockOn')
+            c.post('/author_change_screenname/1', data=dict(screenname='newname'))
+
+        r = self.client.get('/contact')
+        self.assertEqual(r.headers['X-Cache'], 'MISS')
+        self.assertIn(b'newname', r.data)
+
+    def test_hits_keep_the_headers_of_the_view(self):
+        @self.app.route('/cached_headers')
+        @response_cache.cached
+        def cached_headers():
+            response = make_response('hello')
+            response.headers['Cache-Control'] = 'public, max-age=60'
+            response.vary.add('Accept-Language')
+            response.set_cookie('visitor', 'one')
+            return response
+
+        self.assertEqual(self.client.get('/cached_headers').headers['X-Cache'], 'MISS')
+        cached = self.client.get('/cached_headers')
+
+        self.assertEqual(cached.headers['X-Cache'], 'HIT')
+        self.assertEqual(cached.headers['Cache-Control'], 'public, max-age=60')
+        self.assertIn('Accept-Language', cached.headers['Vary'])
+        self.assertEqual(cached.content_type, 'text/html; charset=utf-8')
+        self.assertEqual(cached.headers['Content-Length'], '5')
+        # a cookie set for one visitor is not handed to the next
+        self.assertNotIn('visitor', cached.headers.get('Set-Cookie', ''))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,106 @@
+import unittest
+from flask_testing import TestCase
+from config import TestConfiguration
+from app import create_app as c_app
+from app.models import WorksheetCategory, PostCategory, Version
+from app.database import db
+from app.categories import category_registry, CATEGORIES
+from contextlib import contextmanager
+from sqlalchemy import event
+
+@contextmanager
+def captured_statements():
+    statements = []
+    def record(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+    event.listen(db.engine, 'before_cursor_execute', record)
+    try:
+        yield statements
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', record)
+
+
+class SlowCheckConfiguration(TestConfiguration):
+    CATEGORY_REGISTRY_CHECK_INTERVAL = 3600
+
+
+class CategoryRegistryTests(TestCase):
+    def create_app(self):
+        app = c_app(SlowCheckConfiguration)
+        return app
+
+    # executed prior to each test
+    def setUp(self):
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+
+        db.session.add(WorksheetCategory(name='dundk'))
+        db.session.add(PostCategory(name='froots'))
+        db.session.commit()
+
+    # executed after each test
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def test_categories_kept_in_memory(self):
+        self.assertEqual([c.name for c in category_registry.worksheet_categories()], ['dundk'])
+        self.assertEqual([c.name for c in category_registry.post_categories()], ['froots'])
+
+        db.session.expunge_all()
+        with captured_statements() as statements:
+            categories = category_registry.worksheet_categories()
+            self.assertEqual(categories[0].name, 'dundk')
+            self.assertEqual(category_registry.post_category(1).name, 'froots')
+
+        self.assertEqual(statements, [])
+
+    def test_change_bumps_version(self):
+        category_registry.worksheet_categories()
+        version = Version.query.get(CATEGORIES).version
+
+        category = WorksheetCategory.query.first()
+        category.name = 'dunked'
+        db.session.add(PostCategory(name='loops'))
+        db.session.commit()
+
+        self.assertEqual(Version.query.get(CATEGORIES).version, version + 1)
+
+        # the worker that made the change sees it straight away
+        self.assertEqual([c.name for c in category_registry.worksheet_categories()], ['dunked'])
+        self.assertEqual([c.name for c in category_registry.post_categories()], ['froots', 'loops'])
+
+        db.session.delete(WorksheetCategory.query.first())
+        db.session.commit()
+
+        self.assertEqual(category_registry.worksheet_categories(), [])
+        self.assertEqual(Version.query.get(CATEGORIES).version, version + 2)
+
+    def test_other_worker_notices_change(self):
+        # a second app stands in for another uWSGI worker
+        other = c_app(TestConfiguration)
+        with other.app_context() :
+            self.assertEqual([c.name for c in category_registry.worksheet_categories()], ['dundk'])
+            db.session.remove()
+
+        db.session.add(WorksheetCategory(name='dund32k'))
+        db.session.commit()
+
+        with other.app_context() :
+            self.assertEqual([c.name for c in category_registry.worksheet_categories()], ['dundk', 'dund32k'])
+            db.session.remove()
+
+    def test_unrelated_changes_keep_version(self):
+        category_registry.worksheet_categories()
+        version = Version.query.get(CATEGORIES).version
+
+        db.session.add(Version(name='something else', version=1))
+        db.session.commit()
+
+        self.assertEqual(Version.query.get(CATEGORIES).version, version)
+
+
+if __name__ == "__main__":
+    unittest.main()
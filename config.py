@@ -10,13 +10,47 @@ TOP_LEVEL_DIR = os.path.abspath(os.curdir)
 class BaseConfiguration(object):
     SQLALCHEMY_TRACK_MODIFICATIONS = False
 
+    # how worksheet pdfs are sent: 'flask', 'accel' (nginx) or 'sendfile' (see app/delivery.py)
+    PDF_DELIVERY = 'flask'
+    PDF_ACCEL_PREFIX = '/protected_uploads/'
+
 
 class ProductionConfiguration(BaseConfiguration):
     SQLALCHEMY_DATABASE_URI = os.getenv('DATABASE')
     SQLALCHEMY_POOL_PRE_PING = True
     SQLALCHEMY_ENGINE_OPTIONS = {'pool_size' : 100, 'pool_recycle' : 280}
-    SECRET_KEY = secrets.token_urlsafe(16)
+
+    # must be the same for every worker on every server, when it is not set a key
+    # is made once and kept in the instance folder (see app/sessions.py)
+    SECRET_KEY = os.getenv('SECRET_KEY')
+
+    # sessions are kept in the database so every worker can read them
+    SESSION_BACKEND = 'database'
     UPLOAD_FOLDER = TOP_LEVEL_DIR + '/app/static'
+    PDF_DELIVERY = os.getenv('PDF_DELIVERY', 'flask')
+
+    # seconds between writing the buffered worksheet view counts (see app/counters.py)
+    DOWNLOAD_COUNT_FLUSH_INTERVAL = 10
+
+    # cache of the pages anonymous visitors see (see app/cache.py)
+    RESPONSE_CACHE_TYPE = 'simple'
+    RESPONSE_CACHE_TTL = 60
+
+    # seconds between checking if another worker changed the categories (see app/categories.py)
+    CATEGORY_REGISTRY_CHECK_INTERVAL = 5
+
+    # requests slower than this or running more statements are logged (see app/instrumentation.py)
+    SLOW_REQUEST_SECONDS = 1.0
+    SLOW_REQUEST_QUERIES = 30
+
+    # lets a Prometheus scraper read /metrics without logging in (see app/metrics.py)
+    METRICS_TOKEN = os.getenv('METRICS_TOKEN')
+
+    # the logins, signup and worksheet clicks are rate limited, the buckets are
+    # kept in a sqlite file the workers share or in Redis when there is more than
+    # one server (see app/ratelimit.py)
+    RATE_LIMIT_ENABLED = True
+    RATE_LIMIT_STORAGE = os.getenv('RATE_LIMIT_STORAGE', 'sqlite')
 
     # Flask Mail Configuration
     MAIL_SERVER='smtp.gmail.com'
@@ -26,6 +60,11 @@ class ProductionConfiguration(BaseConfiguration):
     MAIL_USE_TLS = False
     MAIL_USE_SSL = True
 
+    # mail is queued in the database and sent by a thread in each worker, checking
+    # every few seconds for retries (see app/mail_queue.py)
+    MAIL_QUEUE_WORKER = 'thread'
+    MAIL_QUEUE_INTERVAL = 5
+
 
 class TestConfiguration(BaseConfiguration):
     TESTING = True
@@ -36,6 +75,23 @@ class TestConfiguration(BaseConfiguration):
 
     UPLOAD_FOLDER = TOP_LEVEL_DIR
 
+    # write worksheet view counts straight away so the tests can check them
+    DOWNLOAD_COUNT_FLUSH_INTERVAL = 0
+
+    # the tests change the database directly so pages must not be cached
+    RESPONSE_CACHE_TYPE = 'null'
+
+    CATEGORY_REGISTRY_CHECK_INTERVAL = 0
+
+    # send queued mail straight after the commit
+    MAIL_QUEUE_INTERVAL = 0
+
+    # metrics only for the process running the tests, no files
+    METRICS_DIR = None
+
+    # the tests log in far more often than anyone could
+    RATE_LIMIT_ENABLED = False
+
     SECRET_KEY = secrets.token_urlsafe(16)
 
     SQLALCHEMY_DATABASE_URI = 'sqlite:///' + os.path.join(_basedir, 'testing.sqlite')
@@ -0,0 +1,119 @@
+import unittest
+from flask_testing import TestCase
+from config import TestConfiguration
+from app import create_app as c_app
+from app.models import Worksheet, WorksheetCategory, Author
+from app.database import db
+from app.instrumentation import request_stats
+from contextlib import contextmanager
+from sqlalchemy import event
+
+@contextmanager
+def captured_statements():
+    statements = []
+    def record(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+    event.listen(db.engine, 'before_cursor_execute', record)
+    try:
+        yield statements
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', record)
+
+
+class TimingConfiguration(TestConfiguration):
+    SERVER_TIMING = True
+
+
+class InstrumentationTests(TestCase):
+    def create_app(self):
+        app = c_app(TimingConfiguration)
+        return app
+
+    # executed prior to each test
+    def setUp(self):
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+
+        w_cat = WorksheetCategory(name='dundk')
+        db.session.add(w_cat)
+
+        auth_1 = Author(name='Kidkaidf', email='kodyrogers21@gmail.com', password='pbkdf2:sha256:150000$73fMtgAp$1a1d8be4973cb2676c5f17275c43dc08583c8e450c94a282f9c443d34f72464c')
+        db.session.add(auth_1)
+
+        for i in range(3) :
+            db.session.add(Worksheet(pdf_url='w' + str(i) + '.pdf', name='worksheet' + str(i), author=auth_1, category=w_cat))
+        db.session.commit()
+
+    # executed after each test
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def server_timing(self, response):
+        timing = {}
+        for metric in response.headers['Server-Timing'].split(', ') :
+            parts = metric.split(';')
+            timing[parts[0]] = dict(part.split('=', 1) for part in parts[1:])
+        return timing
+
+    def test_server_timing_header(self):
+        db.session.expunge_all()
+        with captured_statements() as statements:
+            response = self.client.get('/worksheets_page')
+
+        timing = self.server_timing(response)
+        self.assertEqual(timing['db']['desc'], '"%d queries"' % len(statements))
+        self.assertTrue(len(statements) > 0)
+        self.assertTrue(float(timing['render']['dur']) > 0)
+        self.assertTrue(float(timing['total']['dur']) >= float(timing['db']['dur']))
+
+        # a page that does not touch the database or a template
+        response = self.client.get('/worksheet_pdf/1000')
+        self.assertIn('Server-Timing', response.headers)
+
+    def test_header_follows_debug(self):
+        self.app.config['SERVER_TIMING'] = None
+        self.assertNotIn('Server-Timing', self.client.get('/contact').headers)
+
+        self.app.debug = True
+        self.assertIn('Server-Timing', self.client.get('/contact').headers)
+
+    def test_endpoint_totals(self):
+        self.client.get('/worksheets_page')
+        self.client.get('/worksheets_page?category=1')
+        self.client.get('/contact')
+
+        endpoints = request_stats.endpoints()
+        self.assertEqual(endpoints['worksheets.worksheets_page'].requests, 2)
+        self.assertTrue(endpoints['worksheets.worksheets_page'].queries >= 2)
+        self.assertEqual(endpoints['other.contact'].requests, 1)
+
+    def test_password_hashing_is_timed(self):
+        response = self.client.post('/author_login', data=dict(email='kodyrogers21@gmail.com', password='wrong'))
+        self.assertTrue(float(self.server_timing(response)['hash']['dur']) > 0)
+        self.assertTrue(request_stats.endpoints()['author.author_login'].hash_time > 0)
+
+        # pages that hash nothing leave it out
+        self.assertNotIn('hash', self.server_timing(self.client.get('/contact')))
+
+    def test_slow_requests_are_logged(self):
+        with self.assertLogs('app.instrumentation', level='WARNING') as logs:
+            self.app.config['SLOW_REQUEST_QUERIES'] = 0
+            self.client.get('/worksheets_page')
+
+        self.assertIn('/worksheets_page', logs.output[0])
+        self.assertEqual(request_stats.endpoints()['worksheets.worksheets_page'].slow, 1)
+
+        self.app.config['SLOW_REQUEST_QUERIES'] = 1000
+        with self.assertNoLogs('app.instrumentation', level='WARNING') :
+            self.client.get('/worksheets_page')
+
+    def test_statements_outside_requests_are_ignored(self):
+        Worksheet.query.all()
+        self.assertEqual(request_stats.endpoints(), {})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -5,12 +5,14 @@ import unittest
 from flask_testing import TestCase
 from flask_sqlalchemy import SQLAlchemy
 from flask import session, url_for, template_rendered, current_app
-from app.models import Worksheet, WorksheetCategory, Author, Post, PostCategory, Learner
+from app.models import Worksheet, WorksheetCategory, Author, Post, PostCategory, Learner, worksheets_identifier
 from werkzeug.utils import secure_filename
 from app.database import db
 from config import TestConfiguration
 from app import create_app as c_app
 from contextlib import contextmanager
+from sqlalchemy.dialects import mysql
+from sqlalchemy.schema import CreateTable
 import pdfkit
 from app.mail import mail
 
@@ -202,6 +204,94 @@ class UserLoginLogout(TestCase):
             response_1 = c.get('/learner_logout', follow_redirects=True)
             self.assertEqual(response_1.status_code, 200)
             self.assertEqual(flask.session['learner_logged_in'], False)
+
+    def test_learner_loaded_by_id(self):
+        learner = Learner(name='KJsa', email='kodyrogers21@gmail.com', screenname='kod'
+                        , password='pbkdf2:sha256:150000$xZu2ipeP$5d4d84302c1d4628c57f7e3f2cfc4bea4fdf69ef1214e18333ba6ff29ec096d9')
+        other = Learner(name='other', email='other@example.com', password='x')
+        db.session.add(learner)
+        db.session.add(other)
+        db.session.commit()
+
+        with self.app.test_client() as c:
+            c.post('/learner_login', data=dict(email='kodyrogers21@gmail.com', password='RockOn'))
+            self.assertEqual(flask.session['learner_id'], learner.id)
+
+            # renaming the learner does not log them out
+            learner.name = 'renamed'
+            db.session.commit()
+            response = c.get('/learner_change_email/' + str(learner.id))
+            self.assert_template_used('learner_templates/learner_change_email.html.j2')
+
+            # someone else's pages send them home
+            response = c.get('/learner_change_email/' + str(other.id))
+            self.assertEqual(response.status_code, 302)
+
+            c.get('/learner_logout')
+            self.assertNotIn('learner_id', flask.session)
+
+    def test_favourites_pages(self):
+        w_cat = WorksheetCategory(name='dunk')
+        auth_1 = Author(name='Kidkaid', email='kodyrogers21@gmail.com', password='x')
+        learner = Learner(name='KJsa', email='kodyrogers21@gmail.com', password='x')
+        db.session.add_all([w_cat, auth_1, learner])
+        db.session.commit()
+
+        worksheets = []
+        for i in range(25) :
+            worksheets.append(Worksheet(pdf_url='w' + str(i) + '.pdf', name='worksheet ' + str(i), author=auth_1, category=w_cat, count=i % 5))
+        db.session.add_all(worksheets)
+        db.session.commit()
+
+        # added oldest first, every worksheet a second after the one before
+        db.session.execute(worksheets_identifier.insert(), [dict(learner_id=learner.id, worksheet_id=w.id, created_at=1000 + i)
+            for i, w in enumerate(worksheets)])
+        db.session.commit()
+
+        with self.app.test_client() as c:
+            with c.session_transaction() as sess:
+                sess['learner_logged_in'] = True
+                sess['learner_id'] = learner.id
+
+            with captured_templates(self.app) as templates:
+                c.get('/learner_dashboard')
+                template, context = templates[0]
+                self.assertEqual(context['favourites'], list(reversed(worksheets))[:20])
+
+            r = c.get(context['next_url'])
+            self.assertEqual([f['id'] for f in r.json['favourites']], [w.id for w in reversed(worksheets[:5])])
+            self.assertEqual(r.json['favourites'][0]['added_at'], 1004)
+            self.assertEqual(r.json['next_url'], None)
+
+            # most viewed first, ties newest first
+            r = c.get('/learner_favourites?sort=viewed')
+            expected = sorted(worksheets, key=lambda w: (w.count, w.id), reverse=True)
+            self.assertEqual([f['id'] for f in r.json['favourites']], [w.id for w in expected[:20]])
+            r = c.get(r.json['next_url'])
+            self.assertEqual([f['id'] for f in r.json['favourites']], [w.id for w in expected[20:]])
+
+            self.assertEqual(c.get('/learner_favourites?after=nonsense').status_code, 400)
+
+        self.assertEqual(self.client.get('/learner_favourites').status_code, 403)
+
+    def test_favourite_times_are_double_precision(self):
+        # a single precision FLOAT on MySQL rounds the times the cursors compare
+        ddl = str(CreateTable(worksheets_identifier).compile(dialect=mysql.dialect()))
+        self.assertIn('created_at FLOAT(53)', ddl)
+
+    def test_session_from_before_ids(self):
+        learner = Learner(name='KJsa', email='kodyrogers21@gmail.com', password='x')
+        db.session.add(learner)
+        db.session.commit()
+
+        with self.app.test_client() as c:
+            with c.session_transaction() as sess:
+                sess['learner_logged_in'] = True
+                sess['learner_name'] = 'KJsa'
+
+            c.get('/learner_dashboard')
+            self.assert_template_used('learner_templates/learner_dashboard.html.j2')
+            self.assertEqual(flask.session['learner_id'], learner.id)
             
             
 
@@ -423,7 +513,8 @@ class DatabaseEditTests(TestCase):
 
                 template, context = templates[0]
 
-                self.assertEqual(context['favourites'], learner.favourites)
+                self.assertEqual(sorted(context['favourites'], key=lambda w: w.id), learner.favourites.order_by(Worksheet.id).all())
+                self.assertEqual(context['next_url'], None)
 
                 response_1 = c.get('/learner_logout', follow_redirects=True)
                 self.assertEqual(response_1.status_code, 200)
@@ -468,7 +559,7 @@ class DatabaseEditTests(TestCase):
         self.assertEqual(response.status_code, 200)
 
         learner_1 = Learner.query.filter_by(email='kodyrogers21@gmail.com').first()
-        self.assertEqual(learner_1.favourites, [worksheet, worksheet_1, worksheet_2])
+        self.assertEqual(learner_1.favourites.all(), [worksheet, worksheet_1, worksheet_2])
 
         logout_learner(self.client)
 
@@ -0,0 +1,291 @@
+import unittest
+import json
+import socketserver
+import threading
+import time
+from flask_testing import TestCase
+from flask_mail import Message
+from sqlalchemy.exc import OperationalError
+from unittest import mock
+from config import TestConfiguration
+from app import create_app as c_app
+from app.models import Learner, MailJob
+from app.database import db
+from app.mail_queue import mail_queue
+
+#
+# A local SMTP server that keeps what it is sent. refuse_data makes it turn down
+# that many messages with a temporary error and refuse_connections turns
+# everyone away.
+#
+class FakeSMTPHandler(socketserver.StreamRequestHandler):
+    def reply(self, line):
+        self.wfile.write(line.encode('ascii') + b'\r\n')
+
+    def handle(self):
+        server = self.server
+        with server.lock :
+            server.connections += 1
+
+        if server.refuse_connections :
+            self.reply('421 fake.smtp not available')
+            return
+
+        self.reply('220 fake.smtp ESMTP')
+        data = None
+        while True :
+            line = self.rfile.readline()
+            if not line :
+                return
+
+            if not data == None :
+                if line == b'.\r\n' :
+                    with server.lock :
+                        if server.refuse_data > 0 :
+                            server.refuse_data -= 1
+                            self.reply('451 try again later')
+                        else :
+                            server.messages.append(b''.join(data))
+                            self.reply('250 OK')
+                    data = None
+                else :
+                    data.append(line)
+                continue
+
+            command = line[:4].upper()
+            if command in (b'EHLO', b'HELO') :
+                self.reply('250 fake.smtp')
+            elif command in (b'MAIL', b'RCPT', b'RSET', b'NOOP') :
+                self.reply('250 OK')
+            elif command == b'DATA' :
+                data = []
+                self.reply('354 go ahead')
+            elif command == b'QUIT' :
+                self.reply('221 bye')
+                return
+            else :
+                self.reply('502 not implemented')
+
+
+class FakeSMTPServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self):
+        socketserver.ThreadingTCPServer.__init__(self, ('127.0.0.1', 0), FakeSMTPHandler)
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.connections = 0
+        self.messages = []
+        self.refuse_data = 0
+        self.refuse_connections = False
+
+
+def queue(subject, recipient='kodyrogers21@gmail.com'):
+    msg = Message(subject, sender='kodyrogers21@gmail.com', recipients=[recipient])
+    msg.body = 'Hello'
+    mail_queue.send(msg)
+
+
+class MailQueueTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.server = FakeSMTPServer()
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def create_app(self):
+        class FakeSMTPConfiguration(TestConfiguration):
+            MAIL_SERVER = '127.0.0.1'
+            MAIL_PORT = self.server.server_address[1]
+            MAIL_USE_SSL = False
+            MAIL_USE_TLS = False
+            MAIL_SUPPRESS_SEND = False
+
+            # nothing is sent until the test drains the queue
+            MAIL_QUEUE_WORKER = 'process'
+            MAIL_QUEUE_INTERVAL = 3600
+            MAIL_QUEUE_BACKOFF = 30
+            MAIL_QUEUE_MAX_ATTEMPTS = 3
+
+        app = c_app(FakeSMTPConfiguration)
+        return app
+
+    # executed prior to each test
+    def setUp(self):
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+
+        self.server.reset()
+
+    # executed after each test
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def jobs(self):
+        db.session.expire_all()
+        return MailJob.query.order_by(MailJob.id).all()
+
+    def test_batch_sent_over_one_connection(self):
+        for subject in ['one', 'two', 'three'] :
+            queue(subject)
+        db.session.commit()
+
+        # queued, not sent
+        self.assertEqual(self.server.connections, 0)
+        self.assertEqual(len(self.jobs()), 3)
+
+        self.assertEqual(mail_queue.drain(), (3, 0))
+
+        self.assertEqual(self.server.connections, 1)
+        self.assertEqual(len(self.server.messages), 3)
+        self.assertIn(b'Subject: one', self.server.messages[0])
+        self.assertIn(b'Subject: three', self.server.messages[2])
+        self.assertEqual(self.jobs(), [])
+
+    def test_rollback_drops_message(self):
+        queue('never')
+        db.session.rollback()
+
+        self.assertEqual(self.jobs(), [])
+        self.assertEqual(mail_queue.drain(), (0, 0))
+
+    def test_retry_with_backoff(self):
+        self.server.refuse_data = 1
+        queue('one')
+        queue('two')
+        db.session.commit()
+
+        self.assertEqual(mail_queue.drain(), (1, 1))
+        self.assertEqual(len(self.server.messages), 1)
+        self.assertIn(b'Subject: two', self.server.messages[0])
+
+        job = self.jobs()[0]
+        self.assertEqual(job.attempts, 1)
+        self.assertIn('451', job.last_error)
+        self.assertAlmostEqual(job.run_at, time.time() + 30, delta=5)
+
+        # not due yet
+        self.assertEqual(mail_queue.drain(), (0, 0))
+
+        job.run_at = 0
+        db.session.commit()
+        self.assertEqual(mail_queue.drain(), (1, 0))
+        self.assertIn(b'Subject: one', self.server.messages[1])
+        self.assertEqual(self.jobs(), [])
+
+    def test_backoff_doubles_then_gives_up(self):
+        self.server.refuse_data = 10
+        queue('one')
+        db.session.commit()
+
+        waits = []
+        for i in range(3) :
+            before = time.time()
+            mail_queue.drain()
+            job = self.jobs()[0]
+            waits.append(round(job.run_at - before))
+            job.run_at = 0
+            db.session.commit()
+
+        self.assertEqual(waits, [30, 60, 120])
+        self.assertEqual(job.attempts, 3)
+        self.assertEqual(job.failed, True)
+        # the body can hold a temporary password so it is not kept
+        message = json.loads(job.message)
+        self.assertEqual(message['body'], None)
+        self.assertEqual((message['subject'], message['recipients']), ('one', ['kodyrogers21@gmail.com']))
+
+        # failed jobs are left alone
+        self.assertEqual(mail_queue.drain(), (0, 0))
+
+    def test_server_unavailable(self):
+        self.server.refuse_connections = True
+        queue('one')
+        queue('two')
+        db.session.commit()
+
+        self.assertEqual(mail_queue.drain(), (0, 2))
+        self.assertEqual([job.attempts for job in self.jobs()], [1, 1])
+
+        self.server.refuse_connections = False
+        for job in self.jobs() :
+            job.run_at = 0
+        db.session.commit()
+
+        self.assertEqual(mail_queue.drain(), (2, 0))
+
+    def test_claimed_jobs_are_not_taken_twice(self):
+        queue('one')
+        db.session.commit()
+
+        worker = self.app.extensions['mail_queue']
+        jobs = worker.claim()
+        self.assertEqual(len(jobs), 1)
+
+        # another worker finds nothing to do until the lease runs out
+        self.assertEqual(worker.claim(), [])
+
+    def test_background_thread_sends_after_commit(self):
+        worker = self.app.extensions['mail_queue']
+        worker.run_thread = True
+        worker.interval = 0.05
+
+        queue('one')
+        db.session.commit()
+
+        for i in range(100) :
+            if self.server.messages :
+                break
+            time.sleep(0.02)
+
+        # stop the thread before the tables are dropped
+        worker.interval = 3600
+        time.sleep(0.1)
+
+        self.assertEqual(len(self.server.messages), 1)
+
+    def test_password_reset_is_queued(self):
+        learner = Learner(name='KJsa', email='kodyrogers21@gmail.com', screenname='kod',
+            password='pbkdf2:sha256:150000$73fMtgAp$1a1d8be4973cb2676c5f17275c43dc08583c8e450c94a282f9c443d34f72464c')
+        db.session.add(learner)
+        db.session.commit()
+
+        response = self.client.post('/learner_password_reset', data=dict(email='kodyrogers21@gmail.com'))
+        self.assertEqual(response.status_code, 302)
+
+        # the request did not talk to the mail server
+        self.assertEqual(self.server.connections, 0)
+        self.assertEqual(len(self.jobs()), 1)
+
+        self.assertEqual(mail_queue.drain(), (1, 0))
+        self.assertIn(b'Subject: Temporary Password', self.server.messages[0])
+        self.assertIn(b'To: kodyrogers21@gmail.com', self.server.messages[0])
+
+    def test_password_reset_failure_keeps_the_error(self):
+        learner = Learner(name='KJsa', email='kodyrogers21@gmail.com', screenname='kod', password='x')
+        db.session.add(learner)
+        db.session.commit()
+
+        # the database goes away after the new password is set, so the mail
+        # saying the reset failed cannot be queued either
+        errors = [OperationalError('COMMIT', {}, Exception('gone')), OperationalError('COMMIT', {}, Exception('still gone'))]
+        with mock.patch.object(db.session, 'commit', side_effect=errors) :
+            with self.assertRaises(OperationalError) as raised :
+                self.client.post('/learner_password_reset', data=dict(email='kodyrogers21@gmail.com'))
+
+        self.assertEqual(str(raised.exception.orig), 'gone')
+        self.assertEqual(self.jobs(), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,177 @@
+import importlib
+import unittest
+import json
+import os
+import shutil
+import tempfile
+from unittest import mock
+from flask_testing import TestCase
+from config import TestConfiguration
+from app import create_app as c_app
+from app.models import Worksheet, WorksheetCategory, Author
+from app.database import db
+from app.metrics import metrics, Histogram, LATENCY_BUCKETS, exposition
+
+# app/__init__.py puts the extension where the module's name would be
+metrics_module = importlib.import_module('app.metrics')
+
+
+class TokenConfiguration(TestConfiguration):
+    METRICS_TOKEN = 'scrape-me'
+
+
+def sample(text, line):
+    for metric in text.splitlines() :
+        if metric.startswith(line + ' ') :
+            return float(metric.split(' ')[-1])
+    return None
+
+
+class MetricsTests(TestCase):
+    def create_app(self):
+        app = c_app(TokenConfiguration)
+        return app
+
+    # executed prior to each test
+    def setUp(self):
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+
+        w_cat = WorksheetCategory(name='dundk')
+        db.session.add(w_cat)
+
+        auth_1 = Author(name='Kidkaidf', email='kodyrogers21@gmail.com', password='pbkdf2:sha256:150000$73fMtgAp$1a1d8be4973cb2676c5f17275c43dc08583c8e450c94a282f9c443d34f72464c')
+        db.session.add(auth_1)
+
+        db.session.add(Worksheet(pdf_url='w.pdf', name='worksheet', author=auth_1, category=w_cat))
+        db.session.commit()
+
+    # executed after each test
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def scrape(self):
+        response = self.client.get('/metrics', headers={'Authorization' : 'Bearer scrape-me'})
+        self.assertEqual(response.status_code, 200)
+        return response.get_data(as_text=True)
+
+    def test_needs_admin_or_token(self):
+        self.assertEqual(self.client.get('/metrics').status_code, 403)
+        self.assertEqual(self.client.get('/metrics', headers={'Authorization' : 'Bearer wrong'}).status_code, 403)
+        self.assertEqual(self.client.get('/metrics', headers={'Authorization' : 'Bearer caf\u00e9'}).status_code, 403)
+
+        with self.client.session_transaction() as sess :
+            sess['logged_in'] = True
+        response = self.client.get('/metrics')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.content_type.startswith('text/plain; version=0.0.4'))
+
+    def test_counts_requests_by_endpoint_and_status(self):
+        self.client.get('/worksheets_page')
+        self.client.get('/worksheets_page')
+        self.client.get('/worksheet_pdf/1000')
+
+        text = self.scrape()
+        self.assertEqual(sample(text, 'lifelonglearning_http_requests_total{endpoint="worksheets.worksheets_page",method="GET",status="200"}'), 2)
+        self.assertEqual(sample(text, 'lifelonglearning_http_request_duration_seconds_count{endpoint="worksheets.worksheets_page"}'), 2)
+        self.assertEqual(sample(text, 'lifelonglearning_http_request_duration_seconds_bucket{endpoint="worksheets.worksheets_page",le="+Inf"}'), 2)
+        self.assertIsNotNone(sample(text, 'lifelonglearning_http_requests_total{endpoint="worksheets.worksheet_pdf",method="GET",status="200"}'))
+
+    def test_in_flight_and_pool_wait(self):
+        self.client.get('/worksheets_page')
+
+        text = self.scrape()
+        # the scrape itself is the only request running
+        self.assertEqual(sample(text, 'lifelonglearning_http_requests_in_flight{endpoint="other.metrics_page"}'), 1)
+        self.assertEqual(sample(text, 'lifelonglearning_http_requests_in_flight{endpoint="worksheets.worksheets_page"}'), 0)
+        self.assertGreater(sample(text, 'lifelonglearning_db_pool_checkout_seconds_count{}'), 0)
+
+
+class HistogramTests(unittest.TestCase):
+    def test_buckets_are_cumulative(self):
+        histogram = Histogram(LATENCY_BUCKETS)
+        for seconds in (0.001, 0.02, 0.02, 60) :
+            histogram.observe(seconds)
+
+        text = exposition([{'pid' : os.getpid(), 'requests' : [], 'in_flight' : {},
+            'latency' : {'a' : histogram.dump()}, 'pool_wait' : Histogram((1.0,)).dump()}])
+        name = 'lifelonglearning_http_request_duration_seconds'
+        self.assertEqual(sample(text, name + '_bucket{endpoint="a",le="0.005"}'), 1)
+        self.assertEqual(sample(text, name + '_bucket{endpoint="a",le="0.025"}'), 3)
+        self.assertEqual(sample(text, name + '_bucket{endpoint="a",le="10.0"}'), 3)
+        self.assertEqual(sample(text, name + '_bucket{endpoint="a",le="+Inf"}'), 4)
+        self.assertEqual(sample(text, name + '_count{endpoint="a"}'), 4)
+
+
+class DirectoryConfiguration(TestConfiguration):
+    METRICS_DIR = os.path.join(tempfile.gettempdir(), 'lifelonglearning-metrics-tests')
+    METRICS_WRITE_INTERVAL = 0
+
+
+class AggregationTests(TestCase):
+    def create_app(self):
+        shutil.rmtree(DirectoryConfiguration.METRICS_DIR, ignore_errors=True)
+        app = c_app(DirectoryConfiguration)
+        return app
+
+    def setUp(self):
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+        shutil.rmtree(DirectoryConfiguration.METRICS_DIR, ignore_errors=True)
+
+    def other_worker(self, pid, in_flight):
+        histogram = Histogram(LATENCY_BUCKETS)
+        histogram.observe(0.3)
+        with open(os.path.join(DirectoryConfiguration.METRICS_DIR, 'metrics-%d.json' % pid), 'w') as f :
+            json.dump({'pid' : pid, 'requests' : [['other.home', 'GET', '200', 5]],
+                'latency' : {'other.home' : histogram.dump()}, 'in_flight' : {'other.home' : in_flight},
+                'pool_wait' : Histogram((1.0,)).dump()}, f)
+
+    def test_adds_up_every_worker(self):
+        self.client.get('/home')
+        self.assertTrue(os.path.exists(os.path.join(DirectoryConfiguration.METRICS_DIR, 'metrics-%d.json' % os.getpid())))
+
+        # the parent of the tests is alive, a pid past pid_max never is
+        self.other_worker(os.getppid(), 1)
+        self.other_worker(2 ** 22 + 1, 3)
+
+        with self.app.test_request_context() :
+            text = metrics.exposition()
+
+        self.assertEqual(sample(text, 'lifelonglearning_http_requests_total{endpoint="other.home",method="GET",status="200"}'), 11)
+        self.assertEqual(sample(text, 'lifelonglearning_http_request_duration_seconds_count{endpoint="other.home"}'), 3)
+        self.assertEqual(sample(text, 'lifelonglearning_http_requests_in_flight{endpoint="other.home"}'), 1)
+
+    def written(self):
+        with open(os.path.join(DirectoryConfiguration.METRICS_DIR, 'metrics-%d.json' % os.getpid())) as f :
+            return json.load(f)
+
+    def test_file_shows_the_request_in_flight(self):
+        with self.app.test_request_context('/home') :
+            self.app.preprocess_request()
+            self.assertEqual(self.written()['in_flight'], {'other.home' : 1})
+
+    def test_thread_writes_what_is_left(self):
+        process = self.app.extensions['metrics']
+        process.write(force=True)
+        process.observe_request('other.home', 'GET', 200, 0.1)
+
+        with mock.patch.object(metrics_module.time, 'sleep', side_effect=[None, StopIteration]) :
+            with self.assertRaises(StopIteration) :
+                process.run()
+
+        self.assertEqual(self.written()['requests'], [['other.home', 'GET', '200', 1]])
+        self.assertFalse(process.changed)
+
+
+if __name__ == '__main__':
+    unittest.main()
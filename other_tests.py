@@ -173,8 +173,46 @@ class DatabaseTests(TestCase):
                 self.assertEqual(context['worksheet_categories'], [w_cat])
                 self.assertEqual(context['learners'], [learner, learner_1, learner_2, learner_3])
                 logout(c)
-                
-                
+
+    def test_home_carousel(self):
+        w_cat = WorksheetCategory(name='dundk')
+        db.session.add(w_cat)
+
+        auth_1 = Author(name='Kidkaidf', email='kodyrogers21@gmail.com', password='pbkdf2:sha256:150000$73fMtgAp$1a1d8be4973cb2676c5f17275c43dc08583c8e450c94a282f9c443d34f72464c')
+        db.session.add(auth_1)
+        db.session.commit()
+
+        worksheets = []
+        for i in range(12) :
+            worksheet = Worksheet(pdf_url='w' + str(i) + '.pdf', name='worksheet' + str(i), author=auth_1, category=w_cat)
+            db.session.add(worksheet)
+            worksheets.append(worksheet)
+        db.session.commit()
+
+        worksheets.reverse()
+
+        # the home page only gets the first batch of slides
+        with self.app.test_client() as c:
+            with captured_templates(self.app) as templates:
+                r = c.get('/')
+                template, context = templates[0]
+                self.assertEqual(context['worksheets'], worksheets[0:5])
+                self.assertEqual(context['next_slides_url'], flask.url_for('other.home_slides', after=worksheets[4].id))
+
+        # the rest come from home_slides
+        r = self.client.get(flask.url_for('other.home_slides', after=worksheets[4].id))
+        self.assertEqual([slide['id'] for slide in r.json['slides']], [w.id for w in worksheets[5:10]])
+        self.assertEqual(r.json['slides'][0]['author_name'], 'Kidkaidf')
+        self.assertEqual(r.json['slides'][0]['pdf_url'], flask.url_for('worksheets.worksheet_pdf', id=worksheets[5].id, v=worksheets[5].sha256))
+        self.assertEqual(r.json['slides'][0]['view_url'], flask.url_for('worksheets.worksheets_count', id=worksheets[5].id))
+        self.assertEqual(r.json['slides'][0]['thumbnail_url'], None)
+        self.assertEqual(r.json['next_url'], flask.url_for('other.home_slides', after=worksheets[9].id))
+
+        r = self.client.get(r.json['next_url'])
+        self.assertEqual([slide['id'] for slide in r.json['slides']], [w.id for w in worksheets[10:12]])
+        self.assertEqual(r.json['next_url'], None)
+
+
 if __name__ == "__main__":
     unittest.main()
     
\ No newline at end of file
@@ -0,0 +1,155 @@
+import unittest
+from flask_testing import TestCase
+from config import TestConfiguration
+from app import create_app as c_app
+from flask import url_for, template_rendered
+from app.models import Worksheet, WorksheetCategory, Author
+from app.database import db
+from app.pagination import paginate, cursor_for_page, seek, decode_cursor
+from contextlib import contextmanager
+from sqlalchemy import event
+
+@contextmanager
+def captured_templates(app):
+    recorded = []
+    def record(sender, template, context, **extra):
+        recorded.append((template, context))
+    template_rendered.connect(record, app)
+    try:
+        yield recorded
+    finally:
+        template_rendered.disconnect(record, app)
+
+@contextmanager
+def captured_statements():
+    statements = []
+    def record(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+    event.listen(db.engine, 'before_cursor_execute', record)
+    try:
+        yield statements
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', record)
+
+
+class PaginationTests(TestCase):
+    def create_app(self):
+        app = c_app(TestConfiguration)
+        return app
+
+    # executed prior to each test
+    def setUp(self):
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+
+        w_cat = WorksheetCategory(name='dundk')
+        db.session.add(w_cat)
+
+        auth_1 = Author(name='Kidkaidf', email='kodyrogers21@gmail.com', password='pbkdf2:sha256:150000$73fMtgAp$1a1d8be4973cb2676c5f17275c43dc08583c8e450c94a282f9c443d34f72464c')
+        db.session.add(auth_1)
+        db.session.commit()
+
+        for i in range(25) :
+            db.session.add(Worksheet(pdf_url='w' + str(i) + '.pdf', name='worksheet ' + str(i), author_id=auth_1.id, category_id=w_cat.id))
+        db.session.commit()
+
+    # executed after each test
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def test_walk_forward_and_back(self):
+        ids = [w.id for w in Worksheet.query.order_by(Worksheet.id.desc()).all()]
+
+        page = paginate(Worksheet.query, Worksheet.id, 9)
+        self.assertEqual([w.id for w in page.items], ids[0:9])
+        self.assertFalse(page.has_prev)
+
+        page = paginate(Worksheet.query, Worksheet.id, 9, after=page.next_after)
+        self.assertEqual([w.id for w in page.items], ids[9:18])
+        self.assertTrue(page.has_prev)
+
+        last = paginate(Worksheet.query, Worksheet.id, 9, after=page.next_after)
+        self.assertEqual([w.id for w in last.items], ids[18:25])
+        self.assertFalse(last.has_next)
+
+        back = paginate(Worksheet.query, Worksheet.id, 9, before=last.prev_before)
+        self.assertEqual([w.id for w in back.items], ids[9:18])
+        self.assertTrue(back.has_prev)
+
+        first = paginate(Worksheet.query, Worksheet.id, 9, before=back.prev_before)
+        self.assertEqual([w.id for w in first.items], ids[0:9])
+        self.assertFalse(first.has_prev)
+
+    def test_seek_on_several_columns(self):
+        # lots of ties on count, the id breaks them
+        for worksheet in Worksheet.query.all() :
+            worksheet.count = worksheet.id % 3
+        db.session.commit()
+
+        columns = (Worksheet.count, Worksheet.id)
+        key = lambda w: (w.count, w.id)
+        expected = [w.id for w in Worksheet.query.order_by(Worksheet.count.desc(), Worksheet.id.desc()).all()]
+
+        seen = []
+        page = seek(Worksheet.query, columns, 4, key)
+        seen.extend(w.id for w in page.items)
+        while page.has_next :
+            page = seek(Worksheet.query, columns, 4, key, after=page.next_after)
+            seen.extend(w.id for w in page.items)
+
+        self.assertEqual(seen, expected)
+
+        with self.assertRaises(ValueError) :
+            decode_cursor('1', columns)
+        with self.assertRaises(ValueError) :
+            decode_cursor('a,1', columns)
+
+    def test_old_page_numbers(self):
+        ids = [w.id for w in Worksheet.query.order_by(Worksheet.id.desc()).all()]
+
+        self.assertEqual(cursor_for_page(Worksheet.query, Worksheet.id, 9, 1), ids[8])
+        self.assertEqual(cursor_for_page(Worksheet.query, Worksheet.id, 9, 5), None)
+
+        page = paginate(Worksheet.query, Worksheet.id, 9, page=2)
+        self.assertEqual([w.id for w in page.items], ids[18:25])
+
+        page = paginate(Worksheet.query, Worksheet.id, 9, page=5)
+        self.assertEqual(page.items, [])
+        self.assertTrue(page.has_prev)
+
+    def test_cursor_page_is_one_query(self):
+        ids = [w.id for w in Worksheet.query.order_by(Worksheet.id.desc()).all()]
+
+        with captured_statements() as statements:
+            page = paginate(Worksheet.query, Worksheet.id, 9, after=ids[8])
+
+        self.assertEqual(len(statements), 1)
+        self.assertIn('worksheets.id < ?', statements[0])
+        self.assertEqual(page.next_after, ids[17])
+
+    def test_worksheets_page_cursor_urls(self):
+        ids = [w.id for w in Worksheet.query.order_by(Worksheet.id.desc()).all()]
+
+        with self.app.test_client() as c:
+            with captured_templates(self.app) as templates:
+                r = c.get(url_for('worksheets.worksheets_page', after=ids[8]))
+                self.assertEqual(r.status_code, 200)
+                template, context = templates[0]
+                self.assertEqual([w.id for w in context['worksheets']], ids[9:18])
+                self.assertEqual(context['next_url'], url_for('worksheets.worksheets_page', after=ids[17]))
+                self.assertEqual(context['prev_url'], url_for('worksheets.worksheets_page', before=ids[9]))
+
+        with self.app.test_client() as c:
+            with captured_templates(self.app) as templates:
+                r = c.get(url_for('worksheets.worksheets_page', before=ids[9]))
+                self.assertEqual(r.status_code, 200)
+                template, context = templates[0]
+                self.assertEqual([w.id for w in context['worksheets']], ids[0:9])
+                self.assertEqual(context['prev_url'], None)
+
+
+if __name__ == "__main__":
+    unittest.main()
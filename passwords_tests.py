@@ -0,0 +1,117 @@
+import importlib
+import unittest
+from unittest import mock
+from flask_testing import TestCase
+from config import TestConfiguration
+from app import create_app as c_app
+from app.models import Author, Learner
+from app.database import db
+from app.passwords import passwords, full_method
+from werkzeug.security import generate_password_hash, check_password_hash
+
+# app/__init__.py puts the extension where the module's name would be
+passwords_module = importlib.import_module('app.passwords')
+
+# the hash of 'RockOn' the other tests use
+ROCK_ON = 'pbkdf2:sha256:150000$73fMtgAp$1a1d8be4973cb2676c5f17275c43dc08583c8e450c94a282f9c443d34f72464c'
+
+
+class StrongerConfiguration(TestConfiguration):
+    PASSWORD_METHOD = 'pbkdf2:sha256:160000'
+    PASSWORD_SALT_LENGTH = 16
+
+
+class PasswordTestCase(TestCase):
+    # executed prior to each test
+    def setUp(self):
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+
+        db.session.add(Author(name='Kidkaidf', email='kodyrogers21@gmail.com', password=ROCK_ON))
+        db.session.add(Learner(name='learner', email='learner@example.com', password=ROCK_ON))
+        db.session.commit()
+
+    # executed after each test
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def checks(self, url, **data):
+        with mock.patch.object(passwords_module, 'check_password_hash', wraps=check_password_hash) as checked :
+            self.client.post(url, data=data)
+        return checked.call_count
+
+
+class PasswordTests(PasswordTestCase):
+    def create_app(self):
+        app = c_app(TestConfiguration)
+        return app
+
+    def test_each_login_checks_once(self):
+        self.assertEqual(self.checks('/author_login', email='kodyrogers21@gmail.com', password='wrong'), 1)
+        self.assertEqual(self.checks('/author_login', email='kodyrogers21@gmail.com', password='RockOn'), 1)
+        self.assertEqual(self.checks('/learner_login', email='learner@example.com', password='wrong'), 1)
+        self.assertEqual(self.checks('/learner_login', email='learner@example.com', password='RockOn'), 1)
+        self.assertEqual(self.checks('/login', username='LLLRocks', password='wrong'), 1)
+
+        # an unknown email is not hashed at all
+        self.assertEqual(self.checks('/learner_login', email='nobody@example.com', password='wrong'), 0)
+
+    def test_wrong_password(self):
+        response = self.client.post('/learner_login', data=dict(email='learner@example.com', password='wrong'), follow_redirects=True)
+        self.assertIn(b'password was incorrect', response.data)
+        with self.client.session_transaction() as session :
+            self.assertFalse(session.get('learner_logged_in'))
+
+    def test_current_hashes_are_kept(self):
+        self.client.post('/author_login', data=dict(email='kodyrogers21@gmail.com', password='RockOn'))
+        self.assertEqual(Author.query.first().password, ROCK_ON)
+
+    def test_full_method(self):
+        self.assertEqual(full_method('pbkdf2:sha256'), 'pbkdf2:sha256:150000')
+        self.assertEqual(full_method('pbkdf2:sha512:300000'), 'pbkdf2:sha512:300000')
+
+        self.assertFalse(passwords.needs_rehash(ROCK_ON))
+        self.assertTrue(passwords.needs_rehash(generate_password_hash('x', method='pbkdf2:sha256:1000')))
+        self.assertTrue(passwords.needs_rehash(generate_password_hash('x', salt_length=4)))
+
+        self.app.config['PASSWORD_METHOD'] = 'pbkdf2:sha256'
+        self.assertFalse(passwords.needs_rehash(ROCK_ON))
+
+
+class RehashTests(PasswordTestCase):
+    def create_app(self):
+        app = c_app(StrongerConfiguration)
+        return app
+
+    def test_rehashed_on_login(self):
+        self.client.post('/author_login', data=dict(email='kodyrogers21@gmail.com', password='RockOn'))
+        self.client.post('/learner_login', data=dict(email='learner@example.com', password='RockOn'))
+
+        for user in (Author.query.first(), Learner.query.first()) :
+            method, salt, hashed = user.password.split('$')
+            self.assertEqual(method, 'pbkdf2:sha256:160000')
+            self.assertEqual(len(salt), 16)
+            self.assertTrue(check_password_hash(user.password, 'RockOn'))
+
+        # the new hash logs in and is not replaced again
+        password = Author.query.first().password
+        self.client.get('/author_logout')
+        self.client.post('/author_login', data=dict(email='kodyrogers21@gmail.com', password='RockOn'))
+        with self.client.session_transaction() as session :
+            self.assertTrue(session.get('author_logged_in'))
+        db.session.expire_all()
+        self.assertEqual(Author.query.first().password, password)
+
+    def test_wrong_password_is_not_rehashed(self):
+        self.client.post('/author_login', data=dict(email='kodyrogers21@gmail.com', password='wrong'))
+        self.assertEqual(Author.query.first().password, ROCK_ON)
+
+    def test_new_passwords_use_the_method(self):
+        self.assertTrue(passwords.hash('secret').startswith('pbkdf2:sha256:160000$'))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,163 @@
+import importlib
+import unittest
+import os
+import shutil
+import tempfile
+from unittest import mock
+from flask_testing import TestCase
+from config import TestConfiguration
+from app import create_app as c_app
+from app.models import Learner, Worksheet, WorksheetCategory, Author
+from app.database import db
+from app.ratelimit import parse_limit, fill, Limit, MemoryStorage, SqliteStorage
+from sqlalchemy import event
+from werkzeug.security import generate_password_hash
+
+# app/__init__.py puts the extension where the module's name would be
+passwords_module = importlib.import_module('app.passwords')
+
+
+class RateLimitConfiguration(TestConfiguration):
+    RATE_LIMIT_ENABLED = True
+    RATE_LIMIT_STORAGE = 'memory'
+    RATE_LIMITS = {
+        'learner.learner_login' : {'methods' : ('POST',), 'ip' : '4/minute', 'account' : '2/minute'},
+        'worksheets.worksheets_count' : {'ip' : '3/hour'},
+    }
+
+
+class RateLimitTests(TestCase):
+    def create_app(self):
+        app = c_app(RateLimitConfiguration)
+        return app
+
+    # executed prior to each test
+    def setUp(self):
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+
+        db.session.add(Learner(name='learner', email='learner@example.com', password=generate_password_hash('secret')))
+        author = Author(name='author', email='author@example.com', password='x')
+        db.session.add(Worksheet(name='worksheet', pdf_url='w.pdf', author=author, category=WorksheetCategory(name='c')))
+        db.session.commit()
+
+    # executed after each test
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def login(self, email, password='wrong'):
+        return self.client.post('/learner_login', data=dict(email=email, password=password))
+
+    def test_account_limit(self):
+        self.assertEqual(self.login('learner@example.com').status_code, 302)
+        self.assertEqual(self.login('LEARNER@example.com ').status_code, 302)
+
+        response = self.login('learner@example.com')
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response.headers['Retry-After'], '30')
+
+        # another account from the same address still gets through
+        self.assertEqual(self.login('other@example.com').status_code, 302)
+
+    def test_ip_limit(self):
+        for i in range(4) :
+            self.assertEqual(self.login('user%d@example.com' % i).status_code, 302)
+
+        response = self.login('user5@example.com')
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response.headers['Retry-After'], '15')
+
+        # other addresses have their own buckets
+        response = self.client.post('/learner_login', data=dict(email='user6@example.com', password='wrong'),
+            environ_base={'REMOTE_ADDR' : '10.0.0.2'})
+        self.assertEqual(response.status_code, 302)
+
+    def test_refused_before_any_work(self):
+        self.login('learner@example.com')
+        self.login('learner@example.com')
+
+        statements = []
+        def record(conn, cursor, statement, parameters, context, executemany):
+            statements.append(statement)
+
+        event.listen(db.engine, 'before_cursor_execute', record)
+        try :
+            with mock.patch.object(passwords_module, 'check_password_hash') as checked :
+                self.assertEqual(self.login('learner@example.com').status_code, 429)
+        finally :
+            event.remove(db.engine, 'before_cursor_execute', record)
+
+        self.assertEqual(statements, [])
+        self.assertEqual(checked.call_count, 0)
+
+    def test_form_is_still_read_by_the_view(self):
+        self.login('learner@example.com', 'secret')
+        with self.client.session_transaction() as session :
+            self.assertTrue(session.get('learner_logged_in'))
+
+    def test_only_limited_methods_and_endpoints(self):
+        for i in range(10) :
+            self.assertEqual(self.client.get('/learner_login').status_code, 200)
+            self.assertEqual(self.client.get('/contact').status_code, 200)
+
+    def test_worksheet_clicks(self):
+        for i in range(3) :
+            self.assertEqual(self.client.get('/worksheets_count/1').status_code, 302)
+
+        response = self.client.get('/worksheets_count/1')
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response.headers['Retry-After'], '1200')
+
+
+class TokenBucketTests(unittest.TestCase):
+    def test_parse_limit(self):
+        self.assertEqual(parse_limit('5/minute'), Limit(5, 5 / 60))
+        self.assertEqual(parse_limit('10 / seconds'), Limit(10, 10))
+        self.assertRaises(ValueError, parse_limit, '0/minute')
+
+    def test_fill(self):
+        limit = parse_limit('2/minute')
+        tokens, wait = fill(None, None, limit, 100)
+        self.assertEqual((tokens, wait), (1, 0))
+        tokens, wait = fill(tokens, 100, limit, 100)
+        self.assertEqual((tokens, wait), (0, 0))
+        tokens, wait = fill(tokens, 100, limit, 110)
+        self.assertAlmostEqual(wait, 20)
+
+        # a bucket never holds more than its burst
+        tokens, wait = fill(0, 0, limit, 10000)
+        self.assertEqual((tokens, wait), (1, 0))
+
+    def test_memory_storage(self):
+        storage = MemoryStorage()
+        limit = parse_limit('1/second')
+        self.assertEqual(storage.take('a', limit, 100), 0)
+        self.assertAlmostEqual(storage.take('a', limit, 100.5), 0.5)
+        self.assertEqual(storage.take('b', limit, 100.5), 0)
+
+    def test_sqlite_storage_is_shared(self):
+        directory = tempfile.mkdtemp()
+        try :
+            path = os.path.join(directory, 'ratelimit.sqlite')
+            worker_1 = SqliteStorage(path)
+            worker_2 = SqliteStorage(path)
+            limit = parse_limit('2/minute')
+
+            self.assertEqual(worker_1.take('login', limit, 100), 0)
+            self.assertEqual(worker_2.take('login', limit, 100), 0)
+            self.assertAlmostEqual(worker_1.take('login', limit, 100), 30)
+
+            # full buckets are removed once in a while
+            worker_2.swept = 0
+            worker_2.take('other', limit, 1000)
+            rows = worker_2.connection().execute('SELECT key FROM buckets').fetchall()
+            self.assertEqual(rows, [('other',)])
+        finally :
+            shutil.rmtree(directory)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,165 @@
+import importlib
+import unittest
+from flask_testing import TestCase
+from config import TestConfiguration
+from app import create_app as c_app
+from app.models import Learner, Worksheet, WorksheetCategory, WorksheetNeighbour, Author, worksheets_identifier
+from app.database import db
+from app.recommendations import recommendations, neighbours_in_python, neighbours_with_scipy
+from app.queries import recommended_for_worksheet, recommended_for_learner
+from werkzeug.security import generate_password_hash
+
+# app/__init__.py puts the extension where the module's name would be
+recommendations_module = importlib.import_module('app.recommendations')
+
+# learner -> the worksheets they like
+LIKES = {
+    1 : [1, 2, 3],
+    2 : [1, 2],
+    3 : [2, 4],
+}
+
+
+class RecommendationsTests(TestCase):
+    def create_app(self):
+        app = c_app(TestConfiguration)
+        return app
+
+    # executed prior to each test
+    def setUp(self):
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+
+        author = Author(name='author', email='author@example.com', password='x')
+        category = WorksheetCategory(name='algebra')
+        for i in range(1, 7) :
+            db.session.add(Worksheet(name='worksheet %d' % i, pdf_url='%d.pdf' % i, author=author, category=category))
+        for i in range(1, 5) :
+            db.session.add(Learner(name='learner %d' % i, email='learner%d@example.com' % i, password=generate_password_hash('secret')))
+        db.session.commit()
+
+    # executed after each test
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def add_likes(self, likes):
+        for learner_id, worksheet_ids in likes.items() :
+            for worksheet_id in worksheet_ids :
+                db.session.execute(worksheets_identifier.insert().values(learner_id=learner_id, worksheet_id=worksheet_id))
+        db.session.commit()
+
+    def like(self, learner_id, worksheet_id):
+        self.client.post('/learner_login', data=dict(email='learner%d@example.com' % learner_id, password='secret'))
+        response = self.client.get('/add_favourite/%d/%d' % (learner_id, worksheet_id))
+        self.client.get('/learner_logout')
+        return response
+
+    def neighbours(self, with_scores=False):
+        db.session.expire_all()
+        rows = WorksheetNeighbour.query.order_by(WorksheetNeighbour.worksheet_id, WorksheetNeighbour.score.desc(),
+            WorksheetNeighbour.neighbour_id).all()
+        if with_scores :
+            return [(row.worksheet_id, row.neighbour_id, row.together, round(row.score, 6)) for row in rows]
+        return [(row.worksheet_id, row.neighbour_id, row.together) for row in rows]
+
+    def test_rebuild(self):
+        self.add_likes(LIKES)
+        self.assertEqual(recommendations.rebuild(), 4)
+
+        self.assertEqual(self.neighbours(with_scores=True), [
+            (1, 2, 2, round(2 / 6 ** 0.5, 6)), (1, 3, 1, round(1 / 2 ** 0.5, 6)),
+            (2, 1, 2, round(2 / 6 ** 0.5, 6)), (2, 3, 1, round(1 / 3 ** 0.5, 6)), (2, 4, 1, round(1 / 3 ** 0.5, 6)),
+            (3, 1, 1, round(1 / 2 ** 0.5, 6)), (3, 2, 1, round(1 / 3 ** 0.5, 6)),
+            (4, 2, 1, round(1 / 3 ** 0.5, 6)),
+        ])
+
+        # a rebuild replaces what was there
+        db.session.execute(worksheets_identifier.delete().where(worksheets_identifier.c.learner_id == 3))
+        db.session.commit()
+        recommendations.rebuild()
+        self.assertEqual([row for row in self.neighbours() if 4 in row[:2]], [])
+
+    def test_favourites_keep_it_current(self):
+        for learner_id, worksheet_ids in LIKES.items() :
+            for worksheet_id in worksheet_ids :
+                self.assertEqual(self.like(learner_id, worksheet_id).status_code, 302)
+
+        incremental = self.neighbours()
+        recommendations.rebuild()
+        self.assertEqual(sorted(incremental), sorted(self.neighbours()))
+
+    def test_only_the_best_are_kept(self):
+        self.app.extensions['recommendations'].k = 2
+        self.add_likes({4 : [1]})
+        db.session.add(WorksheetNeighbour(worksheet_id=1, neighbour_id=2, together=3, score=0.3))
+        db.session.add(WorksheetNeighbour(worksheet_id=1, neighbour_id=3, together=2, score=0.2))
+        db.session.commit()
+
+        self.like(4, 5)
+
+        self.assertEqual(self.neighbours(with_scores=True), [
+            (1, 5, 1, 1.0), (1, 2, 3, 0.3),
+            (5, 1, 1, 1.0),
+        ])
+
+    def test_deleted_worksheets_are_forgotten(self):
+        self.add_likes(LIKES)
+        recommendations.rebuild()
+
+        author = Author.query.first()
+        with self.client.session_transaction() as sess :
+            sess['author_logged_in'] = True
+            sess['author_id'] = author.id
+        self.client.get('/delete_worksheet/2')
+
+        self.assertEqual(Worksheet.query.get(2), None)
+        self.assertEqual([row for row in self.neighbours() if 2 in row[:2]], [])
+        self.assertEqual([worksheet.name for worksheet in recommended_for_worksheet(1, 5)], ['worksheet 3'])
+
+    def test_lookups(self):
+        self.add_likes(LIKES)
+        recommendations.rebuild()
+
+        self.assertEqual([worksheet.name for worksheet in recommended_for_worksheet(2, 2)], ['worksheet 1', 'worksheet 3'])
+        self.assertEqual(recommended_for_worksheet(6, 5), [])
+
+        learner = Learner.query.get(2)
+        self.assertEqual([worksheet.name for worksheet in recommended_for_learner(learner, 5)], ['worksheet 3', 'worksheet 4'])
+        self.assertEqual(recommended_for_learner(Learner.query.get(4), 5), [])
+
+    def test_pages(self):
+        self.add_likes(LIKES)
+        recommendations.rebuild()
+
+        response = self.client.get('/specific_worksheet/4')
+        self.assertIn(b'Learners who liked this also liked', response.data)
+        self.assertIn(b'/specific_worksheet/2', response.data)
+
+        response = self.client.get('/specific_worksheet/6')
+        self.assertNotIn(b'Learners who liked this also liked', response.data)
+
+        self.client.post('/learner_login', data=dict(email='learner2@example.com', password='secret'))
+        response = self.client.get('/learner_dashboard')
+        self.assertIn(b'Recommended for you', response.data)
+        self.assertIn(b'/specific_worksheet/3', response.data)
+        self.assertIn(b'/specific_worksheet/4', response.data)
+        self.assertNotIn(b'/specific_worksheet/1', response.data)
+
+    def test_scipy_matches_python(self):
+        if recommendations_module.sparse == None :
+            self.skipTest('scipy is not installed')
+
+        pairs = [(learner_id, worksheet_id) for learner_id, worksheet_ids in LIKES.items() for worksheet_id in worksheet_ids]
+        python = neighbours_in_python(pairs, 2)
+        vectorised = neighbours_with_scipy(pairs, 2)
+
+        self.assertEqual(sorted(python), sorted(vectorised))
+        for worksheet_id in python :
+            self.assertEqual([n[:2] for n in python[worksheet_id]], [n[:2] for n in vectorised[worksheet_id]])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,147 @@
+import unittest
+import shutil
+from unittest import mock
+from sqlalchemy.dialects import mysql
+from sqlalchemy.schema import CreateTable
+from flask_testing import TestCase
+from config import TestConfiguration
+from app import create_app as c_app
+from app.models import WorksheetCategory, Author, WorksheetTerm, RelatedWorksheet
+from app.database import db
+from app.related import related_worksheets, term_counts, related_in_python, related_with_scipy
+from app.queries import related_to_worksheet
+import app.related
+
+# the search tests upload worksheets the same way
+from search_tests import login_author, add_worksheet, edit_worksheet, read_text
+
+WORKSHEETS = [
+    ('Fractions', b'fractions decimals percentages numerator denominator'),
+    ('Decimals', b'fractions decimals ratios place value'),
+    ('Triangles', b'triangles circles angles hypotenuse'),
+    ('Polygons', b'triangles angles polygons hexagons'),
+]
+
+
+class RelatedConfiguration(TestConfiguration):
+    SEARCH_PDF_EXTRACTOR = read_text
+
+
+class RelatedTests(TestCase):
+    def create_app(self):
+        app = c_app(RelatedConfiguration)
+        return app
+
+    # executed prior to each test
+    def setUp(self):
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+
+        db.session.add(WorksheetCategory(name='maths'))
+        db.session.add(Author(name='Kidkaidf', email='kodyrogers21@gmail.com', password='pbkdf2:sha256:150000$73fMtgAp$1a1d8be4973cb2676c5f17275c43dc08583c8e450c94a282f9c443d34f72464c'))
+        db.session.commit()
+
+        login_author(self.client, email='kodyrogers21@gmail.com', password='RockOn')
+        for title, content in WORKSHEETS :
+            add_worksheet(self.client, title, content)
+
+    # executed after each test
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+        shutil.rmtree('pdfs', ignore_errors=True)
+        shutil.rmtree('thumbs', ignore_errors=True)
+
+    def related(self):
+        db.session.expire_all()
+        found = {}
+        for row in RelatedWorksheet.query.order_by(RelatedWorksheet.worksheet_id, RelatedWorksheet.score.desc(),
+                RelatedWorksheet.related_id) :
+            found.setdefault(row.worksheet_id, []).append(row.related_id)
+        return found
+
+    def test_added_worksheets_are_related(self):
+        self.assertEqual(self.related(), {1 : [2], 2 : [1], 3 : [4], 4 : [3]})
+
+        # the weights of a worksheet are normalised
+        weights = [term.weight for term in WorksheetTerm.query.filter_by(worksheet_id=4)]
+        self.assertAlmostEqual(sum(weight * weight for weight in weights), 1.0)
+
+    def test_rebuild_agrees(self):
+        incremental = self.related()
+        self.assertEqual(related_worksheets.rebuild(), 4)
+        self.assertEqual(self.related(), incremental)
+
+        score = RelatedWorksheet.query.get((1, 2)).score
+        self.assertTrue(0 < score < 1)
+        self.assertAlmostEqual(RelatedWorksheet.query.get((2, 1)).score, score)
+
+    def test_editing_the_pdf_moves_it(self):
+        edit_worksheet(self.client, 3, 'Ratios', b'ratios percentages denominator')
+
+        related = self.related()
+        self.assertEqual(related[3], [2, 1] if related[3][0] == 2 else [1, 2])
+        self.assertEqual(related.get(4, []), [])
+        self.assertIn(3, related[1])
+        self.assertIn(3, related[2])
+
+    def test_unchanged_words_are_not_worked_out_again(self):
+        with mock.patch.object(app.related, 'tf_idf') as tf_idf :
+            edit_worksheet(self.client, 1, 'Fractions')
+        self.assertEqual(tf_idf.call_count, 0)
+
+        with mock.patch.object(app.related, 'tf_idf', wraps=app.related.tf_idf) as tf_idf :
+            edit_worksheet(self.client, 1, 'Fractions and more')
+        self.assertEqual(tf_idf.call_count, 1)
+
+    def test_only_the_best_are_kept(self):
+        self.app.extensions['related_worksheets'].n = 1
+        add_worksheet(self.client, 'Fractions again', b'fractions decimals percentages numerator denominator')
+
+        related = self.related()
+        self.assertEqual(related[5], [1])
+        self.assertEqual(related[1], [5])
+        self.assertEqual(RelatedWorksheet.query.filter_by(worksheet_id=1).count(), 1)
+
+    def test_delete(self):
+        self.client.post('/delete_worksheet/2')
+
+        self.assertEqual(self.related(), {3 : [4], 4 : [3]})
+        self.assertEqual(WorksheetTerm.query.filter_by(worksheet_id=2).count(), 0)
+
+    def test_specific_worksheet_page(self):
+        response = self.client.get('/specific_worksheet/1')
+        self.assertIn(b'Related worksheets', response.data)
+        self.assertIn(b'/specific_worksheet/2', response.data)
+
+        self.assertEqual([worksheet.name for worksheet in related_to_worksheet(3, 5)], ['Polygons'])
+
+    def test_term_counts(self):
+        self.assertEqual(term_counts('Angles', 'the angles of a triangle'), {'angles' : 4, 'triangle' : 1})
+
+    def test_terms_keep_their_accents_on_mysql(self):
+        self.assertEqual(term_counts('R\u00e9sum\u00e9', 'resume'), {'r\u00e9sum\u00e9' : 3, 'resume' : 1})
+
+        ddl = str(CreateTable(WorksheetTerm.__table__).compile(dialect=mysql.dialect()))
+        self.assertIn('term VARCHAR(64) COLLATE utf8mb4_bin', ddl)
+
+    def test_scipy_matches_python(self):
+        if app.related.sparse == None :
+            self.skipTest('scipy is not installed')
+
+        counts = {id : term_counts(title, content.decode()) for id, (title, content) in enumerate(WORKSHEETS, 1)}
+        python_vectors, python_related = related_in_python(counts, 2)
+        vectors, related = related_with_scipy(counts, 2)
+
+        self.assertEqual([[id for id, score in best] for best in python_related.values()],
+            [[id for id, score in best] for best in related.values()])
+        for worksheet_id, vector in python_vectors.items() :
+            for term, weight in vector.items() :
+                self.assertAlmostEqual(vectors[worksheet_id][term], weight)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,245 @@
+import unittest
+import io
+import shutil
+from sqlalchemy.dialects import mysql
+from sqlalchemy.schema import CreateTable
+from flask_testing import TestCase
+from config import TestConfiguration
+from app import create_app as c_app
+from app.models import Worksheet, WorksheetCategory, Author, Post, PostCategory, SearchDocument, SearchPosting
+from app.database import db
+from app.search import search_index, extract_with_pypdf2
+
+def login_author(client, email, password):
+    return client.post('/author_login', data=dict(
+        email=email,
+        password=password
+    ), follow_redirects=True)
+
+def add_worksheet(client, title, content, category=1):
+    data = dict(title=title, video_url='youtube.com', category=category)
+    data['worksheet_pdf'] = (io.BytesIO(content), 'worksheet.pdf')
+    return client.post('/add_worksheet', follow_redirects=False, data=data, content_type='multipart/form-data')
+
+def edit_worksheet(client, id, title, content=None, category=1):
+    data = dict(title=title, video_url='youtube.com', category=category)
+    if not content == None :
+        data['worksheet_pdf'] = (io.BytesIO(content), 'worksheet.pdf')
+    return client.post('/edit_worksheet/%d' % id, follow_redirects=False, data=data, content_type='multipart/form-data')
+
+# the "pdfs" uploaded by the tests are plain text, the extractor just reads it
+extracted = []
+
+def read_text(pdf_path, max_chars):
+    extracted.append(pdf_path)
+    with open(pdf_path, 'rb') as f :
+        return f.read().decode()
+
+#
+# make_pdf
+#   A one page pdf showing the text, small enough to write by hand
+#
+def make_pdf(text):
+    stream = b'BT /F1 12 Tf 72 720 Td (' + text.encode() + b') Tj ET'
+    objects = [
+        b'<< /Type /Catalog /Pages 2 0 R >>',
+        b'<< /Type /Pages /Kids [3 0 R] /Count 1 >>',
+        b'<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] /Contents 4 0 R /Resources << /Font << /F1 5 0 R >> >> >>',
+        b'<< /Length ' + str(len(stream)).encode() + b' >>\nstream\n' + stream + b'\nendstream',
+        b'<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>',
+    ]
+
+    out = b'%PDF-1.4\n'
+    offsets = []
+    for number, body in enumerate(objects, 1) :
+        offsets.append(len(out))
+        out += str(number).encode() + b' 0 obj\n' + body + b'\nendobj\n'
+
+    xref = len(out)
+    out += b'xref\n0 ' + str(len(objects) + 1).encode() + b'\n0000000000 65535 f \n'
+    for offset in offsets :
+        out += b'%010d 00000 n \n' % offset
+    out += b'trailer\n<< /Size ' + str(len(objects) + 1).encode() + b' /Root 1 0 R >>\nstartxref\n' + str(xref).encode() + b'\n%%EOF\n'
+    return out
+
+
+class SearchConfiguration(TestConfiguration):
+    SEARCH_PDF_EXTRACTOR = read_text
+
+
+class InvertedSearchConfiguration(SearchConfiguration):
+    SEARCH_BACKEND = 'inverted'
+
+
+class SearchTests(TestCase):
+    def create_app(self):
+        app = c_app(SearchConfiguration)
+        return app
+
+    # executed prior to each test
+    def setUp(self):
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+
+        db.session.add(WorksheetCategory(name='algebra'))
+        db.session.add(WorksheetCategory(name='geometry'))
+        db.session.add(PostCategory(name='news'))
+        db.session.add(Author(name='Kidkaidf', email='kodyrogers21@gmail.com', password='pbkdf2:sha256:150000$73fMtgAp$1a1d8be4973cb2676c5f17275c43dc08583c8e450c94a282f9c443d34f72464c'))
+        db.session.commit()
+
+        login_author(self.client, email='kodyrogers21@gmail.com', password='RockOn')
+        del extracted[:]
+
+    # executed after each test
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+        shutil.rmtree('pdfs', ignore_errors=True)
+        shutil.rmtree('thumbs', ignore_errors=True)
+
+    def found(self, query, page=0, per_page=10):
+        return [(result.kind, result.item.name) for result in search_index.search(query, page, per_page).results]
+
+    def test_worksheet_found_by_name_author_category_and_pdf(self):
+        add_worksheet(self.client, 'Solving for x', b'quadratic equations and the discriminant')
+
+        self.assertEqual(self.found('solving'), [('worksheet', 'Solving for x')])
+        self.assertEqual(self.found('kidkaidf'), [('worksheet', 'Solving for x')])
+        self.assertEqual(self.found('algebra'), [('worksheet', 'Solving for x')])
+        self.assertEqual(self.found('Discriminant'), [('worksheet', 'Solving for x')])
+        self.assertEqual(self.found('calculus'), [])
+
+    def test_post_found_without_its_html(self):
+        post = Post(name='Welcome', content='<p class="intro">Fractions &amp; decimals</p>', category_id=1)
+        db.session.add(post)
+        db.session.commit()
+
+        self.assertEqual(self.found('decimals'), [('post', 'Welcome')])
+        self.assertEqual(self.found('news'), [('post', 'Welcome')])
+        self.assertEqual(self.found('intro'), [])
+
+    def test_edit_reads_the_pdf_only_when_it_changes(self):
+        add_worksheet(self.client, 'Angles', b'triangles and circles')
+        worksheet = Worksheet.query.filter_by(name='Angles').first()
+        self.assertEqual(len(extracted), 1)
+
+        edit_worksheet(self.client, worksheet.id, 'Polygons', category=2)
+        self.assertEqual(len(extracted), 1)
+        self.assertEqual(self.found('angles'), [])
+        self.assertEqual(self.found('polygons'), [('worksheet', 'Polygons')])
+        self.assertEqual(self.found('geometry'), [('worksheet', 'Polygons')])
+        self.assertEqual(self.found('algebra'), [])
+        self.assertEqual(self.found('triangles'), [('worksheet', 'Polygons')])
+
+        edit_worksheet(self.client, worksheet.id, 'Polygons', content=b'squares and hexagons', category=2)
+        self.assertEqual(len(extracted), 2)
+        self.assertEqual(self.found('triangles'), [])
+        self.assertEqual(self.found('hexagons'), [('worksheet', 'Polygons')])
+
+    def test_delete_removes_from_the_index(self):
+        add_worksheet(self.client, 'Angles', b'triangles and circles')
+        worksheet = Worksheet.query.filter_by(name='Angles').first()
+
+        self.client.post('/delete_worksheet/%d' % worksheet.id)
+
+        self.assertEqual(self.found('triangles'), [])
+        self.assertEqual(SearchDocument.query.count(), 0)
+        self.assertEqual(SearchPosting.query.count(), 0)
+
+    def test_renaming_category_or_author_reindexes(self):
+        add_worksheet(self.client, 'Angles', b'triangles and circles')
+        db.session.add(Post(name='Welcome', content='hello', category_id=1))
+        db.session.commit()
+
+        WorksheetCategory.query.get(1).name = 'trigonometry'
+        PostCategory.query.get(1).name = 'announcements'
+        Author.query.get(1).screenname = 'mrkody'
+        db.session.commit()
+
+        self.assertEqual(self.found('algebra'), [])
+        self.assertEqual(self.found('trigonometry'), [('worksheet', 'Angles')])
+        self.assertEqual(self.found('announcements'), [('post', 'Welcome')])
+        self.assertEqual(self.found('mrkody'), [('worksheet', 'Angles')])
+        self.assertEqual(len(extracted), 1)
+
+    def test_ranked_by_relevance(self):
+        add_worksheet(self.client, 'Fractions', b'adding and subtracting')
+        add_worksheet(self.client, 'Decimals', b'place value, rounding and how fractions become decimals')
+        add_worksheet(self.client, 'Percentages', b'ratios')
+
+        self.assertEqual(self.found('fractions'), [('worksheet', 'Fractions'), ('worksheet', 'Decimals')])
+        self.assertEqual(self.found('fractions rounding'), [('worksheet', 'Decimals'), ('worksheet', 'Fractions')])
+
+    def test_pages(self):
+        for i in range(12) :
+            db.session.add(Post(name='Post %d' % i, content='weekly update', category_id=1))
+        db.session.commit()
+
+        first = search_index.search('update', 0, 10)
+        second = search_index.search('update', 1, 10)
+        self.assertEqual(len(first.results), 10)
+        self.assertTrue(first.has_next)
+        self.assertEqual(len(second.results), 2)
+        self.assertFalse(second.has_next)
+
+        names = [result.item.name for result in first.results + second.results]
+        self.assertEqual(sorted(names), sorted('Post %d' % i for i in range(12)))
+
+    def test_search_page(self):
+        add_worksheet(self.client, 'Fractions', b'adding and subtracting')
+
+        response = self.client.get('/search?q=fractions')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b'Fractions', response.data)
+        self.assertIn(b'/specific_worksheet/1', response.data)
+
+        response = self.client.get('/search?q=calculus')
+        self.assertIn(b'Nothing matched', response.data)
+
+        self.assertEqual(self.client.get('/search').status_code, 200)
+
+    def test_rebuild(self):
+        db.session.execute(Post.__table__.insert().values(id=5, name='Seeded', content='loaded without the orm', category_id=1))
+        db.session.commit()
+        self.assertEqual(self.found('seeded'), [])
+
+        self.assertEqual(search_index.rebuild(), (0, 1))
+        self.assertEqual(self.found('seeded'), [('post', 'Seeded')])
+
+    def test_backend(self):
+        # the sqlite the tests use has FTS5
+        self.assertEqual(search_index.backend(), 'fts5')
+        add_worksheet(self.client, 'Fractions', b'adding and subtracting')
+        self.assertEqual(SearchPosting.query.count(), 0)
+
+    def test_extract_with_pypdf2(self):
+        with open('search_test.pdf', 'wb') as f :
+            f.write(make_pdf('quadratic equations'))
+
+        try :
+            self.assertEqual(extract_with_pypdf2('search_test.pdf', 1000).strip(), 'quadratic equations')
+        finally :
+            shutil.os.remove('search_test.pdf')
+
+    def test_content_fits_in_mysql(self):
+        # TEXT only holds 64KB there, less than SEARCH_PDF_MAX_CHARS
+        ddl = str(CreateTable(SearchDocument.__table__).compile(dialect=mysql.dialect()))
+        self.assertIn('content MEDIUMTEXT', ddl)
+
+
+class InvertedSearchTests(SearchTests):
+    def create_app(self):
+        app = c_app(InvertedSearchConfiguration)
+        return app
+
+    def test_backend(self):
+        self.assertEqual(search_index.backend(), 'inverted')
+        add_worksheet(self.client, 'Fractions', b'adding and subtracting')
+        self.assertTrue(SearchPosting.query.count() > 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,172 @@
+import unittest
+import shutil
+import tempfile
+import time
+from flask_testing import TestCase
+from config import TestConfiguration
+from app import create_app as c_app
+from app.models import Learner, StoredSession
+from app.database import db
+from app.sessions import stable_secret_key, hash_id, server_sessions
+from werkzeug.security import generate_password_hash
+
+def session_cookie(client):
+    for cookie in client.cookie_jar :
+        if cookie.name == 'session' :
+            return cookie.value
+    return None
+
+
+class ServerSessionTests(TestCase):
+    def create_app(self):
+        app = c_app(TestConfiguration)
+        return app
+
+    # executed prior to each test
+    def setUp(self):
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+
+        db.session.add(Learner(name='learner', email='learner@example.com', password=generate_password_hash('secret')))
+        db.session.commit()
+
+    # executed after each test
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def test_login_is_kept_in_the_database(self):
+        response = self.client.post('/learner_login', data=dict(email='learner@example.com', password='secret'))
+        self.assertEqual(response.status_code, 302)
+
+        stored = StoredSession.query.all()
+        self.assertEqual(len(stored), 1)
+
+        # the cookie only holds the signed id, the table only its hash
+        sid = session_cookie(self.client).rsplit('.', 1)[0]
+        self.assertEqual(stored[0].id, hash_id(sid))
+        self.assertNotIn('learner', session_cookie(self.client))
+
+        with self.client.session_transaction() as sess :
+            self.assertTrue(sess['learner_logged_in'])
+
+    def test_visitors_without_a_session_write_nothing(self):
+        response = self.client.get('/')
+        self.assertNotIn('Set-Cookie', response.headers)
+        self.assertEqual(StoredSession.query.count(), 0)
+
+    def test_another_worker_reads_the_session(self):
+        with self.client.session_transaction() as sess :
+            sess['learner_logged_in'] = True
+
+        # a second app with the same key and database, like another uWSGI worker
+        other = c_app(TestConfiguration).test_client()
+        other.set_cookie('localhost', 'session', session_cookie(self.client))
+        with other.session_transaction() as sess :
+            self.assertTrue(sess.get('learner_logged_in'))
+
+    def test_changes_made_by_another_worker_are_seen(self):
+        with self.client.session_transaction() as sess :
+            sess['learner_logged_in'] = False
+
+        other = c_app(TestConfiguration).test_client()
+        other.set_cookie('localhost', 'session', session_cookie(self.client))
+        with other.session_transaction() as sess :
+            self.assertFalse(sess.get('learner_logged_in'))
+
+        # logging in here has to show up there straight away
+        with self.client.session_transaction() as sess :
+            sess['learner_logged_in'] = True
+        with other.session_transaction() as sess :
+            self.assertTrue(sess.get('learner_logged_in'))
+
+    def test_cached_copy_is_used_while_its_version_matches(self):
+        with self.client.session_transaction() as sess :
+            sess['learner_logged_in'] = True
+
+        # the data in the table is not read again while the version is the same
+        StoredSession.query.update({StoredSession.data : '{}'})
+        db.session.commit()
+        with self.client.session_transaction() as sess :
+            self.assertTrue(sess.get('learner_logged_in'))
+
+        # saved by another worker, so the version went up
+        other = c_app(TestConfiguration).test_client()
+        other.set_cookie('localhost', 'session', session_cookie(self.client))
+        with other.session_transaction() as sess :
+            sess['learner_logged_in'] = False
+        self.assertEqual(StoredSession.query.one().version, 2)
+
+        with self.client.session_transaction() as sess :
+            self.assertFalse(sess.get('learner_logged_in'))
+
+    def test_logging_in_and_out_changes_the_id(self):
+        # a failed login leaves a session behind to flash its message
+        self.client.post('/learner_login', data=dict(email='learner@example.com', password='wrong'))
+        before = session_cookie(self.client)
+        self.assertNotEqual(before, None)
+
+        self.client.post('/learner_login', data=dict(email='learner@example.com', password='secret'))
+        logged_in = session_cookie(self.client)
+        self.assertNotEqual(logged_in, before)
+
+        # the old id is gone so it cannot be used to get the login
+        other = c_app(TestConfiguration).test_client()
+        other.set_cookie('localhost', 'session', before)
+        with other.session_transaction() as sess :
+            self.assertFalse(sess.get('learner_logged_in'))
+        with self.client.session_transaction() as sess :
+            self.assertTrue(sess['learner_logged_in'])
+
+        self.client.get('/learner_logout')
+        self.assertNotEqual(session_cookie(self.client), logged_in)
+        self.assertEqual(StoredSession.query.filter_by(id=hash_id(logged_in.rsplit('.', 1)[0])).count(), 0)
+
+    def test_tampered_cookie_gets_a_new_session(self):
+        with self.client.session_transaction() as sess :
+            sess['learner_logged_in'] = True
+
+        self.client.set_cookie('localhost', 'session', session_cookie(self.client)[:-2] + 'xx')
+        with self.client.session_transaction() as sess :
+            self.assertNotIn('learner_logged_in', sess)
+
+    def test_clearing_the_session_removes_it(self):
+        with self.client.session_transaction() as sess :
+            sess['learner_logged_in'] = True
+        self.assertEqual(StoredSession.query.count(), 1)
+
+        with self.client.session_transaction() as sess :
+            sess.clear()
+        self.assertEqual(StoredSession.query.count(), 0)
+
+    def test_expired_sessions_are_ignored_and_swept(self):
+        with self.client.session_transaction() as sess :
+            sess['learner_logged_in'] = True
+
+        StoredSession.query.update({StoredSession.expires_at : time.time() - 1})
+        db.session.commit()
+
+        with self.client.session_transaction() as sess :
+            self.assertNotIn('learner_logged_in', sess)
+
+        self.assertEqual(server_sessions.sweep(), 1)
+        self.assertEqual(StoredSession.query.count(), 0)
+
+
+class SecretKeyTests(unittest.TestCase):
+    def setUp(self):
+        self.instance = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.instance)
+
+    def test_key_is_made_once(self):
+        key = stable_secret_key(self.instance)
+        self.assertTrue(len(key) >= 32)
+        self.assertEqual(stable_secret_key(self.instance), key)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -16,6 +16,9 @@ sudo apt install mysql-server
 
 sudo apt install wkhtmltopdf
 
+# pdftoppm draws the worksheet thumbnails
+sudo apt install poppler-utils
+
 python3 -m venv venv
 
 source venv/bin/activate
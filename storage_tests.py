@@ -0,0 +1,168 @@
+import unittest
+import hashlib
+import io
+import os
+import shutil
+from flask_testing import TestCase
+from config import TestConfiguration
+from app import create_app as c_app
+from app.models import Worksheet, WorksheetCategory, Author, StoredFile
+from app.database import db
+from app.storage import pdf_store
+
+def login_author(client, email, password):
+    return client.post('/author_login', data=dict(
+        email=email,
+        password=password
+    ), follow_redirects=True)
+
+def add_worksheet(client, title, content, filename='worksheet.pdf'):
+    data = dict(title=title, video_url='youtube.com', category=1)
+    data['worksheet_pdf'] = (io.BytesIO(content), filename)
+    return client.post('/add_worksheet', follow_redirects=False, data=data, content_type='multipart/form-data')
+
+
+class PdfStoreTests(TestCase):
+    def create_app(self):
+        app = c_app(TestConfiguration)
+        return app
+
+    # executed prior to each test
+    def setUp(self):
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+
+        db.session.add(WorksheetCategory(name='dundk'))
+        db.session.add(Author(name='Kidkaidf', email='kodyrogers21@gmail.com', password='pbkdf2:sha256:150000$73fMtgAp$1a1d8be4973cb2676c5f17275c43dc08583c8e450c94a282f9c443d34f72464c'))
+        db.session.commit()
+
+        login_author(self.client, email='kodyrogers21@gmail.com', password='RockOn')
+
+    # executed after each test
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+        shutil.rmtree('pdfs', ignore_errors=True)
+        shutil.rmtree('thumbs', ignore_errors=True)
+
+    def refs(self, content):
+        stored = StoredFile.query.get(hashlib.sha256(content).hexdigest())
+        if stored == None :
+            return 0
+        return stored.refs
+
+    def test_upload_is_stored_under_hash(self):
+        content = b'%PDF-1.4 ' + os.urandom(200 * 1024)
+        sha256 = hashlib.sha256(content).hexdigest()
+
+        self.assertEqual(add_worksheet(self.client, 'trig', content).status_code, 302)
+
+        worksheet = Worksheet.query.filter_by(name='trig').first()
+        self.assertEqual(worksheet.sha256, sha256)
+        self.assertEqual(worksheet.size, len(content))
+        self.assertEqual(worksheet.pdf_url, 'pdfs/' + sha256[:2] + '/' + sha256[2:4] + '/' + sha256 + '.pdf')
+
+        with open(worksheet.pdf_url, 'rb') as f :
+            self.assertEqual(f.read(), content)
+
+        # nothing is left behind from streaming the upload
+        self.assertEqual([name for name in os.listdir('pdfs') if name.endswith('.part')], [])
+
+    def test_same_name_different_files(self):
+        add_worksheet(self.client, 'trig', b'%PDF-1.4 trig', filename='worksheet.pdf')
+        add_worksheet(self.client, 'calc', b'%PDF-1.4 calc', filename='worksheet.pdf')
+
+        trig = Worksheet.query.filter_by(name='trig').first()
+        calc = Worksheet.query.filter_by(name='calc').first()
+        self.assertNotEqual(trig.pdf_url, calc.pdf_url)
+
+        with open(trig.pdf_url, 'rb') as f :
+            self.assertEqual(f.read(), b'%PDF-1.4 trig')
+        with open(calc.pdf_url, 'rb') as f :
+            self.assertEqual(f.read(), b'%PDF-1.4 calc')
+
+    def test_duplicates_share_one_file(self):
+        content = b'%PDF-1.4 the same worksheet'
+        add_worksheet(self.client, 'trig', content, filename='a.pdf')
+        add_worksheet(self.client, 'trig again', content, filename='b.pdf')
+
+        trig = Worksheet.query.filter_by(name='trig').first()
+        again = Worksheet.query.filter_by(name='trig again').first()
+        self.assertEqual(trig.pdf_url, again.pdf_url)
+        self.assertEqual(self.refs(content), 2)
+
+        # the first delete keeps the file for the other worksheet
+        self.client.get('/delete_worksheet/' + str(trig.id))
+        self.assertEqual(self.refs(content), 1)
+        self.assertTrue(os.path.exists(again.pdf_url))
+
+        self.client.get('/delete_worksheet/' + str(again.id))
+        self.assertEqual(self.refs(content), 0)
+        self.assertFalse(os.path.exists(again.pdf_url))
+
+    def test_edit_releases_old_file(self):
+        add_worksheet(self.client, 'trig', b'%PDF-1.4 old')
+        add_worksheet(self.client, 'calc', b'%PDF-1.4 shared')
+        worksheet = Worksheet.query.filter_by(name='trig').first()
+        old = worksheet.pdf_url
+
+        data = dict(title='trig', video_url='youtube.com', category=1)
+        data['worksheet_pdf'] = (io.BytesIO(b'%PDF-1.4 shared'), 'new.pdf')
+        self.client.post('/edit_worksheet/' + str(worksheet.id), data=data, content_type='multipart/form-data')
+
+        db.session.expire_all()
+        worksheet = Worksheet.query.filter_by(name='trig').first()
+        self.assertEqual(worksheet.pdf_url, Worksheet.query.filter_by(name='calc').first().pdf_url)
+        self.assertEqual(self.refs(b'%PDF-1.4 shared'), 2)
+        self.assertEqual(self.refs(b'%PDF-1.4 old'), 0)
+        self.assertFalse(os.path.exists(old))
+
+        # uploading the same file again changes nothing
+        data['worksheet_pdf'] = (io.BytesIO(b'%PDF-1.4 shared'), 'new.pdf')
+        self.client.post('/edit_worksheet/' + str(worksheet.id), data=data, content_type='multipart/form-data')
+        self.assertEqual(self.refs(b'%PDF-1.4 shared'), 2)
+        self.assertTrue(os.path.exists(worksheet.pdf_url))
+
+    def test_rollback_removes_new_file(self):
+        stored = pdf_store.save(io.BytesIO(b'%PDF-1.4 never used'))
+        self.assertTrue(os.path.exists(stored.pdf_url))
+
+        db.session.rollback()
+
+        self.assertFalse(os.path.exists(stored.pdf_url))
+        self.assertEqual(self.refs(b'%PDF-1.4 never used'), 0)
+
+    def test_old_uploads_are_removed(self):
+        with open('old_upload.pdf', 'wb') as f :
+            f.write(b'%PDF-1.4 from before the store')
+
+        worksheet = Worksheet(pdf_url='old_upload.pdf', name='old', author_id=1, category_id=1)
+        db.session.add(worksheet)
+        db.session.commit()
+
+        self.client.get('/delete_worksheet/' + str(worksheet.id))
+
+        self.assertEqual(Worksheet.query.filter_by(name='old').first(), None)
+        self.assertFalse(os.path.exists('old_upload.pdf'))
+
+    def test_shared_old_uploads_are_kept(self):
+        with open('old_upload.pdf', 'wb') as f :
+            f.write(b'%PDF-1.4 uploaded twice under one name')
+
+        first = Worksheet(pdf_url='old_upload.pdf', name='first', author_id=1, category_id=1)
+        second = Worksheet(pdf_url='old_upload.pdf', name='second', author_id=1, category_id=1)
+        db.session.add_all([first, second])
+        db.session.commit()
+
+        self.client.get('/delete_worksheet/' + str(first.id))
+        self.assertTrue(os.path.exists('old_upload.pdf'))
+
+        self.client.get('/delete_worksheet/' + str(second.id))
+        self.assertFalse(os.path.exists('old_upload.pdf'))
+
+
+if __name__ == "__main__":
+    unittest.main()
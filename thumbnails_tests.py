@@ -0,0 +1,165 @@
+import unittest
+import io
+import os
+import shutil
+from flask_testing import TestCase
+from config import TestConfiguration
+from app import create_app as c_app
+from app.models import Worksheet, WorksheetCategory, Author
+from app.database import db
+from app.worksheets.commands import backfill_thumbnails
+from app.thumbnails import render_with_pdftoppm
+
+# the smallest png there is, the fake renderer writes it for every pdf
+PNG = (b'\x89PNG\r\n\x1a\n\x00\x00\x00\rIHDR\x00\x00\x00\x01\x00\x00\x00\x01\x08\x06\x00\x00\x00\x1f\x15\xc4\x89'
+    b'\x00\x00\x00\rIDATx\x9cc\xf8\x0f\x00\x00\x01\x01\x00\x05\x18\xd8N\x00\x00\x00\x00IEND\xaeB`\x82')
+
+# a one page pdf with nothing on it
+PDF = (b'%PDF-1.1\n1 0 obj<</Type/Catalog/Pages 2 0 R>>endobj\n'
+    b'2 0 obj<</Type/Pages/Kids[3 0 R]/Count 1>>endobj\n'
+    b'3 0 obj<</Type/Page/Parent 2 0 R/MediaBox[0 0 612 792]>>endobj\n'
+    b'trailer<</Root 1 0 R>>\n%%EOF\n')
+
+def fake_renderer(pdf_path, png_path, width):
+    with open(pdf_path, 'rb') as f :
+        if b'broken' in f.read() :
+            raise ValueError('not a pdf')
+
+    with open(png_path, 'wb') as f :
+        f.write(PNG)
+
+def login_author(client, email, password):
+    return client.post('/author_login', data=dict(
+        email=email,
+        password=password
+    ), follow_redirects=True)
+
+def add_worksheet(client, title, content):
+    data = dict(title=title, video_url='youtube.com', category=1)
+    data['worksheet_pdf'] = (io.BytesIO(content), 'worksheet.pdf')
+    return client.post('/add_worksheet', follow_redirects=False, data=data, content_type='multipart/form-data')
+
+
+class ThumbnailConfiguration(TestConfiguration):
+    THUMBNAIL_RENDERER = fake_renderer
+
+
+class ThumbnailTests(TestCase):
+    def create_app(self):
+        app = c_app(ThumbnailConfiguration)
+        return app
+
+    # executed prior to each test
+    def setUp(self):
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+
+        db.session.add(WorksheetCategory(name='dundk'))
+        db.session.add(Author(name='Kidkaidf', email='kodyrogers21@gmail.com', password='pbkdf2:sha256:150000$73fMtgAp$1a1d8be4973cb2676c5f17275c43dc08583c8e450c94a282f9c443d34f72464c'))
+        db.session.commit()
+
+    # executed after each test
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+        shutil.rmtree('pdfs', ignore_errors=True)
+        shutil.rmtree('thumbs', ignore_errors=True)
+
+    def test_thumbnail_drawn_on_upload(self):
+        login_author(self.client, email='kodyrogers21@gmail.com', password='RockOn')
+        add_worksheet(self.client, 'trig', b'%PDF-1.4 trig')
+
+        worksheet = Worksheet.query.filter_by(name='trig').first()
+        self.assertEqual(worksheet.thumbnail, 'thumbs/' + worksheet.sha256[:2] + '/' + worksheet.sha256[2:4] + '/' + worksheet.sha256 + '.png')
+        self.assertTrue(os.path.exists(worksheet.thumbnail))
+
+        response = self.client.get('/worksheet_thumbnail/' + str(worksheet.id) + '?v=' + worksheet.sha256)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.mimetype, 'image/png')
+        self.assertEqual(response.data, PNG)
+        self.assertIn('immutable', response.headers['Cache-Control'])
+        response.close()
+
+        # the listing pages show the picture instead of the pdf
+        for url in ['/worksheets_page', '/home'] :
+            r = self.client.get(url)
+            self.assertIn(b'/worksheet_thumbnail/' + str(worksheet.id).encode(), r.data)
+            self.assertNotIn(b'<iframe', r.data)
+
+    def test_broken_pdf_still_uploads(self):
+        login_author(self.client, email='kodyrogers21@gmail.com', password='RockOn')
+        add_worksheet(self.client, 'trig', b'%PDF-1.4 broken')
+
+        worksheet = Worksheet.query.filter_by(name='trig').first()
+        self.assertNotEqual(worksheet, None)
+        self.assertEqual(worksheet.thumbnail, None)
+        self.assertEqual([name for name in os.listdir('thumbs/' + worksheet.sha256[:2] + '/' + worksheet.sha256[2:4])], [])
+
+        self.assertIn(b'fa-file-pdf-o', self.client.get('/worksheets_page').data)
+        self.assertIn(b'that page does not exist', self.client.get('/worksheet_thumbnail/' + str(worksheet.id)).data)
+
+    def test_thumbnail_removed_with_pdf(self):
+        login_author(self.client, email='kodyrogers21@gmail.com', password='RockOn')
+        add_worksheet(self.client, 'trig', b'%PDF-1.4 trig')
+        worksheet = Worksheet.query.filter_by(name='trig').first()
+        thumbnail = worksheet.thumbnail
+
+        self.client.get('/delete_worksheet/' + str(worksheet.id))
+
+        self.assertFalse(os.path.exists(thumbnail))
+
+    def test_backfill(self):
+        with open('old_upload.pdf', 'wb') as f :
+            f.write(b'%PDF-1.4 from before thumbnails')
+
+        db.session.add(Worksheet(pdf_url='old_upload.pdf', name='old', author_id=1, category_id=1))
+        db.session.add(Worksheet(pdf_url='gone.pdf', name='gone', author_id=1, category_id=1))
+        db.session.commit()
+
+        result = self.app.test_cli_runner().invoke(args=['worksheets', 'backfill-thumbnails'])
+        self.assertIn('Drew 1 thumbnails, 1 worksheets could not be drawn', result.output)
+
+        worksheet = Worksheet.query.filter_by(name='old').first()
+        self.assertNotEqual(worksheet.sha256, None)
+        self.assertTrue(os.path.exists(worksheet.pdf_url))
+        self.assertTrue(os.path.exists(worksheet.thumbnail))
+        self.assertFalse(os.path.exists('old_upload.pdf'))
+
+        # nothing left to do the second time
+        self.assertEqual(backfill_thumbnails(), (0, 1))
+
+    def test_backfill_shared_upload(self):
+        with open('worksheet.pdf', 'wb') as f :
+            f.write(b'%PDF-1.4 uploaded twice under one name')
+
+        db.session.add(Worksheet(pdf_url='worksheet.pdf', name='first', author_id=1, category_id=1))
+        db.session.add(Worksheet(pdf_url='worksheet.pdf', name='second', author_id=1, category_id=1))
+        db.session.commit()
+
+        self.assertEqual(backfill_thumbnails(), (2, 0))
+
+        first, second = Worksheet.query.order_by(Worksheet.id).all()
+        self.assertEqual(first.pdf_url, second.pdf_url)
+        self.assertTrue(os.path.exists(first.pdf_url))
+        self.assertFalse(os.path.exists('worksheet.pdf'))
+
+    @unittest.skipUnless(shutil.which('pdftoppm'), 'pdftoppm is not installed')
+    def test_pdftoppm(self):
+        with open('pdftoppm_test.pdf', 'wb') as f :
+            f.write(PDF)
+
+        try :
+            render_with_pdftoppm('pdftoppm_test.pdf', 'pdftoppm_test.png', 40)
+            with open('pdftoppm_test.png', 'rb') as f :
+                self.assertEqual(f.read(8), PNG[:8])
+        finally :
+            os.remove('pdftoppm_test.pdf')
+            if os.path.exists('pdftoppm_test.png') :
+                os.remove('pdftoppm_test.png')
+
+
+if __name__ == "__main__":
+    unittest.main()
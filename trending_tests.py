@@ -0,0 +1,221 @@
+import importlib
+import unittest
+import time
+from unittest import mock
+from flask_testing import TestCase
+from config import TestConfiguration
+from app import create_app as c_app
+from app.models import Learner, Worksheet, WorksheetCategory, WorksheetEvent, Author, Version
+from app.database import db
+from app.counters import download_counter
+from app.trending import trending, scores_in_python, scores_with_numpy, EPOCH
+from werkzeug.security import generate_password_hash
+
+# app/__init__.py puts the extension where the module's name would be
+trending_module = importlib.import_module('app.trending')
+
+DAY = 86400
+
+
+class TrendingConfiguration(TestConfiguration):
+    TRENDING_HALF_LIFE = DAY
+    TRENDING_WEIGHTS = {'view' : 1.0, 'favourite' : 4.0}
+
+
+class TrendingTests(TestCase):
+    def create_app(self):
+        app = c_app(TrendingConfiguration)
+        return app
+
+    # executed prior to each test
+    def setUp(self):
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+
+        author = Author(name='author', email='author@example.com', password='x')
+        category = WorksheetCategory(name='algebra')
+        for i in range(5) :
+            db.session.add(Worksheet(name='worksheet %d' % i, pdf_url='%d.pdf' % i, author=author, category=category))
+        db.session.add(Learner(name='learner', email='learner@example.com', password=generate_password_hash('secret')))
+        db.session.commit()
+
+    # executed after each test
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def state(self):
+        return self.app.extensions['trending']
+
+    def scores(self):
+        db.session.expire_all()
+        return {worksheet.id : worksheet.trending_score for worksheet in Worksheet.query.all()}
+
+    def names(self, response):
+        return [name for name in ('worksheet %d' % i for i in range(5)) if name.encode() in response.data]
+
+    def order(self, response):
+        return sorted(self.names(response), key=lambda name: response.data.index(name.encode()))
+
+    def test_views_are_recorded_with_their_counts(self):
+        self.client.get('/worksheets_count/2')
+        self.client.get('/worksheets_count/2')
+        self.client.get('/worksheets_count/3')
+
+        events = WorksheetEvent.query.order_by(WorksheetEvent.id).all()
+        self.assertEqual([(event.worksheet_id, event.kind, event.count) for event in events],
+            [(2, 'view', 1), (2, 'view', 1), (3, 'view', 1)])
+
+        scores = self.scores()
+        self.assertTrue(scores[2] > scores[3] > 0)
+        self.assertEqual(scores[1], 0)
+
+    def test_one_row_for_each_worksheet_in_a_batch(self):
+        state = self.app.extensions['download_counter']
+        with mock.patch.object(state, 'interval', 60), mock.patch.object(state, 'start') :
+            for i in range(3) :
+                download_counter.increment(1)
+            download_counter.increment(2)
+            self.assertEqual(download_counter.flush(), 4)
+
+        events = WorksheetEvent.query.order_by(WorksheetEvent.worksheet_id).all()
+        self.assertEqual([(event.worksheet_id, event.count) for event in events], [(1, 3), (2, 1)])
+
+    def test_favourites_are_recorded(self):
+        self.client.post('/learner_login', data=dict(email='learner@example.com', password='secret'))
+        self.client.get('/add_favourite/1/4')
+
+        event = WorksheetEvent.query.one()
+        self.assertEqual((event.worksheet_id, event.kind, event.count), (4, 'favourite', 1))
+        self.assertAlmostEqual(self.scores()[4], 4.0 * trending_module.scale(event.created_at, self.state().epoch, DAY))
+
+    def test_newer_events_count_for_more(self):
+        now = time.time()
+        with db.engine.begin() as connection :
+            self.state().record(connection, {1 : 4}, 'view', now - 2 * DAY)
+            self.state().record(connection, {2 : 1}, 'view', now)
+            self.state().record(connection, {3 : 1}, 'favourite', now - DAY)
+
+        scores = self.scores()
+        # four views two half lives ago are worth one view now, a favourite a
+        # half life ago two
+        self.assertAlmostEqual(scores[1] / scores[2], 1.0)
+        self.assertAlmostEqual(scores[3] / scores[2], 2.0)
+
+    def test_recompute_moves_the_epoch_and_keeps_the_order(self):
+        start = 1000 * DAY
+        with db.engine.begin() as connection :
+            self.state().record(connection, {1 : 1}, 'view', start)
+            self.state().record(connection, {2 : 3}, 'view', start + DAY)
+            self.state().record(connection, {3 : 1}, 'favourite', start + 2 * DAY)
+
+        before = self.scores()
+        self.assertEqual(trending.recompute(start + 2 * DAY), 3)
+        after = self.scores()
+
+        self.assertEqual(db.session.query(Version.version).filter_by(name=EPOCH).scalar(), (start + 2 * DAY) // 3600)
+        # every score is measured from the new epoch, a view right now is 1
+        self.assertAlmostEqual(after[1], 0.25)
+        self.assertAlmostEqual(after[2], 1.5)
+        self.assertAlmostEqual(after[3], 4.0)
+        self.assertEqual(sorted(before, key=before.get), sorted(after, key=after.get))
+
+    def test_recompute_removes_old_events(self):
+        now = 1000 * DAY
+        with db.engine.begin() as connection :
+            self.state().record(connection, {1 : 1}, 'view', now - 11 * DAY)
+            self.state().record(connection, {2 : 1}, 'view', now - DAY)
+
+        self.assertEqual(trending.recompute(now), 1)
+        self.assertEqual([event.worksheet_id for event in WorksheetEvent.query.all()], [2])
+
+        scores = self.scores()
+        self.assertEqual(scores[1], 0)
+        self.assertAlmostEqual(scores[2], 0.5)
+
+    def test_record_follows_a_moved_epoch(self):
+        now = 1000 * DAY
+        with db.engine.begin() as connection :
+            self.state().record(connection, {1 : 1}, 'view', now)
+
+        # another worker moves the epoch on its own connection just after this
+        # one has read it
+        read_epoch = trending_module.read_epoch
+        def read_then_recompute(connection, now, lock=False):
+            epoch = read_epoch(connection, now, lock)
+            if not lock :
+                trending.recompute(now)
+            return epoch
+
+        with mock.patch.object(trending_module, 'read_epoch', side_effect=read_then_recompute) :
+            with db.engine.begin() as connection :
+                self.state().record(connection, {2 : 1}, 'view', now + 2 * DAY)
+
+        self.assertEqual(self.state().epoch, now // 3600 + 48)
+        scores = self.scores()
+        self.assertAlmostEqual(scores[1], 0.25)
+        self.assertAlmostEqual(scores[2], 1.0)
+
+    def test_recompute_when_due(self):
+        self.client.get('/worksheets_count/1')
+        epoch = self.state().epoch
+
+        with mock.patch.object(self.state(), 'recompute') as recompute :
+            self.state().recompute_if_due(trending_module.epoch_seconds(epoch) + 60)
+            self.assertEqual(recompute.call_count, 0)
+            self.state().recompute_if_due(trending_module.epoch_seconds(epoch) + DAY)
+            self.assertEqual(recompute.call_count, 1)
+
+    def test_sort_by_trending(self):
+        now = time.time()
+        with db.engine.begin() as connection :
+            self.state().record(connection, {1 : 10}, 'view', now - 5 * DAY)
+            self.state().record(connection, {4 : 1}, 'favourite', now)
+            self.state().record(connection, {2 : 2}, 'view', now)
+
+        response = self.client.get('/worksheets_page?sort=trending')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.order(response)[:3], ['worksheet 3', 'worksheet 1', 'worksheet 0'])
+
+        # newest is still the default
+        response = self.client.get('/worksheets_page')
+        self.assertEqual(self.order(response), ['worksheet 4', 'worksheet 3', 'worksheet 2', 'worksheet 1', 'worksheet 0'])
+
+    def test_sort_by_popular_pages_with_a_cursor(self):
+        for i in range(12) :
+            db.session.add(Worksheet(name='extra %d' % i, pdf_url='e%d.pdf' % i, author_id=1, category_id=1))
+        db.session.commit()
+        for id, count in [(1, 5), (2, 7), (3, 5)] :
+            Worksheet.query.get(id).count = count
+        db.session.commit()
+
+        response = self.client.get('/worksheets_page?sort=popular')
+        self.assertEqual(self.order(response)[:3], ['worksheet 1', 'worksheet 2', 'worksheet 0'])
+        self.assertIn(b'More Worksheets', response.data)
+        self.assertIn(b'sort=popular', response.data)
+
+        response = self.client.get('/worksheets_page?sort=popular&after=0,8')
+        self.assertEqual(self.order(response), ['worksheet 4', 'worksheet 3'])
+        self.assertNotIn(b'More Worksheets', response.data)
+
+        self.assertEqual(self.client.get('/worksheets_page?sort=popular&after=nonsense').status_code, 400)
+
+    def test_scores_with_and_without_numpy(self):
+        if trending_module.numpy == None :
+            self.skipTest('numpy is not installed')
+
+        ids = [1, 2, 1, 3, 2]
+        weights = [1, 5, 2, 1, 1]
+        times = [0, 3600, 7200, 86400, 172800]
+        python = scores_in_python(ids, weights, times, 0, DAY)
+        vectorised = scores_with_numpy(ids, weights, times, 0, DAY)
+
+        self.assertEqual(sorted(python), sorted(vectorised))
+        for worksheet_id in python :
+            self.assertAlmostEqual(python[worksheet_id], vectorised[worksheet_id])
+
+
+if __name__ == '__main__':
+    unittest.main()
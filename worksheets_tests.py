@@ -9,8 +9,14 @@ from app.database import db
 from contextlib import contextmanager
 import pdfkit
 import io
+from sqlalchemy import event
 
 from app.worksheets.forms import category_choices
+from app.counters import download_counter
+import threading
+import hashlib
+import shutil
+import time
 
 def login(client, username, password):
     return client.post('/login', data=dict(
@@ -43,6 +49,11 @@ def login_learner(client, email, password):
 def logout_learner(client):
     return client.get('/learner_logout', follow_redirects=True)
 
+# where the pdf store (app/storage.py) keeps a file with these contents
+def stored_pdf(content):
+    sha256 = hashlib.sha256(content).hexdigest()
+    return 'pdfs/' + sha256[:2] + '/' + sha256[2:4] + '/' + sha256 + '.pdf'
+
 @contextmanager
 def captured_templates(app):
     recorded = []
@@ -54,6 +65,17 @@ def captured_templates(app):
     finally:
         template_rendered.disconnect(record, app)
 
+@contextmanager
+def captured_statements():
+    statements = []
+    def record(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+    event.listen(db.engine, 'before_cursor_execute', record)
+    try:
+        yield statements
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', record)
+
 
 class BasicTests(TestCase):
 
@@ -159,7 +181,7 @@ class DatabaseTests(TestCase):
         
         choice_factory = category_choices()
         
-        self.assertEqual(choice_factory.all(), WorksheetCategory.query.all())
+        self.assertEqual(choice_factory, WorksheetCategory.query.all())
         
     def test_worksheet_page(self) :
         # worksheet page
@@ -307,7 +329,7 @@ class DatabaseTests(TestCase):
                 self.assertEqual(context['worksheets'], [])
                 self.assertEqual(context['categories'], [w_cat, w_cat_1, w_cat_2])
                 self.assertEqual(context['next_url'], None)
-                self.assertEqual(context['prev_url'], url_for('worksheets.worksheets_page', author=None, worksheet=None, category=None, page=1))
+                self.assertEqual(context['prev_url'], url_for('worksheets.worksheets_page', author=None, worksheet=None, category=None, page=0))
 
         with self.app.test_client() as c:
             with captured_templates(self.app) as templates:
@@ -315,7 +337,7 @@ class DatabaseTests(TestCase):
                 template, context = templates[0]
                 self.assertEqual(context['worksheets'], [worksheet_12, worksheet_11, worksheet_10, worksheet_9, worksheet_8, worksheet_7, worksheet_6, worksheet_5, worksheet_4])
                 self.assertEqual(context['categories'], [w_cat, w_cat_1, w_cat_2])
-                self.assertEqual(context['next_url'], url_for('worksheets.worksheets_page', author=None, category=None, page=1))
+                self.assertEqual(context['next_url'], url_for('worksheets.worksheets_page', author=None, category=None, after=worksheet_4.id))
                 self.assertEqual(context['prev_url'], None)
 
         #
@@ -355,7 +377,7 @@ class DatabaseTests(TestCase):
                 template, context = templates[0]
                 self.assertEqual(context['worksheets'], [worksheet_26, worksheet_25, worksheet_24, worksheet_23, worksheet_22, worksheet_21, worksheet_20, worksheet_19, worksheet_18])
                 self.assertEqual(context['categories'], [w_cat, w_cat_1, w_cat_2])
-                self.assertEqual(context['next_url'],  url_for('worksheets.worksheets_page', author=None, category=None, page=1))
+                self.assertEqual(context['next_url'],  url_for('worksheets.worksheets_page', author=None, category=None, after=worksheet_18.id))
                 self.assertEqual(context['prev_url'], None)
 
         with self.app.test_client() as c:
@@ -364,7 +386,7 @@ class DatabaseTests(TestCase):
                 template, context = templates[0]
                 self.assertEqual(context['worksheets'], [worksheet_17, worksheet_16, worksheet_15, worksheet_14, worksheet_13, worksheet_12, worksheet_11, worksheet_10, worksheet_9])
                 self.assertEqual(context['categories'], [w_cat, w_cat_1, w_cat_2])
-                self.assertEqual(context['next_url'], url_for('worksheets.worksheets_page', author=None, worksheet=None, category=None, page=2))
+                self.assertEqual(context['next_url'], url_for('worksheets.worksheets_page', author=None, worksheet=None, category=None, after=worksheet_9.id))
                 self.assertEqual(context['prev_url'], url_for('worksheets.worksheets_page', author=None, worksheet=None, category=None, page=0))
 
         with self.app.test_client() as c:
@@ -374,7 +396,7 @@ class DatabaseTests(TestCase):
                 self.assertEqual(context['worksheets'], [worksheet_8, worksheet_7, worksheet_6, worksheet_5, worksheet_4, worksheet_3, worksheet_2, worksheet_1, worksheet])
                 self.assertEqual(context['categories'], [w_cat, w_cat_1, w_cat_2])
                 self.assertEqual(context['next_url'], None)
-                self.assertEqual(context['prev_url'], url_for('worksheets.worksheets_page', author=None, worksheet=None, category=None, page=1))
+                self.assertEqual(context['prev_url'], url_for('worksheets.worksheets_page', author=None, worksheet=None, category=None, before=worksheet_8.id))
 
         # testing the specific worksheet page
         res = self.client.get('/specific_worksheet/1', follow_redirects=True)
@@ -414,7 +436,7 @@ class DatabaseTests(TestCase):
 
                 r = c.get('/worksheets_page', follow_redirects=False)
                 template, context = templates[1]
-                self.assertEqual(context['favourites'], [])
+                self.assertEqual(context['favourites'], set())
                 self.assertEqual(context['worksheets'], [worksheet])
                 self.assertEqual(context['categories'], [w_cat])
                 self.assertEqual(context['next_url'], None)
@@ -480,7 +502,7 @@ class DatabaseTests(TestCase):
                 r = c.get(url_for('worksheets.worksheets_page', author=2, category=None, page=0))
                 template, context = templates[1]
                 self.assertEqual(context['worksheets'], [worksheet_12, worksheet_10, worksheet_8, worksheet_6,  worksheet_4, worksheet_2])
-                self.assertEqual(context['favourites'], [worksheet, worksheet_1, worksheet_3, worksheet_2])
+                self.assertEqual(context['favourites'], {worksheet_2.id})
                 self.assertEqual(context['categories'], [w_cat, w_cat_1, w_cat_2])
                 self.assertEqual(context['next_url'], None)
                 self.assertEqual(context['prev_url'], None)
@@ -496,7 +518,7 @@ class DatabaseTests(TestCase):
                 template, context = templates[1]
                 self.assertEqual(context['worksheets'], [worksheet_12, worksheet_10, worksheet_8, worksheet_6,  worksheet_4, worksheet_2])
                 self.assertEqual(context['categories'], [w_cat, w_cat_1, w_cat_2])
-                self.assertEqual(context['favourites'], [worksheet, worksheet_1, worksheet_3, worksheet_2])
+                self.assertEqual(context['favourites'], {worksheet_2.id})
                 self.assertEqual(context['next_url'], None)
                 self.assertEqual(context['prev_url'], None)
                 logout_learner(c)
@@ -512,7 +534,7 @@ class DatabaseTests(TestCase):
                 template, context = templates[1]
                 self.assertEqual(context['worksheets'], [])
                 self.assertEqual(context['categories'], [w_cat, w_cat_1, w_cat_2])
-                self.assertEqual(context['favourites'], [worksheet, worksheet_1, worksheet_3, worksheet_2])
+                self.assertEqual(context['favourites'], set())
                 self.assertEqual(context['next_url'], None)
                 self.assertEqual(context['prev_url'], url_for('worksheets.worksheets_page', author=2, category=None, page=0))
                 logout_learner(c)
@@ -528,7 +550,7 @@ class DatabaseTests(TestCase):
                 template, context = templates[1]
                 self.assertEqual(context['worksheets'], [])
                 self.assertEqual(context['categories'], [w_cat, w_cat_1, w_cat_2])
-                self.assertEqual(context['favourites'], [worksheet, worksheet_1, worksheet_3, worksheet_2])
+                self.assertEqual(context['favourites'], set())
                 self.assertEqual(context['next_url'], None)
                 self.assertEqual(context['prev_url'], url_for('worksheets.worksheets_page', category=2, author=None, page=0))
                 logout_learner(c)
@@ -545,7 +567,7 @@ class DatabaseTests(TestCase):
                 template, context = templates[1]
                 self.assertEqual(context['worksheets'], [worksheet_3, worksheet_2, worksheet_1, worksheet])
                 self.assertEqual(context['categories'], [w_cat, w_cat_1, w_cat_2])
-                self.assertEqual(context['favourites'], [worksheet, worksheet_1, worksheet_3, worksheet_2])
+                self.assertEqual(context['favourites'], {worksheet.id, worksheet_1.id, worksheet_3.id, worksheet_2.id})
                 self.assertEqual(context['next_url'], None)
                 self.assertEqual(context['prev_url'], url_for('worksheets.worksheets_page', author=None, category=None, page=0))
                 logout_learner(c)
@@ -558,8 +580,8 @@ class DatabaseTests(TestCase):
                 self.assertEqual(context['worksheets'], [])
                 self.assertEqual(context['categories'], [w_cat, w_cat_1, w_cat_2])
                 self.assertEqual(context['next_url'], None)
-                self.assertEqual(context['favourites'], [worksheet, worksheet_1, worksheet_3, worksheet_2])
-                self.assertEqual(context['prev_url'], url_for('worksheets.worksheets_page', author=None, category=None, page=1))
+                self.assertEqual(context['favourites'], set())
+                self.assertEqual(context['prev_url'], url_for('worksheets.worksheets_page', author=None, category=None, page=0))
                 logout_learner(c)
 
         with self.app.test_client() as c:
@@ -569,8 +591,8 @@ class DatabaseTests(TestCase):
                 template, context = templates[1]
                 self.assertEqual(context['worksheets'], [worksheet_12, worksheet_11, worksheet_10, worksheet_9, worksheet_8, worksheet_7, worksheet_6, worksheet_5, worksheet_4])
                 self.assertEqual(context['categories'], [w_cat, w_cat_1, w_cat_2])
-                self.assertEqual(context['favourites'], [worksheet, worksheet_1, worksheet_3, worksheet_2])
-                self.assertEqual(context['next_url'], url_for('worksheets.worksheets_page', author=None, category=None, page=1))
+                self.assertEqual(context['favourites'], set())
+                self.assertEqual(context['next_url'], url_for('worksheets.worksheets_page', author=None, category=None, after=worksheet_4.id))
                 self.assertEqual(context['prev_url'], None)
                 logout_learner(c)
 
@@ -592,12 +614,48 @@ class DatabaseTests(TestCase):
                 template, context = templates[1]
                 self.assertEqual(context['worksheets'], [worksheet_11, worksheet_5, worksheet_1, worksheet])
                 self.assertEqual(context['categories'], [w_cat, w_cat_1, w_cat_2])
-                self.assertEqual(context['favourites'], [worksheet, worksheet_1, worksheet_3, worksheet_2, worksheet_14])
+                self.assertEqual(context['favourites'], {worksheet.id, worksheet_1.id})
                 self.assertEqual(context['next_url'], None)
                 self.assertEqual(context['prev_url'], None)
                 logout_learner(c)
                 
                 
+    def test_worksheet_page_statement_count(self) :
+        w_cat = WorksheetCategory(name='dundk')
+        db.session.add(w_cat)
+        db.session.commit()
+        w_cat_id = w_cat.id
+
+        # every worksheet has its own author so a lazy load would be a query per card
+        def add_worksheets(start, number) :
+            for i in range(start, start + number) :
+                author = Author(name='author' + str(i), email='author' + str(i) + '@gmail.com', screenname='screen' + str(i), password='pbkdf2:sha256:150000$73fMtgAp$1a1d8be4973cb2676c5f17275c43dc08583c8e450c94a282f9c443d34f72464c')
+                db.session.add(author)
+                db.session.add(Worksheet(pdf_url='w' + str(i) + '.pdf', name='worksheet' + str(i), author=author, category_id=w_cat_id))
+            db.session.commit()
+            db.session.expunge_all()
+
+        def count_statements(url) :
+            # warm up what each worker keeps in memory (like the categories)
+            self.client.get(url)
+
+            db.session.expunge_all()
+            with captured_statements() as statements:
+                r = self.client.get(url)
+                self.assertEqual(r.status_code, 200)
+            return len(statements)
+
+        add_worksheets(0, 2)
+        few = {url : count_statements(url) for url in ['/', '/worksheets_page', '/specific_worksheet/1']}
+
+        add_worksheets(2, 12)
+        many = {url : count_statements(url) for url in ['/', '/worksheets_page', '/specific_worksheet/1']}
+
+        self.assertEqual(few, many)
+
+        r = self.client.get('/worksheets_page')
+        self.assertIn(b'More by the author: screen13', r.data)
+
     def test_worksheet_count_page(self):
         w_cat = WorksheetCategory(name='dundk')
         db.session.add(w_cat)
@@ -655,6 +713,9 @@ class DatabaseEditTests(TestCase):
         db.session.remove()
         db.drop_all()
         self.app_context.pop()
+
+        shutil.rmtree('pdfs', ignore_errors=True)
+        shutil.rmtree('thumbs', ignore_errors=True)
     
     def test_delete_worksheet_page_author(self):
         w_cat = WorksheetCategory(name='dundk')
@@ -780,7 +841,7 @@ class DatabaseEditTests(TestCase):
 
         logout_author(self.client)
 
-        self.assertEqual(True, os.path.exists('test.pdf'))
+        self.assertEqual(True, os.path.exists(stored_pdf(b"abcdef")))
 
         worksheet = Worksheet.query.filter_by(name='trig').first()
 
@@ -803,10 +864,10 @@ class DatabaseEditTests(TestCase):
         self.assertEqual(worksheet_1, None)
 
         worksheet_2 = Worksheet.query.filter_by(name='trig').first()
-        self.assertEqual(worksheet_2.pdf_url, 'test.pdf')
+        self.assertEqual(worksheet_2.pdf_url, stored_pdf(b"abcdef"))
 
-        self.assertEqual(True, os.path.exists('test.pdf'))
-        self.assertEqual(False, os.path.exists('test_1.pdf'))
+        self.assertEqual(True, os.path.exists(stored_pdf(b"abcdef")))
+        self.assertEqual(False, os.path.exists(stored_pdf(b"abcd234ef")))
 
         #
         # Now with user logged in
@@ -828,12 +889,14 @@ class DatabaseEditTests(TestCase):
         self.assertNotEqual(worksheet_1, None)
 
         worksheet_2 = Worksheet.query.filter_by(name='trig').first()
-        self.assertEqual(worksheet_1.pdf_url, 'test_1.pdf')
+        self.assertEqual(worksheet_1.pdf_url, stored_pdf(b"abcd234ef"))
+        self.assertEqual(worksheet_1.sha256, hashlib.sha256(b"abcd234ef").hexdigest())
+        self.assertEqual(worksheet_1.size, 9)
 
         self.assertEqual(worksheet_2, None)
 
-        self.assertEqual(False, os.path.exists('test.pdf'))
-        self.assertEqual(True, os.path.exists('test_1.pdf'))
+        self.assertEqual(False, os.path.exists(stored_pdf(b"abcdef")))
+        self.assertEqual(True, os.path.exists(stored_pdf(b"abcd234ef")))
 
         #
         # Now not editing the pdf itself
@@ -847,11 +910,11 @@ class DatabaseEditTests(TestCase):
 
         self.assertNotEqual(worksheet_2, None)
 
-        self.assertEqual(True, os.path.exists('test_1.pdf'))
+        self.assertEqual(True, os.path.exists(stored_pdf(b"abcd234ef")))
 
         logout_author(self.client)
 
-        os.remove('test_1.pdf')
+        os.remove(stored_pdf(b"abcd234ef"))
 
     def test_add_worksheet_page_author_li(self):
         w_cat = WorksheetCategory(name='Math')
@@ -881,8 +944,9 @@ class DatabaseEditTests(TestCase):
         self.assertEqual(response_1.status_code, 200)
 
         self.assertNotEqual(worksheet, None)
+        self.assertEqual(worksheet.pdf_url, stored_pdf(b"abcdef"))
 
-        os.remove('test.pdf')
+        os.remove(stored_pdf(b"abcdef"))
 
         logout_author(self.client)
         
@@ -1008,6 +1072,283 @@ class DatabaseModelsTests(TestCase):
 
 
 
+class BufferedCountConfiguration(TestConfiguration):
+    DOWNLOAD_COUNT_FLUSH_INTERVAL = 0.01
+
+
+class DownloadCounterTests(TestCase):
+    def create_app(self):
+        app = c_app(BufferedCountConfiguration)
+        return app
+
+    # executed prior to each test
+    def setUp(self):
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+
+        w_cat = WorksheetCategory(name='dundk')
+        db.session.add(w_cat)
+
+        auth_1 = Author(name='Kidkaidf', email='kodyrogers21@gmail.com', password='pbkdf2:sha256:150000$73fMtgAp$1a1d8be4973cb2676c5f17275c43dc08583c8e450c94a282f9c443d34f72464c')
+        db.session.add(auth_1)
+
+        worksheet = Worksheet(pdf_url='tudolsoos.pdf', name='tudoloods', author=auth_1, category=w_cat)
+        db.session.add(worksheet)
+        db.session.commit()
+
+        self.worksheet_id = worksheet.id
+
+    # executed after each test
+    def tearDown(self):
+        download_counter.flush()
+
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def count(self):
+        db.session.expire_all()
+        return Worksheet.query.get(self.worksheet_id).count
+
+    def test_count_page_is_buffered(self):
+        self.app.extensions['download_counter'].interval = 3600
+
+        for i in range(3) :
+            response = self.client.get('/worksheets_count/' + str(self.worksheet_id), follow_redirects=False)
+            self.assertEqual(response.status_code, 302)
+
+        self.assertEqual(self.count(), 0)
+        self.assertEqual(download_counter.pending(self.worksheet_id), 3)
+
+        self.assertEqual(download_counter.flush(), 3)
+        self.assertEqual(self.count(), 3)
+        self.assertEqual(download_counter.pending(self.worksheet_id), 0)
+
+    def test_no_views_lost_under_concurrency(self):
+        # the background thread flushes every 0.01 seconds while the views come in
+        def view() :
+            with self.app.app_context() :
+                for i in range(250) :
+                    download_counter.increment(self.worksheet_id)
+
+        threads = [threading.Thread(target=view) for i in range(8)]
+        for thread in threads :
+            thread.start()
+        for thread in threads :
+            thread.join()
+
+        download_counter.flush()
+
+        self.assertEqual(self.count(), 2000)
+
+    def test_failed_flush_keeps_views(self):
+        self.app.extensions['download_counter'].interval = 3600
+
+        download_counter.increment(self.worksheet_id, 5)
+
+        Worksheet.__table__.drop(db.engine)
+        with self.assertRaises(Exception) :
+            download_counter.flush()
+        Worksheet.__table__.create(db.engine)
+
+        self.assertEqual(download_counter.pending(self.worksheet_id), 5)
+
+class PdfDeliveryTests(TestCase):
+    def create_app(self):
+        app = c_app(TestConfiguration)
+        return app
+
+    # executed prior to each test
+    def setUp(self):
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+
+        with open('delivery_test.pdf', 'wb') as f :
+            f.write(b'%PDF-1.4 not much of a worksheet')
+
+        with open('delivery_test.txt', 'wb') as f :
+            f.write(b'not a pdf')
+
+    # executed after each test
+    def tearDown(self):
+        os.remove('delivery_test.pdf')
+        os.remove('delivery_test.txt')
+
+        self.app_context.pop()
+
+    def test_flask_sends_file(self):
+        response = self.client.get('/uploads/delivery_test.pdf')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.mimetype, 'application/pdf')
+        self.assertEqual(response.data, b'%PDF-1.4 not much of a worksheet')
+        response.close()
+
+        response = self.client.get('/uploads/delivery_test.pdf', headers={'Range' : 'bytes=0-3'})
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response.data, b'%PDF')
+        self.assertEqual(response.headers['Content-Range'], 'bytes 0-3/32')
+        response.close()
+
+    def test_accel_redirect(self):
+        self.app.config['PDF_DELIVERY'] = 'accel'
+
+        response = self.client.get('/uploads/delivery_test.pdf')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.headers['X-Accel-Redirect'], '/protected_uploads/delivery_test.pdf')
+        self.assertEqual(response.mimetype, 'application/pdf')
+        self.assertEqual(response.data, b'')
+
+    def test_sendfile(self):
+        self.app.config['PDF_DELIVERY'] = 'sendfile'
+
+        response = self.client.get('/uploads/delivery_test.pdf')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.headers['X-Sendfile'], os.path.join(self.app.config['UPLOAD_FOLDER'], 'delivery_test.pdf'))
+        self.assertEqual(response.data, b'')
+
+    def test_only_uploaded_pdfs(self):
+        for mode in ['flask', 'accel', 'sendfile'] :
+            self.app.config['PDF_DELIVERY'] = mode
+
+            for url in ['/uploads/missing.pdf', '/uploads/delivery_test.txt', '/uploads/..%2Fdelivery_test.pdf'] :
+                with captured_templates(self.app) as templates:
+                    response = self.client.get(url)
+                    self.assertEqual(len(templates), 1)
+                    template, context = templates[0]
+                    self.assertEqual(template.name, 'error_templates/404.html.j2')
+                    self.assertNotIn('X-Accel-Redirect', response.headers)
+                    self.assertNotIn('X-Sendfile', response.headers)
+
+class WorksheetPdfTests(TestCase):
+    def create_app(self):
+        app = c_app(TestConfiguration)
+        return app
+
+    # executed prior to each test
+    def setUp(self):
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+
+        self.content = b'%PDF-1.4 0123456789 the rest of the worksheet'
+        with open('pdf_route_test.pdf', 'wb') as f :
+            f.write(self.content)
+        self.sha256 = hashlib.sha256(self.content).hexdigest()
+
+        w_cat = WorksheetCategory(name='dundk')
+        db.session.add(w_cat)
+
+        auth_1 = Author(name='Kidkaidf', email='kodyrogers21@gmail.com', password='pbkdf2:sha256:150000$73fMtgAp$1a1d8be4973cb2676c5f17275c43dc08583c8e450c94a282f9c443d34f72464c')
+        db.session.add(auth_1)
+
+        db.session.add(Worksheet(pdf_url='pdf_route_test.pdf', name='tudoloods', author=auth_1, category=w_cat))
+        db.session.commit()
+
+    # executed after each test
+    def tearDown(self):
+        os.remove('pdf_route_test.pdf')
+
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def get(self, url, **headers):
+        response = self.client.get(url, headers=headers)
+        data = response.data
+        response.close()
+        return response, data
+
+    def test_whole_pdf(self):
+        response, data = self.get('/worksheet_pdf/1')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(data, self.content)
+        self.assertEqual(response.mimetype, 'application/pdf')
+        self.assertEqual(response.headers['ETag'], '"' + self.sha256 + '"')
+        self.assertIn('no-cache', response.headers['Cache-Control'])
+        self.assertNotIn('immutable', response.headers['Cache-Control'])
+        self.assertIn('Last-Modified', response.headers)
+
+        response, data = self.get('/worksheet_pdf/2')
+        self.assertIn(b'that page does not exist', data)
+
+    def test_partial_content(self):
+        response, data = self.get('/worksheet_pdf/1', Range='bytes=9-18')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(data, b'0123456789')
+        self.assertEqual(response.headers['Content-Range'], 'bytes 9-18/' + str(len(self.content)))
+        self.assertEqual(response.headers['Content-Length'], '10')
+
+        response, data = self.get('/worksheet_pdf/1', Range='bytes=-5')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(data, self.content[-5:])
+
+        response, data = self.get('/worksheet_pdf/1', Range='bytes=1000-')
+        self.assertEqual(response.status_code, 416)
+
+    def test_if_range(self):
+        response, data = self.get('/worksheet_pdf/1', Range='bytes=0-3', **{'If-Range' : '"' + self.sha256 + '"'})
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(data, b'%PDF')
+
+        # the file changed since the viewer started so it gets the whole thing
+        response, data = self.get('/worksheet_pdf/1', Range='bytes=0-3', **{'If-Range' : '"something old"'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(data, self.content)
+
+    def test_revalidation(self):
+        response, data = self.get('/worksheet_pdf/1', **{'If-None-Match' : '"' + self.sha256 + '"'})
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(data, b'')
+
+        response, data = self.get('/worksheet_pdf/1', **{'If-None-Match' : '"something old"'})
+        self.assertEqual(response.status_code, 200)
+
+        last_modified = self.get('/worksheet_pdf/1')[0].headers['Last-Modified']
+        response, data = self.get('/worksheet_pdf/1', **{'If-Modified-Since' : last_modified})
+        self.assertEqual(response.status_code, 304)
+
+        # replacing the file changes the ETag
+        time.sleep(0.01)
+        with open('pdf_route_test.pdf', 'wb') as f :
+            f.write(b'%PDF-1.4 a new version')
+        response, data = self.get('/worksheet_pdf/1', **{'If-None-Match' : '"' + self.sha256 + '"'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.headers['ETag'], '"' + hashlib.sha256(b'%PDF-1.4 a new version').hexdigest() + '"')
+
+    def test_content_addressed_url_is_immutable(self):
+        response, data = self.get('/worksheet_pdf/1?v=' + self.sha256)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('immutable', response.headers['Cache-Control'])
+        self.assertIn('max-age=31536000', response.headers['Cache-Control'])
+
+        response, data = self.get('/worksheet_pdf/1?v=' + self.sha256, Range='bytes=0-3')
+        self.assertEqual(response.status_code, 206)
+        self.assertIn('immutable', response.headers['Cache-Control'])
+
+        # an old hash is not trusted
+        response, data = self.get('/worksheet_pdf/1?v=abc')
+        self.assertIn('no-cache', response.headers['Cache-Control'])
+        self.assertNotIn('immutable', response.headers['Cache-Control'])
+
+    def test_front_end_server_revalidation(self):
+        self.app.config['PDF_DELIVERY'] = 'accel'
+
+        response, data = self.get('/worksheet_pdf/1')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.headers['ETag'], '"' + self.sha256 + '"')
+        self.assertEqual(response.headers['X-Accel-Redirect'], '/protected_uploads/pdf_route_test.pdf')
+
+        response, data = self.get('/worksheet_pdf/1', **{'If-None-Match' : '"' + self.sha256 + '"'})
+        self.assertEqual(response.status_code, 304)
+        self.assertNotIn('X-Accel-Redirect', response.headers)
+
+    def test_count_redirects_to_pdf(self):
+        response = self.client.get('/worksheets_count/1', follow_redirects=False)
+        self.assertEqual(response.status_code, 302)
+        self.assertTrue(response.location.endswith('/worksheet_pdf/1'))
+
+
 if __name__ == "__main__":
     unittest.main()
     
\ No newline at end of file